@@ -0,0 +1,215 @@
+import contextlib
+import os
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from episuite import icu
+from episuite.mobility import google
+from tests.conftest import cache_dir  # noqa: F401
+
+# Number of rows of the synthetic datasets, it can be changed
+# with the environment variable EPISUITE_BENCH_ROWS
+BENCH_ROWS: int = int(os.environ.get("EPISUITE_BENCH_ROWS", 500_000))
+
+# Number of patients of the synthetic admissions and line lists, it can
+# be changed with the environment variable EPISUITE_BENCH_PATIENTS, i.e.
+# "1000,100000,10000000" for scales up to tens of millions of patients
+BENCH_PATIENTS: List[int] = [
+    int(value) for value in
+    os.environ.get("EPISUITE_BENCH_PATIENTS", "1000,10000").split(",")
+]
+
+# Extra values recorded by the benchmarks, by name and benchmark,
+# which are shown in the terminal summary, see record_extra()
+EXTRA_SUMMARY: Dict[str, Dict[str, float]] = {}
+
+
+def record_extra(benchmark: Any, name: str, value: float) -> None:
+    """Record a value in the extra info of the benchmark, which is saved
+    with the results, and show it in the terminal summary."""
+    benchmark.extra_info[name] = value
+    EXTRA_SUMMARY.setdefault(name, {})[benchmark.name] = value
+
+
+def record_peak_memory(benchmark: Any, func: Callable, *args: Any,
+                       **kwargs: Any) -> Any:
+    """Run the function once while tracing the memory allocations and
+    record the peak memory (MiB) in the extra info of the benchmark,
+    which is saved with the results. Only the allocations of the current
+    process are traced, not the ones of worker processes."""
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    record_extra(benchmark, "peak_memory_mb", peak / 2 ** 20)
+    return result
+
+
+class StagePeakMemoryStats(icu.SimulationStats):
+    """Simulation stats that also keep the peak traced memory (bytes) of
+    each stage, the allocations must be traced (tracemalloc) while the
+    stages run in the current process."""
+    def __init__(self) -> None:
+        super().__init__()
+        self.peaks: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[Dict[str, int]]:
+        # Clearing the traces also resets the peak, so the peak only
+        # has the memory allocated by the stage
+        tracemalloc.clear_traces()
+        with super().stage(stage) as counters:
+            yield counters
+        _, peak = tracemalloc.get_traced_memory()
+        self.peaks[stage] = max(self.peaks.get(stage, 0), peak)
+
+
+def record_stage_peak_memory(benchmark: Any, func: Callable, *args: Any,
+                             **kwargs: Any) -> Any:
+    """Run the function once with the stats argument, while tracing the
+    memory allocations, and record the peak memory (MiB) of each stage
+    of the simulation as "peak_memory_mb[stage]", see
+    :class:`StagePeakMemoryStats`."""
+    stats = StagePeakMemoryStats()
+    tracemalloc.start()
+    try:
+        result = func(*args, stats=stats, **kwargs)
+    finally:
+        tracemalloc.stop()
+    for stage, peak in stats.peaks.items():
+        record_extra(benchmark, f"peak_memory_mb[{stage}]", peak / 2 ** 20)
+    return result
+
+
+def record_worker_peak_memory(benchmark: Any, stats: icu.SimulationStats) -> None:
+    """Record the largest peak resident memory (MiB) of the worker
+    processes that ran the rounds of a profiled simulation, see
+    :class:`episuite.icu.SimulationStats`."""
+    df_stats = stats.to_dataframe()
+    max_rss = df_stats[df_stats.worker != os.getpid()].max_rss.dropna()
+    if len(max_rss) > 0:
+        record_extra(benchmark, "worker_peak_rss_mb", max_rss.max() / 2 ** 20)
+
+
+def pytest_terminal_summary(terminalreporter: Any) -> None:
+    for name, values in EXTRA_SUMMARY.items():
+        terminalreporter.section(name)
+        width = max(len(benchmark_name) for benchmark_name in values)
+        for benchmark_name, value in sorted(values.items()):
+            terminalreporter.write_line(f"{benchmark_name:<{width}} {value:>12.3f}")
+
+
+def synthetic_admissions(num_patients: int, num_days: int = 365,
+                         seed: int = 0) -> pd.Series:
+    """Generate a synthetic epidemic curve of daily admissions with
+    a total of `num_patients` admissions."""
+    rng = np.random.default_rng(seed)
+    days = np.arange(num_days)
+    curve = np.exp(-0.5 * ((days - num_days / 2) / (num_days / 8)) ** 2)
+    counts = rng.multinomial(num_patients, curve / curve.sum())
+    return pd.Series(counts, index=pd.date_range("2020-03-01", periods=num_days))
+
+
+def synthetic_trajectories(admissions: pd.Series, num_trajectories: int,
+                           num_days: int = 60, seed: int = 0) -> pd.DataFrame:
+    """Generate synthetic admission forecast trajectories after the last
+    date of the admissions, from the mean of the last week of admissions
+    with a random exponential growth rate for each trajectory."""
+    rng = np.random.default_rng(seed)
+    level = admissions.values[-7:].mean() + 1.0
+    growth = rng.normal(0.0, 0.03, (num_trajectories, 1))
+    rates = level * np.exp(growth * np.arange(1, num_days + 1))
+    dates = pd.date_range(admissions.index[-1] + pd.Timedelta(days=1), periods=num_days)
+    return pd.DataFrame(rng.poisson(rates), columns=dates)
+
+
+def synthetic_line_list(num_patients: int, num_days: int = 365,
+                        seed: int = 0) -> pd.DataFrame:
+    """Generate a synthetic line list of ICU stays with the columns of
+    :func:`episuite.data.admissions_sample`, with gamma distributed
+    lengths of stay."""
+    rng = np.random.default_rng(seed)
+    admissions = synthetic_admissions(num_patients, num_days, seed)
+    date_start = np.repeat(admissions.index.values, admissions.values)
+    los = rng.gamma(2.0, 5.0, num_patients).astype(np.int64)
+    return pd.DataFrame({
+        "DATE_START": date_start,
+        "DATE_END": date_start + los.astype("timedelta64[D]"),
+        "OUTCOME": rng.choice(["RECOVERY", "DEATH"], num_patients, p=[0.6, 0.4]),
+    })
+
+
+def synthetic_google_report(rows: int, num_countries: int = 100,
+                            seed: int = 0) -> pd.DataFrame:
+    """Generate a synthetic Google Community Mobility Report."""
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"{chr(65 + i // 26)}{chr(65 + i % 26)}"
+                      for i in range(num_countries)])
+    dates = pd.date_range("2020-02-15", periods=500).strftime("%Y-%m-%d")
+    df = pd.DataFrame({
+        "country_region_code": np.sort(rng.choice(codes, rows)),
+        "country_region": "Country",
+        "sub_region_1": rng.choice(["", "Region A", "Region B"], rows),
+        "sub_region_2": "",
+        "metro_area": "",
+        "iso_3166_2_code": "",
+        "census_fips_code": "",
+        "place_id": "ChIJ",
+        "date": rng.choice(dates, rows),
+    })
+    for category in google.GoogleMobility.MOBILITY_CATEGORIES:
+        values = rng.integers(-100, 100, rows).astype(np.float64)
+        values[rng.random(rows) < 0.1] = np.nan
+        df[f"{category}_percent_change_from_baseline"] = values
+    return df
+
+
+def synthetic_movement_range(rows: int, num_countries: int = 100,
+                             seed: int = 0) -> pd.DataFrame:
+    """Generate a synthetic Facebook Movement Range dataset."""
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"C{i:02d}" for i in range(num_countries)])
+    dates = pd.date_range("2020-03-01", periods=500).strftime("%Y-%m-%d")
+    return pd.DataFrame({
+        "ds": rng.choice(dates, rows),
+        "country": np.sort(rng.choice(codes, rows)),
+        "polygon_source": "GADM",
+        "polygon_id": rng.choice(["A.1_1", "A.2_1", "A.3_1"], rows),
+        "polygon_name": rng.choice(["Polygon A", "Polygon B"], rows),
+        "all_day_bing_tiles_visited_relative_change": rng.normal(size=rows),
+        "all_day_ratio_single_tile_users": rng.random(rows),
+        "baseline_name": "full_february",
+        "baseline_type": "DAY_OF_WEEK",
+    })
+
+
+@pytest.fixture
+def google_report(cache_dir: Path) -> Path:  # noqa: F811
+    """Place a synthetic report in the cache directory."""
+    fname = cache_dir / google.GoogleMobility.REPORT_FILENAME
+    synthetic_google_report(BENCH_ROWS).to_csv(fname, index=False)
+    return fname
+
+
+@pytest.fixture
+def movement_range_zip(cache_dir: Path) -> Path:  # noqa: F811
+    """Place a synthetic movement range zip in the cache directory."""
+    fname = cache_dir / "movement-range-data-2021-01-01.zip"
+    content = synthetic_movement_range(BENCH_ROWS).to_csv(sep="\t", index=False)
+    with zipfile.ZipFile(fname, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("movement-range-2021-01-01.txt", content)
+    return fname
+
+
+@pytest.fixture(params=BENCH_PATIENTS, ids=lambda value: f"patients={value}")
+def num_patients(request: Any) -> int:
+    """The scales (number of patients) of the synthetic data."""
+    return request.param
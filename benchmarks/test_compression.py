@@ -0,0 +1,62 @@
+import shutil
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+
+from episuite import data
+from episuite.mobility import google
+
+COMPRESSIONS = [None, "gzip", "zstd"]
+
+
+def stored_report(google_report: Path, compression: Optional[str]) -> Path:
+    if compression is None:
+        return google_report
+    extension = data.COMPRESSION_EXTENSIONS[compression]
+    return data.compress_file(google_report,
+                              google_report.with_name(google_report.name + extension),
+                              compression)
+
+
+def skip_missing(compression: Optional[str]) -> None:
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+
+class TestCacheCompression:
+    @pytest.mark.parametrize("compression", ["gzip", "zstd"])
+    def test_compress(self, benchmark: Any, google_report: Path,
+                      compression: str) -> None:
+        skip_missing(compression)
+        target = google_report.with_name("compressed")
+        benchmark(data.compress_file, google_report, target, compression)
+        benchmark.extra_info["size_mb"] = target.stat().st_size / 2 ** 20
+        benchmark.extra_info["ratio"] = google_report.stat().st_size / target.stat().st_size
+
+    @pytest.mark.parametrize("compression", COMPRESSIONS)
+    def test_read_csv(self, benchmark: Any, google_report: Path,
+                      compression: Optional[str]) -> None:
+        skip_missing(compression)
+        fname = stored_report(google_report, compression)
+        benchmark.extra_info["size_mb"] = fname.stat().st_size / 2 ** 20
+        df = benchmark(data.read_csv_filtered, fname,
+                       {"country_region_code": ["AA", "BB"]},
+                       parse_dates=["date"], engine="c")
+        assert len(df) > 0
+
+    @pytest.mark.parametrize("compression", COMPRESSIONS)
+    def test_columnar_conversion(self, benchmark: Any, google_report: Path,
+                                 compression: Optional[str]) -> None:
+        pytest.importorskip("pyarrow")
+        skip_missing(compression)
+        fname = stored_report(google_report, compression)
+        dataset_dir = fname.with_name("dataset.parquet")
+
+        def setup() -> None:
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+
+        benchmark.pedantic(data.csv_to_partitioned_parquet,
+                           args=(fname, dataset_dir, "country_region_code",
+                                 google.GoogleMobility.column_types()),
+                           setup=setup, rounds=3)
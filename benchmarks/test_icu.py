@@ -0,0 +1,168 @@
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.conftest import (record_peak_memory, record_stage_peak_memory,
+                                 record_worker_peak_memory,
+                                 synthetic_admissions, synthetic_line_list,
+                                 synthetic_trajectories)
+from episuite import backtest, distributions, durations, icu
+
+# The simulation stages are slow at larger scales, so they
+# use a fixed number of rounds instead of the calibration
+ROUNDS: int = 3
+
+
+@pytest.fixture
+def line_list(num_patients: int) -> pd.DataFrame:
+    return synthetic_line_list(num_patients)
+
+
+@pytest.fixture
+def simulation(num_patients: int, line_list: pd.DataFrame) -> icu.ICUSimulation:
+    admissions = icu.ICUAdmissions(synthetic_admissions(num_patients))
+    bootstrap = durations.Durations(line_list).get_bootstrap()
+    return icu.ICUSimulation(admissions, bootstrap)
+
+
+class TestDurations:
+    def test_durations(self, benchmark: Any, line_list: pd.DataFrame) -> None:
+        benchmark(durations.Durations, line_list)
+        record_peak_memory(benchmark, durations.Durations, line_list)
+
+    def test_bootstrap_sample(self, benchmark: Any, line_list: pd.DataFrame) -> None:
+        bootstrap = durations.Durations(line_list).get_bootstrap()
+        samples = benchmark(bootstrap.sample, len(line_list))
+        record_peak_memory(benchmark, bootstrap.sample, len(line_list))
+        assert len(samples) == len(line_list)
+
+    def test_census(self, benchmark: Any, line_list: pd.DataFrame) -> None:
+        dur = durations.Durations(line_list)
+        census = benchmark(dur.get_census)
+        record_peak_memory(benchmark, dur.get_census)
+        assert census.sum() == dur.get_stay_distribution().sum()
+
+    def test_bootstrap_cached(self, benchmark: Any, line_list: pd.DataFrame,
+                              tmp_path: Any) -> None:
+        cache = durations.DurationsCache(tmp_path)
+        cache.get_bootstrap(line_list)
+        bootstrap = benchmark(cache.get_bootstrap, line_list)
+        assert len(bootstrap.samples) == len(line_list)
+
+
+class TestICUSimulation:
+    def test_simulation_round(self, benchmark: Any,
+                              simulation: icu.ICUSimulation) -> None:
+        benchmark.pedantic(simulation.simulation_round, rounds=ROUNDS)
+        record_peak_memory(benchmark, simulation.simulation_round)
+        record_stage_peak_memory(benchmark, simulation.simulation_round)
+
+    def test_simulate(self, benchmark: Any, simulation: icu.ICUSimulation) -> None:
+        results = benchmark.pedantic(simulation.simulate, args=(4,),
+                                     kwargs={"show_progress": False, "max_workers": 2},
+                                     rounds=ROUNDS)
+        record_peak_memory(benchmark, simulation.simulate, 4,
+                           show_progress=False, max_workers=2)
+        profiled = simulation.simulate(4, show_progress=False, max_workers=2, profile=True)
+        record_worker_peak_memory(benchmark, profiled.get_stats())
+        assert results.get_simulation_results().shape[1] == 4
+
+    def test_simulate_ensemble(self, benchmark: Any, num_patients: int,
+                               line_list: pd.DataFrame) -> None:
+        # Admissions up to the peak of the epidemic and a forecast
+        # trajectory for each iteration after it
+        s_admissions = synthetic_admissions(num_patients)[:180]
+        trajectories = synthetic_trajectories(s_admissions, 200)
+        bootstrap = durations.Durations(line_list).get_bootstrap()
+        simulation = icu.ICUSimulation(icu.ICUAdmissions(s_admissions), bootstrap, trajectories)
+        results = benchmark.pedantic(simulation.simulate_ensemble, rounds=ROUNDS)
+        record_peak_memory(benchmark, simulation.simulate_ensemble)
+        assert results.get_simulation_results().shape[1] == 200
+
+
+class TestICUSimulationResults:
+    @pytest.mark.parametrize("iterations", [100, 1000])
+    def test_hdi(self, benchmark: Any, simulation: icu.ICUSimulation,
+                 num_patients: int, iterations: int) -> None:
+        rng = np.random.default_rng(0)
+        index = pd.date_range("2020-03-01", periods=400)
+        occupancy = rng.poisson(num_patients / 40, (len(index), iterations))
+        results = icu.ICUSimulationResults(simulation, pd.DataFrame(occupancy, index=index))
+        # The HDI is cached, so the cache is cleared before each round
+        df_hdi = benchmark.pedantic(results.hdi, setup=results.invalidate_cache,
+                                    rounds=ROUNDS)
+        results.invalidate_cache()
+        record_peak_memory(benchmark, results.hdi)
+        assert len(df_hdi) == len(index)
+
+    def test_hdi_cached(self, benchmark: Any, simulation: icu.ICUSimulation,
+                        num_patients: int) -> None:
+        rng = np.random.default_rng(0)
+        index = pd.date_range("2020-03-01", periods=400)
+        occupancy = rng.poisson(num_patients / 40, (len(index), 1000))
+        results = icu.ICUSimulationResults(simulation, pd.DataFrame(occupancy, index=index))
+        results.hdi()
+        df_hdi = benchmark(results.hdi)
+        assert len(df_hdi) == len(index)
+
+    @pytest.mark.parametrize("mode", ["lines", "density"])
+    def test_trajectories(self, benchmark: Any, simulation: icu.ICUSimulation,
+                          num_patients: int, mode: str) -> None:
+        from matplotlib import pyplot as plt
+
+        rng = np.random.default_rng(0)
+        index = pd.date_range("2020-03-01", periods=400)
+        occupancy = rng.poisson(num_patients / 40, (len(index), 5000))
+        results = icu.ICUSimulationResults(simulation, pd.DataFrame(occupancy, index=index))
+        results.hdi()
+
+        def draw() -> None:
+            results.plot.trajectories(mode)
+            plt.gcf().canvas.draw()
+            plt.close()
+
+        benchmark.pedantic(draw, rounds=ROUNDS)
+
+
+class TestMultiHospitalSimulation:
+    @pytest.mark.parametrize("num_hospitals", [10, 100])
+    def test_simulate(self, benchmark: Any, num_patients: int,
+                      line_list: pd.DataFrame, num_hospitals: int) -> None:
+        admissions = pd.concat({f"h{i}": synthetic_admissions(num_patients // num_hospitals, seed=i)
+                                for i in range(num_hospitals)}, axis=1)
+        bootstrap = durations.Durations(line_list).get_bootstrap()
+        simulation = icu.MultiHospitalSimulation(admissions, bootstrap)
+        results = benchmark.pedantic(simulation.simulate, args=(100,), rounds=ROUNDS)
+        record_peak_memory(benchmark, simulation.simulate, 100)
+        assert results.get_occupancy_array().shape[:2] == (num_hospitals, 100)
+
+
+class TestPathwaySimulation:
+    def test_simulate(self, benchmark: Any, num_patients: int,
+                      line_list: pd.DataFrame) -> None:
+        icu_durations = durations.Durations(line_list).get_bootstrap_by("OUTCOME")
+        ward_durations = distributions.EmpiricalBootstrap([1, 2, 2, 3, 5, 8])
+        stages = {
+            "ward": icu.PathwayStage(ward_durations, {"icu": {"DEATH": 0.7, "RECOVERY": 0.3}}),
+            "icu": icu.PathwayStage(icu_durations, {"step-down": {"RECOVERY": 0.9}}),
+            "step-down": icu.PathwayStage(ward_durations),
+        }
+        outcomes = line_list.OUTCOME.value_counts(normalize=True)
+        simulation = icu.PathwaySimulation(icu.ICUAdmissions(synthetic_admissions(num_patients)),
+                                           stages, outcomes)
+        results = benchmark.pedantic(simulation.simulate, args=(100,), rounds=ROUNDS)
+        record_peak_memory(benchmark, simulation.simulate, 100)
+        assert results.get_occupancy_array().shape[:2] == (3, 100)
+
+
+class TestBacktest:
+    def test_backtest(self, benchmark: Any, line_list: pd.DataFrame) -> None:
+        dur = durations.Durations(line_list)
+        cutoffs = pd.date_range("2020-05-01", periods=20, freq="7D")
+        results = benchmark.pedantic(backtest.backtest, args=(dur, cutoffs),
+                                     kwargs={"horizon": 14, "iterations": 100, "seed": 0,
+                                             "max_workers": 2, "show_progress": False},
+                                     rounds=ROUNDS)
+        assert len(results.metrics()) == 14
@@ -0,0 +1,82 @@
+import datetime
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+import pytest
+
+from episuite.mobility import facebook, google
+
+COUNTRIES = ["AA", "BB", "CC"]
+
+
+def legacy_chunked_filter(fpath: Path, country_code: str) -> pd.DataFrame:
+    """The chunked filtering used by the loaders before the ingestion layer."""
+    iter_csv = pd.read_csv(fpath, low_memory=False, parse_dates=["date"],
+                           iterator=True, chunksize=5000)
+    return pd.concat([chunk[chunk["country_region_code"] == country_code]
+                      for chunk in iter_csv])
+
+
+class TestGoogleMobility:
+    def test_legacy_chunks(self, benchmark: Any, google_report: Path) -> None:
+        df = benchmark(legacy_chunked_filter, google_report, "AA")
+        assert len(df) > 0
+
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_csv(self, benchmark: Any, google_report: Path, engine: str) -> None:
+        if engine == "pyarrow":
+            pytest.importorskip("pyarrow")
+        client = google.GoogleMobility()
+        df = benchmark(client.load_report, COUNTRIES, show_progress=False,
+                       columnar=False, engine=engine)
+        assert len(df) > 0
+
+    def test_columnar_conversion(self, benchmark: Any, google_report: Path) -> None:
+        pytest.importorskip("pyarrow")
+        client = google.GoogleMobility()
+        dataset_dir = google_report.with_name(client.DATASET_DIRNAME)
+
+        def setup() -> None:
+            if (dataset_dir / "_source.json").exists():
+                (dataset_dir / "_source.json").unlink()
+
+        benchmark.pedantic(client.load_report, args=(COUNTRIES,),
+                           kwargs={"show_progress": False},
+                           setup=setup, rounds=3)
+
+    def test_columnar(self, benchmark: Any, google_report: Path) -> None:
+        pytest.importorskip("pyarrow")
+        client = google.GoogleMobility()
+        client.load_report(COUNTRIES, show_progress=False)
+        df = benchmark(client.load_report, COUNTRIES, show_progress=False)
+        assert len(df) > 0
+
+
+class TestFacebookMovementRange:
+    @pytest.fixture
+    def client(self, movement_range_zip: Path,
+               monkeypatch: pytest.MonkeyPatch) -> facebook.FacebookMovementRange:
+        resource = facebook.MovementRangeResource(datetime.date(2021, 1, 1),
+                                                  "http://localhost/unused.zip",
+                                                  movement_range_zip.name)
+        client = facebook.FacebookMovementRange()
+        monkeypatch.setattr(client, "_get_last_date_available", lambda: resource)
+        return client
+
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_csv(self, benchmark: Any, client: facebook.FacebookMovementRange,
+                 engine: str) -> None:
+        if engine == "pyarrow":
+            pytest.importorskip("pyarrow")
+        df = benchmark(client.load_movement_range, ["C01", "C02"],
+                       show_progress=False, engine=engine, columnar=False)
+        assert len(df) > 0
+
+    def test_columnar(self, benchmark: Any,
+                      client: facebook.FacebookMovementRange) -> None:
+        pytest.importorskip("pyarrow")
+        client.load_movement_range(["C01", "C02"], show_progress=False)
+        df = benchmark(client.load_movement_range, ["C01", "C02"],
+                       show_progress=False)
+        assert len(df) > 0
@@ -0,0 +1,70 @@
+import time
+from typing import Any, Callable
+
+import pandas as pd
+import pytest
+
+from benchmarks.conftest import (record_extra, synthetic_admissions,
+                                 synthetic_line_list)
+from episuite import distributions, durations, icu
+
+# Target standard error (in number of patients) of the
+# mean and of the HDI bounds of the occupancy of each date
+TOLERANCE: float = 1.0
+MAX_ITERATIONS: int = 1024
+
+# Maximum cost of drawing the uniforms with Sobol relative to random,
+# building the scrambled engine once per number of patients
+MAX_SOBOL_COST: float = 10.0
+
+
+def best_time(func: Callable[[], Any], repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+class TestVarianceReduction:
+    @pytest.fixture
+    def simulation(self) -> icu.ICUSimulation:
+        admissions = icu.ICUAdmissions(synthetic_admissions(300, num_days=60))
+        line_list = synthetic_line_list(300, num_days=60)
+        return icu.ICUSimulation(admissions, durations.Durations(line_list).get_bootstrap())
+
+    @pytest.mark.parametrize("sampling", ["random", "antithetic", "sobol"])
+    def test_iterations_to_precision(self, benchmark: Any, simulation: icu.ICUSimulation,
+                                     sampling: str) -> None:
+        """The number of iterations needed to reach the target precision
+        is recorded as "iterations" in the summary and results."""
+        results = benchmark.pedantic(simulation.simulate_adaptive,
+                                     kwargs={"tolerance": TOLERANCE, "batch_size": 64,
+                                             "max_iterations": MAX_ITERATIONS,
+                                             "show_progress": False, "backend": "serial",
+                                             "sampling": sampling, "seed": 0},
+                                     rounds=1)
+        precision = results.get_precision()
+        record_extra(benchmark, "iterations", precision.iterations)
+        record_extra(benchmark, "max_mcse", precision.max_error())
+        assert isinstance(results.get_simulation_results(), pd.DataFrame)
+
+    @pytest.mark.parametrize("draws", ["rounds", "batch"])
+    def test_sobol_cost(self, benchmark: Any, draws: str) -> None:
+        """The cost of the Sobol uniforms of 1024 rounds of 2000 patients,
+        each round at a time (as in simulate) or in a batch (as in
+        simulate_ensemble), is recorded relative to random sampling as
+        "cost_vs_random" in the summary and results."""
+        def draw(method: str) -> Any:
+            # A new sampler, so the engine is built in every call
+            sampler = distributions.DurationSampler(method, seed=0)
+            if draws == "batch":
+                return sampler.batch_uniforms(2000, 0, 1024)
+            return [sampler.uniforms(2000, round_index) for round_index in range(1024)]
+
+        draw("sobol")
+        cost = best_time(lambda: draw("sobol")) / best_time(lambda: draw("random"))
+        benchmark.pedantic(draw, args=("sobol",), rounds=3)
+        record_extra(benchmark, "cost_vs_random", cost)
+        assert cost < MAX_SOBOL_COST
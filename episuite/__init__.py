@@ -1,6 +1,23 @@
+import importlib
+from types import ModuleType
+from typing import List
+
 __version__ = "0.4.0"
 __appname__ = "Episuite"
 __author__ = "Christian S. Perone"
 
-from episuite import durations  # noqa: F401
-from episuite import icu  # noqa: F401
+# The submodules are imported on first access (i.e. episuite.icu), so
+# that importing the package doesn't import the plotting and scientific
+# stacks when they aren't used.
+_SUBMODULES = ("backtest", "cli", "data", "distributions", "durations",
+               "executors", "icu", "mobility", "prevalence")
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(list(globals()) + list(_SUBMODULES))
@@ -0,0 +1,173 @@
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from episuite.distributions import (DurationDistribution, DurationSampler,
+                                    EmpiricalBootstrap)
+from episuite.durations import Durations
+from episuite.executors import ExecutionBackend, get_backend
+from episuite.icu import ICUAdmissions, ICUSimulation
+
+# A function returning the admission trajectories of the forecast dates
+# (trajectories x dates) from the admissions observed up to the cutoff
+AdmissionForecaster = Callable[[pd.Series, pd.DatetimeIndex], pd.DataFrame]
+
+
+class BacktestResults:
+    """This class holds the forecasts of a backtest, see :func:`backtest`,
+    with one row for each cutoff and horizon (in days after the cutoff),
+    with the observed census and the HDI of the simulated occupancy.
+
+    :param forecasts: the forecasts dataframe
+    """
+    def __init__(self, forecasts: pd.DataFrame):
+        self.forecasts = forecasts
+
+    def get_forecasts(self) -> pd.DataFrame:
+        """Returns the dataframe with the forecasts."""
+        return self.forecasts
+
+    def metrics(self) -> pd.DataFrame:
+        """Returns the metrics of each horizon over the cutoffs: the
+        coverage of the 95% and 50% intervals (the fraction of the
+        observed census inside the interval), the mean width of the 95%
+        interval, and the bias, mean absolute error and root mean squared
+        error of the mean occupancy. The dates without an observed census
+        are ignored."""
+        df = self.forecasts.dropna(subset=["observed"])
+        error = df.mean_val - df.observed
+        df = df.assign(
+            inside95=(df.observed >= df.lb95) & (df.observed <= df.ub95),
+            inside50=(df.observed >= df.lb50) & (df.observed <= df.ub50),
+            width95=df.ub95 - df.lb95,
+            error=error,
+            abs_error=error.abs(),
+            squared_error=error ** 2,
+        )
+        metrics = df.groupby("horizon").agg(
+            cutoffs=("cutoff", "nunique"),
+            coverage_95=("inside95", "mean"),
+            coverage_50=("inside50", "mean"),
+            width_95=("width95", "mean"),
+            bias=("error", "mean"),
+            mae=("abs_error", "mean"),
+            rmse=("squared_error", "mean"),
+        )
+        metrics["rmse"] = np.sqrt(metrics["rmse"])
+        return metrics
+
+    def __repr__(self) -> str:
+        cutoffs = self.forecasts.cutoff.nunique()
+        horizon = self.forecasts.horizon.max()
+        return f"BacktestResults[Cutoffs={cutoffs}, Horizon={horizon}]"
+
+
+def _simulate_cutoff(cutoff: pd.Timestamp, s_admissions: pd.Series,
+                     duration_distribution: DurationDistribution,
+                     trajectories: Optional[pd.DataFrame], iterations: int,
+                     sampling: Optional[Union[str, DurationSampler]],
+                     seed: Optional[int]) -> Tuple[pd.Timestamp, pd.DataFrame]:
+    simulation = ICUSimulation(ICUAdmissions(s_admissions), duration_distribution,
+                               trajectories)
+    results = simulation.simulate_ensemble(iterations, sampling=sampling, seed=seed)
+    return cutoff, results.hdi()
+
+
+def _ended_stays(durations: Durations) -> Tuple[np.ndarray, np.ndarray]:
+    df = durations.get_dataframe()
+    ends = pd.to_datetime(df[durations.column_end]).dt.normalize().values
+    order = np.argsort(ends, kind="stable")
+    return ends[order], df[Durations.COLUMN_STAY_DURATION].values[order]
+
+
+def backtest(durations: Durations, cutoffs: Sequence[Union[str, pd.Timestamp]],
+             horizon: int = 14,
+             iterations: int = 100,
+             duration_distribution: Optional[DurationDistribution] = None,
+             admission_forecaster: Optional[AdmissionForecaster] = None,
+             sampling: Optional[Union[str, DurationSampler]] = None,
+             seed: Optional[int] = None,
+             backend: Optional[Union[str, ExecutionBackend]] = None,
+             max_workers: Optional[int] = None,
+             show_progress: bool = True) -> BacktestResults:
+    """Rolling-origin backtest of the ICU simulation. For each cutoff date,
+    the occupancy of the next days is simulated from the admissions up to
+    the cutoff (see :meth:`episuite.icu.ICUSimulation.simulate_ensemble`)
+    and compared to the observed census of the line list (see
+    :meth:`episuite.durations.Durations.get_census`). The simulations
+    of the cutoffs run in parallel on the execution backend.
+
+    :param durations: the line list, with the admissions and the stays
+    :param cutoffs: the last dates of the observed admissions
+    :param horizon: number of days forecast after each cutoff
+    :param iterations: number of simulation rounds of each cutoff
+    :param duration_distribution: the duration distribution, used for all
+                                  the cutoffs. By default, the bootstrap of
+                                  each cutoff is fitted only on the stays
+                                  ended up to the cutoff, so the stays known
+                                  later don't leak into the forecast. A
+                                  distribution fitted on the whole line list
+                                  leaks them and the metrics are optimistic.
+    :param admission_forecaster: a function returning the admission
+                                 trajectories (a dataframe with one row
+                                 for each trajectory and one column for
+                                 each date) of the forecast dates from
+                                 the admissions up to the cutoff. Without
+                                 it, the observed admissions after the
+                                 cutoff are used, so only the occupancy
+                                 simulation is evaluated.
+    :param sampling: the sampling of the durations, see
+                     :meth:`episuite.icu.ICUSimulation.simulate`
+    :param seed: the seed of the sampling
+    :param backend: the execution backend or its name, see
+                    :mod:`episuite.executors`
+    :param max_workers: the number of workers of a backend created by name
+    :param show_progress: show the progress of the cutoffs
+    :returns: the backtest results
+    """
+    from tqdm.auto import tqdm
+
+    if duration_distribution is None:
+        # The stays sorted by the end date, the stays ended up
+        # to each cutoff are a prefix of them
+        sorted_ends, sorted_stays = _ended_stays(durations)
+    s_admissions = durations.get_admissions()
+    s_census = durations.get_census()
+
+    tasks: List[Tuple[Any, ...]] = []
+    for cutoff in pd.DatetimeIndex(cutoffs).normalize():
+        if cutoff < s_admissions.index[0]:
+            raise ValueError(f"Cutoff {cutoff.date()} before the first admission.")
+        forecast_dates = pd.date_range(cutoff + pd.Timedelta(days=1), periods=horizon)
+        history = s_admissions[:cutoff]
+        trajectories = None
+        if admission_forecaster is None:
+            history = s_admissions[:forecast_dates[-1]]
+        else:
+            trajectories = admission_forecaster(history, forecast_dates)
+        cutoff_distribution = duration_distribution
+        if cutoff_distribution is None:
+            num_ended = np.searchsorted(sorted_ends, cutoff.to_datetime64(), side="right")
+            if num_ended == 0:
+                raise ValueError(f"No stays ended up to the cutoff {cutoff.date()}.")
+            cutoff_distribution = EmpiricalBootstrap(sorted_stays[:num_ended])
+        tasks.append((cutoff, history, cutoff_distribution, trajectories,
+                      iterations, sampling, seed))
+
+    forecasts = []
+    executor = get_backend(backend, max_workers)
+    with tqdm(total=len(tasks), desc="Backtest", disable=not show_progress) as pbar:
+        for cutoff, df_hdi in executor.run(_simulate_cutoff, tasks):
+            df_hdi["horizon"] = (df_hdi.date - cutoff).dt.days
+            df_hdi = df_hdi[(df_hdi.horizon >= 1) & (df_hdi.horizon <= horizon)]
+            df_hdi.insert(0, "cutoff", cutoff)
+            forecasts.append(df_hdi)
+            pbar.update()
+
+    df_forecasts = pd.concat(forecasts, ignore_index=True)
+    df_forecasts = df_forecasts.sort_values(["cutoff", "horizon"], ignore_index=True)
+    df_forecasts["observed"] = s_census.reindex(df_forecasts.date).values
+    columns = ["cutoff", "horizon", "date", "observed", "lb95", "ub95",
+               "lb50", "ub50", "mean_val", "median_val"]
+    return BacktestResults(df_forecasts[columns])
@@ -0,0 +1,292 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Sequence
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# The heavy modules (pandas, numpy and the simulation) are imported only
+# when a command runs, so the help and argument errors are fast.
+
+
+class SimulationOptions(NamedTuple):
+    """The options shared by the jobs of a batch simulation."""
+    output_dir: Path
+    output_format: str
+    iterations: int
+    capacities: List[float]
+    sampling: Optional[str]
+    seed: Optional[int]
+    date_column: str
+    count_column: str
+    column_start: str
+    column_end: str
+    cache_durations: bool = False
+
+
+class SimulationJob(NamedTuple):
+    """A simulation of the admissions of a file, with the durations
+    from a line list."""
+    name: str
+    admissions: Path
+    line_list: Path
+
+
+class JobResult(NamedTuple):
+    """The outcome of a job, with the wall time of each stage and the
+    files written, or the error message when the job failed."""
+    name: str
+    seconds: Dict[str, float]
+    outputs: List[str]
+    error: Optional[str] = None
+
+
+def read_admissions(path: Path, date_column: str, count_column: str) -> 'pd.Series':
+    """Read the admissions from a CSV file, as the number of admissions
+    of each date. When the file doesn't have the count column, each row
+    is an admission (i.e. a line list). The dates without admissions
+    are filled with zero.
+
+    :param path: the CSV file
+    :param date_column: the column with the admission date
+    :param count_column: the column with the number of admissions
+    :returns: a series with the admissions of each date
+    """
+    import pandas as pd
+    df = pd.read_csv(path)
+    dates = pd.to_datetime(df[date_column]).dt.normalize()
+    if count_column in df.columns:
+        s_admissions = df[count_column].groupby(dates).sum()
+    else:
+        s_admissions = dates.groupby(dates).size()
+    return s_admissions.sort_index().resample("D").sum()
+
+
+def write_table(df: 'pd.DataFrame', path: Path, output_format: str) -> Path:
+    """Write a dataframe as CSV or Parquet, into a temporary file that
+    is then renamed, so readers never see a partial file.
+
+    :param df: the dataframe
+    :param path: the output file, without the extension
+    :param output_format: "csv" or "parquet"
+    :returns: the output file
+    """
+    path = path.with_suffix(f".{output_format}")
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    os.close(fd)
+    try:
+        if output_format == "parquet":
+            df.to_parquet(tmp_name, index=False)
+        else:
+            df.to_csv(tmp_name, index=False)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink()
+        raise
+    return path
+
+
+def _run_simulation(job: SimulationJob, options: SimulationOptions,
+                    seconds: Dict[str, float]) -> List[str]:
+    import pandas as pd
+
+    from episuite import durations, icu
+
+    start = time.perf_counter()
+    s_admissions = read_admissions(job.admissions, options.date_column,
+                                   options.count_column)
+    df_line_list = pd.read_csv(job.line_list,
+                               parse_dates=[options.column_start, options.column_end])
+    if options.cache_durations:
+        bootstrap = durations.DurationsCache().get_bootstrap(
+            df_line_list, options.column_start, options.column_end)
+    else:
+        bootstrap = durations.Durations(df_line_list, options.column_start,
+                                        options.column_end).get_bootstrap()
+    seconds["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    simulation = icu.ICUSimulation(icu.ICUAdmissions(s_admissions), bootstrap)
+    results = simulation.simulate(options.iterations, show_progress=False,
+                                  backend="serial", sampling=options.sampling,
+                                  seed=options.seed)
+    seconds["simulate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outputs = [write_table(results.hdi(), options.output_dir / f"{job.name}_hdi",
+                           options.output_format)]
+    if options.capacities:
+        df_exceedance = results.exceedance_probability(options.capacities)
+        df_exceedance.columns = [f"capacity_{capacity:g}" for capacity in df_exceedance.columns]
+        df_exceedance = df_exceedance.rename_axis("date").reset_index()
+        outputs.append(write_table(df_exceedance,
+                                   options.output_dir / f"{job.name}_exceedance",
+                                   options.output_format))
+    seconds["write"] = time.perf_counter() - start
+    return [str(output) for output in outputs]
+
+
+def run_job(job: SimulationJob, options: SimulationOptions) -> JobResult:
+    """Run the simulation of a job and write its summaries, the HDI
+    table and the exceedance probabilities of the capacities. The rounds
+    of the simulation run serially, the jobs are run in parallel. An
+    error in a job is returned instead of raised, so the other jobs of
+    the batch aren't interrupted.
+
+    :param job: the job
+    :param options: the options of the batch
+    :returns: the result of the job
+    """
+    seconds: Dict[str, float] = {}
+    try:
+        outputs = _run_simulation(job, options, seconds)
+    except Exception as exc:
+        return JobResult(job.name, seconds, [], f"{type(exc).__name__}: {exc}")
+    return JobResult(job.name, seconds, outputs)
+
+
+def make_jobs(admissions: Sequence[str], line_lists: Sequence[str]) -> List[SimulationJob]:
+    """Pair the admissions files with the line lists, a single line list
+    is used for all the admissions. The job names (used for the output
+    files) are the names of the admissions files without the extension.
+
+    :param admissions: the admissions files
+    :param line_lists: one line list, or one for each admissions file
+    :returns: the jobs
+    """
+    if len(line_lists) not in (1, len(admissions)):
+        raise ValueError(f"Expected 1 or {len(admissions)} line lists, "
+                         f"got {len(line_lists)}.")
+    if len(line_lists) == 1:
+        line_lists = list(line_lists) * len(admissions)
+    names = [Path(path).stem for path in admissions]
+    duplicated = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicated:
+        raise ValueError(f"Admissions files with the same name: {duplicated}.")
+    return [SimulationJob(name, Path(path), Path(line_list))
+            for name, path, line_list in zip(names, admissions, line_lists)]
+
+
+def _report(results: List[JobResult], elapsed: float,
+            options: SimulationOptions) -> None:
+    import pandas as pd
+    df_report = pd.DataFrame([{
+        "job": result.name,
+        **{f"{stage}_seconds": value for stage, value in result.seconds.items()},
+        "error": result.error,
+    } for result in results])
+    write_table(df_report, options.output_dir / "report", options.output_format)
+
+    failed = sum(result.error is not None for result in results)
+    job_seconds = [sum(result.seconds.values()) for result in results]
+    print(f"{len(results)} jobs ({failed} failed) in {elapsed:.2f}s, "
+          f"{sum(job_seconds) / max(len(results), 1):.2f}s per job, "
+          f"{len(results) / max(elapsed, 1e-9):.2f} jobs/s", file=sys.stderr)
+    for stage in ("read", "simulate", "write"):
+        total = sum(result.seconds.get(stage, 0.0) for result in results)
+        print(f"  {stage:<10} {total:>10.2f}s", file=sys.stderr)
+
+
+def icu_simulate(args: argparse.Namespace) -> int:
+    """Run the ``icu-simulate`` command, the jobs run on a single pool of
+    workers and the progress is reported as each job finishes.
+
+    :param args: the parsed arguments
+    :returns: the exit code, 1 if any job failed
+    """
+    from episuite.executors import persistent_backend
+
+    jobs = make_jobs(args.admissions, args.line_list)
+    options = SimulationOptions(
+        output_dir=Path(args.output_dir), output_format=args.format,
+        iterations=args.iterations, capacities=args.capacity or [],
+        sampling=args.sampling, seed=args.seed,
+        date_column=args.date_column, count_column=args.count_column,
+        column_start=args.column_start, column_end=args.column_end,
+        cache_durations=args.cache_durations)
+    options.output_dir.mkdir(parents=True, exist_ok=True)
+
+    results: List[JobResult] = []
+    start = time.perf_counter()
+    with persistent_backend(args.backend, args.workers) as backend:
+        for result in backend.run(run_job, [(job, options) for job in jobs]):
+            results.append(result)
+            status = "failed: " + result.error if result.error else "ok"
+            print(f"[{len(results)}/{len(jobs)}] {result.name} "
+                  f"{sum(result.seconds.values()):.2f}s {status}", file=sys.stderr)
+    _report(results, time.perf_counter() - start, options)
+    return int(any(result.error is not None for result in results))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Returns the parser of the command-line arguments."""
+    parser = argparse.ArgumentParser(prog="episuite",
+                                     description="A suite of tools for epidemiology.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    simulate = subparsers.add_parser(
+        "icu-simulate", help="ICU occupancy simulation of many admissions files.",
+        description="Simulate the ICU occupancy of many admissions files and write "
+                    "the HDI and exceedance probabilities of each file.")
+    simulate.add_argument("--admissions", nargs="+", required=True,
+                          help="admissions CSV files")
+    simulate.add_argument("--line-list", nargs="+", required=True,
+                          help="line list CSV files with the durations, "
+                               "one for all or one for each admissions file")
+    simulate.add_argument("--output-dir", required=True, help="output directory")
+    simulate.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                          help="output format (parquet requires pyarrow)")
+    simulate.add_argument("--iterations", type=int, default=100,
+                          help="number of simulation rounds")
+    simulate.add_argument("--capacity", type=float, nargs="+",
+                          help="capacities of the exceedance probabilities")
+    simulate.add_argument("--sampling", choices=["random", "antithetic", "sobol"],
+                          help="sampling of the durations")
+    simulate.add_argument("--seed", type=int, help="seed of the sampling")
+    simulate.add_argument("--backend", default="processes",
+                          help="execution backend of the jobs")
+    simulate.add_argument("--workers", type=int, help="number of workers")
+    simulate.add_argument("--date-column", default="DATE",
+                          help="date column of the admissions")
+    simulate.add_argument("--count-column", default="ADMISSIONS",
+                          help="count column of the admissions, without it "
+                               "each row is an admission")
+    simulate.add_argument("--column-start", default="DATE_START",
+                          help="start column of the line list")
+    simulate.add_argument("--column-end", default="DATE_END",
+                          help="end column of the line list")
+    simulate.add_argument("--cache-durations", action="store_true",
+                          help="memoize the duration distribution of the line "
+                               "lists in the episuite cache directory")
+    simulate.set_defaults(func=icu_simulate)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """The ``episuite`` console entry point, i.e.::
+
+        episuite icu-simulate --admissions admissions/*.csv \\
+            --line-list line_list.csv --capacity 50 100 --output-dir results
+
+    :param argv: the arguments, default to the process arguments
+    :returns: the exit code
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "format", None) == "parquet":
+        from episuite.data import has_pyarrow
+        if not has_pyarrow():
+            parser.error("the parquet format requires pyarrow.")
+    try:
+        return args.func(args)
+    except ValueError as exc:
+        parser.error(str(exc))
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
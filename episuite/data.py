@@ -1,14 +1,41 @@
+import concurrent.futures
+import contextlib
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
 from pathlib import Path
-from typing import BinaryIO, Optional, Union
+from typing import (IO, Any, BinaryIO, Callable, Dict, Iterator, List, Mapping,
+                    Optional, Sequence, Union)
 
+import numpy as np
 import pandas as pd
-import pkg_resources
 import requests
 from appdirs import AppDirs
+from requests.adapters import HTTPAdapter
 from tqdm.auto import tqdm
 
 import episuite
 
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+DEFAULT_CHUNK_SIZE: int = 1024 * 1024
+SESSION_POOL_SIZE: int = 16
+SOURCE_SIGNATURE_FILENAME: str = "_source.json"
+COMPRESSION_EXTENSIONS: Dict[str, str] = {"gzip": ".gz", "zstd": ".zst"}
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
 
 def get_cache_dir_file(filename: Optional[Union[str, Path]] = None) -> Path:
     dirs = AppDirs(episuite.__appname__,
@@ -21,45 +48,835 @@ def get_cache_dir_file(filename: Optional[Union[str, Path]] = None) -> Path:
     return cache_dir
 
 
-def load_from_cache(url: str, filename: Union[str, Path],
-                    desc: Optional[str] = None,
-                    show_progress: bool = True,
-                    invalidate: bool = False) -> Path:
-    cache_dir = get_cache_dir_file()
-    filename_output = cache_dir / Path(filename)
+def compress_file(source: Union[str, Path], target: Union[str, Path],
+                  compression: str,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> Path:
+    """Compress a file in a streaming manner. The "zstd" compression
+    requires the optional zstandard dependency. The compressed file can
+    be read directly by pandas, which infers the compression from the
+    file extension (see :data:`COMPRESSION_EXTENSIONS`).
 
-    # Already exists in the cache
-    if filename_output.exists():
-        if invalidate:
-            filename_output.unlink()
+    :param source: the file to compress
+    :param target: the compressed output file
+    :param compression: "gzip" or "zstd"
+    :param chunk_size: size in bytes of the chunks read from the source
+    :returns: the compressed file
+    """
+    target = Path(target)
+    ftarget: Any
+    with contextlib.ExitStack() as stack:
+        fsource = stack.enter_context(open(source, "rb"))
+        if compression == "gzip":
+            ftarget = stack.enter_context(gzip.open(target, "wb", compresslevel=6))
+        elif compression == "zstd":
+            import zstandard
+            compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+            ftarget = stack.enter_context(
+                compressor.stream_writer(open(target, "wb")))
         else:
-            return filename_output
+            raise ValueError(f"Unknown compression {compression}, "
+                             f"use one of {list(COMPRESSION_EXTENSIONS)}.")
+        shutil.copyfileobj(fsource, ftarget, chunk_size)
+    return target
 
-    with filename_output.open(mode="wb") as fhandle:
-        download_remote(url, fhandle, desc, show_progress)
 
-    return filename_output
+def _lock_fd(fd: int, blocking: bool) -> bool:
+    # An exclusive lock of the first byte of the file, polled until
+    # it is acquired when blocking
+    while True:
+        try:
+            if sys.platform == "win32":
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.01)
 
 
-def download_remote(url: str, stream: BinaryIO,
+def _unlock_fd(fd: int) -> None:
+    if sys.platform == "win32":
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _file_lock(lock_file: Path, blocking: bool = True) -> Iterator[bool]:
+    # An exclusive lock between processes and threads, held on a lock
+    # file that is removed on release. The operating system releases the
+    # lock of a process that dies, so a crash never leaves a stale lock.
+    # Yields whether the lock was acquired, always True when blocking.
+    while True:
+        fd = os.open(lock_file, os.O_RDWR | os.O_CREAT)
+        if not _lock_fd(fd, blocking):
+            os.close(fd)
+            yield False
+            return
+        try:
+            # The lock file may have been removed by the previous holder
+            # between the open and the lock, then the lock is taken again
+            if os.path.samestat(os.fstat(fd), os.stat(lock_file)):
+                break
+        except FileNotFoundError:
+            pass
+        _unlock_fd(fd)
+        os.close(fd)
+    try:
+        yield True
+    finally:
+        try:
+            os.unlink(lock_file)
+        except OSError:
+            pass
+        _unlock_fd(fd)
+        os.close(fd)
+
+
+class CacheManager:
+    """This class manages the files downloaded into the cache directory.
+    Downloads are written into a partial file that is atomically
+    renamed into the final cache file, so an interrupted download never
+    leaves a truncated file behind and it is resumed in the next call.
+    The partial file is locked while it is downloaded, a concurrent
+    download of the same entry uses a temporary file instead.
+    The metadata of each entry (url, ETag, Last-Modified, size and access
+    times) is recorded in an index file, which is used to revalidate
+    stale entries with conditional requests and to evict the least
+    recently used entries when the cache grows beyond the size limit.
+    The index is updated under a lock file, so processes sharing the
+    cache directory don't lose each other's entries. The entries can be
+    optionally stored compressed.
+
+    :param cache_dir: the cache directory, default to the
+                      episuite cache directory.
+    :param max_size: maximum size of the cache in bytes, no limit
+                     by default.
+    :param chunk_size: size in bytes of the chunks written to the
+                       cache, see :func:`download_file`.
+    :param max_segments: maximum number of parallel segments of each
+                         download, see :func:`download_file`.
+    :param compression: compression of the new entries, "gzip", "zstd"
+                        or None (default) for no compression. The
+                        compression extension is appended to the name
+                        of the stored file, see :func:`compress_file`.
+    """
+    INDEX_FILENAME: str = "cache_index.json"
+    INDEX_LOCK_FILENAME: str = ".cache_index.json.lock"
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None,
+                 max_size: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_segments: int = 4,
+                 compression: Optional[str] = None):
+        if compression is not None and compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unknown compression {compression}, "
+                             f"use one of {list(COMPRESSION_EXTENSIONS)}.")
+        self.cache_dir = Path(cache_dir) if cache_dir is not None \
+            else get_cache_dir_file()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.max_segments = max_segments
+        self.compression = compression
+        self.index_file = self.cache_dir / self.INDEX_FILENAME
+        self.index_lock_file = self.cache_dir / self.INDEX_LOCK_FILENAME
+
+    def read_index(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the index with the metadata of each cache entry."""
+        if not self.index_file.exists():
+            return {}
+        try:
+            with self.index_file.open("r", encoding="utf-8") as fhandle:
+                index: Dict[str, Dict[str, Any]] = json.load(fhandle)
+        except ValueError:
+            # A corrupted index only loses the metadata, the
+            # entries are adopted again when accessed
+            return {}
+        return index
+
+    def _write_index(self, index: Dict[str, Dict[str, Any]]) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix=f".{self.INDEX_FILENAME}.",
+                                        suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as fhandle:
+            json.dump(index, fhandle, indent=2)
+        os.replace(tmp_name, self.index_file)
+
+    def _entry_path(self, key: str, entry: Optional[Dict[str, Any]]) -> Path:
+        if entry is not None:
+            return self.cache_dir / entry.get("path", key)
+        extension = COMPRESSION_EXTENSIONS.get(self.compression or "", "")
+        return self.cache_dir / f"{key}{extension}"
+
+    def _is_fresh(self, entry: Dict[str, Any], ttl: Optional[float]) -> bool:
+        # Without a TTL in the call, the TTL stored with the entry is used
+        if ttl is None:
+            ttl = entry.get("ttl")
+        if ttl is None:
+            return True
+        return time.time() - entry["fetched_at"] < ttl
+
+    def _store(self, partial_output: Path, filename_output: Path,
+               compression: Optional[str]) -> None:
+        if compression is not None:
+            compressed_output = partial_output.with_name(
+                partial_output.name + COMPRESSION_EXTENSIONS[compression])
+            try:
+                compress_file(partial_output, compressed_output,
+                              compression, self.chunk_size)
+            except BaseException:
+                if compressed_output.exists():
+                    compressed_output.unlink()
+                raise
+            partial_output.unlink()
+            partial_output = compressed_output
+        os.replace(partial_output, filename_output)
+
+    def _download(self, url: str, filename_output: Path,
+                  entry: Optional[Dict[str, Any]],
+                  compression: Optional[str],
+                  desc: Optional[str], show_progress: bool) -> Dict[str, Any]:
+        headers: Dict[str, str] = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        # The partial download is kept between calls to be resumed by the
+        # process holding its lock, while another process downloading the
+        # same entry at the same time uses a temporary file of its own
+        partial_output = self.cache_dir / f".{filename_output.name}.part"
+        lock_file = partial_output.with_name(partial_output.name + ".lock")
+        with _file_lock(lock_file, blocking=False) as locked:
+            if locked:
+                return self._fetch(url, partial_output, filename_output, entry,
+                                   compression, headers, desc, show_progress)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix=f".{filename_output.name}.",
+                                        suffix=".part")
+        os.close(fd)
+        try:
+            return self._fetch(url, Path(tmp_name), filename_output, entry,
+                               compression, headers, desc, show_progress)
+        finally:
+            remove_partial_download(tmp_name)
+
+    def _fetch(self, url: str, partial_output: Path, filename_output: Path,
+               entry: Optional[Dict[str, Any]], compression: Optional[str],
+               headers: Dict[str, str], desc: Optional[str],
+               show_progress: bool) -> Dict[str, Any]:
+        try:
+            resp = download_file(url, partial_output, desc, show_progress,
+                                 headers=headers,
+                                 chunk_size=self.chunk_size,
+                                 max_segments=self.max_segments)
+        except requests.HTTPError:
+            remove_partial_download(partial_output)
+            raise
+
+        if resp.status_code == requests.codes.not_modified \
+                and entry is not None:
+            remove_partial_download(partial_output)
+            entry["fetched_at"] = time.time()
+            return entry
+
+        self._store(partial_output, filename_output, compression)
+        return {
+            "url": url,
+            "path": filename_output.name,
+            "compression": compression,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "size": filename_output.stat().st_size,
+            "fetched_at": time.time(),
+        }
+
+    def get(self, url: str, filename: Union[str, Path],
+            desc: Optional[str] = None,
+            show_progress: bool = True,
+            invalidate: bool = False,
+            ttl: Optional[float] = None) -> Path:
+        """Returns the cached file, downloading it when it is not in the
+        cache yet. When the entry is older than the TTL, it is revalidated
+        with the server using a conditional request and downloaded again
+        only if it has changed.
+
+        :param url: the url to download from
+        :param filename: the file name inside the cache directory
+        :param desc: progress bar description
+        :param show_progress: whether to show progress or not
+        :param invalidate: if the entry should be removed and downloaded again
+        :param ttl: time-to-live in seconds of the entry, it is stored
+                    with the entry and used by the calls without a TTL.
+                    The entry never expires by default.
+        :returns: the path of the cached file, with the compression
+                  extension when the entry is compressed
+        """
+        key = str(filename)
+        entry = self.read_index().get(key)
+        if ttl is None and entry is not None:
+            ttl = entry.get("ttl")
+
+        if invalidate:
+            self._remove_entry_file(key, entry)
+            entry = None
+
+        filename_output = self._entry_path(key, entry)
+        if entry is None and (self.cache_dir / key).exists():
+            # Files cached without the index are adopted
+            filename_output = self.cache_dir / key
+            stat = filename_output.stat()
+            entry = {"url": url, "path": key, "etag": None,
+                     "last_modified": None, "size": stat.st_size,
+                     "fetched_at": stat.st_mtime}
+        elif entry is not None and not filename_output.exists():
+            entry = None
+            filename_output = self._entry_path(key, None)
+
+        if entry is None or not self._is_fresh(entry, ttl):
+            compression = entry.get("compression") if entry is not None \
+                else self.compression
+            entry = self._download(url, filename_output, entry,
+                                   compression, desc, show_progress)
+
+        entry["ttl"] = ttl
+        entry["last_access"] = time.time()
+        # The index is read again under the lock, with the entries
+        # written by other processes since the first read
+        with _file_lock(self.index_lock_file):
+            index = self.read_index()
+            index[key] = entry
+            index = self._evict(index, keep=key)
+            self._write_index(index)
+        return filename_output
+
+    def _remove_entry_file(self, key: str,
+                           entry: Optional[Dict[str, Any]]) -> None:
+        for fname in {self._entry_path(key, entry), self.cache_dir / key}:
+            if fname.exists():
+                fname.unlink()
+
+    def _evict(self, index: Dict[str, Dict[str, Any]],
+               keep: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        if self.max_size is None:
+            return index
+        total_size = sum(entry["size"] for entry in index.values())
+        lru_keys = sorted(index, key=lambda k: index[k]["last_access"])
+        for key in lru_keys:
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            entry = index.pop(key)
+            self._remove_entry_file(key, entry)
+            total_size -= entry["size"]
+        return index
+
+    def remove(self, filename: Union[str, Path]) -> None:
+        """Remove an entry from the cache.
+
+        :param filename: the file name inside the cache directory
+        """
+        with _file_lock(self.index_lock_file):
+            index = self.read_index()
+            entry = index.pop(str(filename), None)
+            self._remove_entry_file(str(filename), entry)
+            self._write_index(index)
+
+
+def load_from_cache(url: str, filename: Union[str, Path],
                     desc: Optional[str] = None,
-                    show_progress: bool = True) -> None:
-    """This function will download data frmo a remote URL and
-    will optionally show the progress.
+                    show_progress: bool = True,
+                    invalidate: bool = False,
+                    ttl: Optional[float] = None,
+                    max_size: Optional[int] = None,
+                    compression: Optional[str] = None) -> Path:
+    """Download a file into the cache directory or return the cached
+    file if it was already downloaded, see :class:`CacheManager`.
 
     :param url: the url to download from
-    :param stream: buffered IO object
+    :param filename: the file name inside the cache directory
     :param desc: progress bar description
     :param show_progress: whether to show progress or not
+    :param invalidate: if the cached file should be downloaded again
+    :param ttl: time-to-live in seconds of the entry, default to the
+                TTL stored with the entry, which never expires without one
+    :param max_size: maximum size of the cache in bytes
+    :param compression: compression of the stored file, "gzip", "zstd"
+                        or None for no compression
+    :returns: the path of the cached file
     """
-    resp = requests.get(url, stream=True)
+    cache = CacheManager(max_size=max_size, compression=compression)
+    return cache.get(url, filename, desc, show_progress,
+                     invalidate=invalidate, ttl=ttl)
+
+
+def get_session() -> requests.Session:
+    """Returns the session shared by the downloads, which keeps a pool of
+    connections alive between the requests and threads."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=SESSION_POOL_SIZE,
+                                  pool_maxsize=SESSION_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSION = session
+    return _SESSION
+
+
+def _write_response(resp: requests.Response, stream: BinaryIO,
+                    desc: Optional[str], show_progress: bool,
+                    chunk_size: int) -> None:
     content_length = resp.headers.get('content-length', 0)
     total = int(content_length)
+    written = 0
     with tqdm(desc=desc, total=total, unit='iB', unit_scale=True,
               unit_divisor=1024, disable=not show_progress) as bar:
-        for data in resp.iter_content(chunk_size=1024):
+        for data in resp.iter_content(chunk_size=chunk_size):
             size = stream.write(data)
+            written += size
             bar.update(size)
+    if total > 0 and written != total and \
+            resp.headers.get("content-encoding") is None:
+        raise IOError(f"Incomplete download from {resp.url}: "
+                      f"{written} of {total} bytes.")
+
+
+def download_remote(url: str, stream: BinaryIO,
+                    desc: Optional[str] = None,
+                    show_progress: bool = True,
+                    headers: Optional[Dict[str, str]] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> requests.Response:
+    """This function will download data frmo a remote URL and
+    will optionally show the progress.
+
+    :param url: the url to download from
+    :param stream: buffered IO object
+    :param desc: progress bar description
+    :param show_progress: whether to show progress or not
+    :param headers: additional request headers
+    :param chunk_size: size in bytes of the chunks written to the stream
+    :returns: the response, the content is already consumed
+    """
+    resp = get_session().get(url, stream=True, headers=headers)
+    with resp:
+        resp.raise_for_status()
+        if resp.status_code != requests.codes.not_modified:
+            _write_response(resp, stream, desc, show_progress, chunk_size)
+    return resp
+
+
+def _state_filename(filename: Path) -> Path:
+    return filename.with_name(filename.name + ".state")
+
+
+def remove_partial_download(filename: Union[str, Path]) -> None:
+    """Remove a partial download and its state, see :func:`download_file`.
+
+    :param filename: the output file name of the download
+    """
+    filename = Path(filename)
+    for fname in [filename, _state_filename(filename)]:
+        if fname.exists():
+            fname.unlink()
+
+
+def _parse_content_range(value: Optional[str]) -> Optional[int]:
+    if value is None or "/" not in value:
+        return None
+    total = value.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def _load_download_state(filename: Path, url: str,
+                         probe: requests.Response,
+                         total: int) -> Optional[Dict[str, Any]]:
+    state_file = _state_filename(filename)
+    if not state_file.exists() or not filename.exists():
+        return None
+    try:
+        with state_file.open("r", encoding="utf-8") as fhandle:
+            state: Dict[str, Any] = json.load(fhandle)
+    except ValueError:
+        return None
+    same_resource = state["url"] == url and state["total"] == total \
+        and state["etag"] == probe.headers.get("ETag") \
+        and state["last_modified"] == probe.headers.get("Last-Modified")
+    has_validator = state["etag"] is not None \
+        or state["last_modified"] is not None
+    if not same_resource or not has_validator \
+            or filename.stat().st_size != total:
+        return None
+    return state
+
+
+def _save_download_state(filename: Path, state: Dict[str, Any]) -> None:
+    with _state_filename(filename).open("w", encoding="utf-8") as fhandle:
+        json.dump(state, fhandle)
+
+
+def _new_download_state(filename: Path, url: str, probe: requests.Response,
+                        total: int, max_segments: int,
+                        min_segment_size: int) -> Dict[str, Any]:
+    num_segments = min(max(total // min_segment_size, 1), max_segments)
+    bounds = np.linspace(0, total, num_segments + 1).astype(np.int64)
+    state = {
+        "url": url,
+        "total": total,
+        "etag": probe.headers.get("ETag"),
+        "last_modified": probe.headers.get("Last-Modified"),
+        "segments": [[int(start), int(end) - 1, 0]
+                     for start, end in zip(bounds[:-1], bounds[1:])],
+    }
+    with filename.open("wb") as fhandle:
+        fhandle.truncate(total)
+    _save_download_state(filename, state)
+    return state
+
+
+def _download_segment(url: str, filename: Path, segment: List[int],
+                      validator: Optional[str], chunk_size: int,
+                      on_progress: Callable[[List[int], int], None],
+                      resp: Optional[requests.Response] = None) -> None:
+    start, end, done = segment
+    if resp is None:
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        if validator is not None:
+            headers["If-Range"] = validator
+        resp = get_session().get(url, stream=True, headers=headers)
+    with resp:
+        resp.raise_for_status()
+        if resp.status_code != requests.codes.partial_content:
+            raise IOError(f"The resource {url} changed during the download.")
+        with filename.open("r+b") as fhandle:
+            fhandle.seek(start + done)
+            remaining = end - start - done + 1
+            for data in resp.iter_content(chunk_size=chunk_size):
+                data = data[:remaining]
+                fhandle.write(data)
+                fhandle.flush()
+                on_progress(segment, len(data))
+                remaining -= len(data)
+                if remaining <= 0:
+                    break
+
+
+def _download_segments(url: str, filename: Path, state: Dict[str, Any],
+                       probe: Optional[requests.Response],
+                       desc: Optional[str], show_progress: bool,
+                       chunk_size: int) -> None:
+    etag = state["etag"]
+    validator = etag if etag is not None and not etag.startswith("W/") \
+        else state["last_modified"]
+    pending = [segment for segment in state["segments"]
+               if segment[0] + segment[2] <= segment[1]]
+    initial = sum(segment[2] for segment in state["segments"])
+    lock = threading.Lock()
+    errors: List[BaseException] = []
+    if len(pending) == 0:
+        return
+
+    with tqdm(desc=desc, total=state["total"], initial=initial, unit='iB',
+              unit_scale=True, unit_divisor=1024,
+              disable=not show_progress) as bar:
+        def on_progress(segment: List[int], size: int) -> None:
+            with lock:
+                segment[2] += size
+                bar.update(size)
+                _save_download_state(filename, state)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            # The probe response covers the whole file, so it is
+            # reused for the first segment of a fresh download
+            futures = [executor.submit(_download_segment, url, filename,
+                                       segment, validator, chunk_size,
+                                       on_progress, probe if i == 0 else None)
+                       for i, segment in enumerate(pending)]
+            for future in concurrent.futures.as_completed(futures):
+                exception = future.exception()
+                if exception is not None:
+                    errors.append(exception)
+
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def download_file(url: str, filename: Union[str, Path],
+                  desc: Optional[str] = None,
+                  show_progress: bool = True,
+                  headers: Optional[Dict[str, str]] = None,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  max_segments: int = 4,
+                  min_segment_size: int = 16 * 1024 * 1024) -> requests.Response:
+    """This function will download data from a remote URL into a file.
+    When the server supports HTTP range requests, the file is split in
+    segments that are downloaded in parallel and the progress of each
+    segment is recorded in a state file next to the output, so an
+    interrupted download is resumed from where it stopped. When the
+    server lacks range support, it falls back to a single connection.
+
+    :param url: the url to download from
+    :param filename: the output file name
+    :param desc: progress bar description
+    :param show_progress: whether to show progress or not
+    :param headers: additional request headers (i.e. conditional headers)
+    :param chunk_size: size in bytes of the chunks written to the file
+    :param max_segments: maximum number of parallel segments
+    :param min_segment_size: minimum size in bytes of each segment
+    :returns: the response of the first request, with status 304 when
+              the resource was not modified
+    """
+    filename = Path(filename)
+    session = get_session()
+    probe_headers = dict(headers or {})
+    probe_headers["Range"] = "bytes=0-"
+    probe = session.get(url, stream=True, headers=probe_headers)
+
+    if probe.status_code == requests.codes.requested_range_not_satisfiable:
+        probe.close()
+        probe = session.get(url, stream=True, headers=headers)
+    total = _parse_content_range(probe.headers.get("Content-Range"))
+
+    if probe.status_code != requests.codes.partial_content or total is None:
+        with probe:
+            probe.raise_for_status()
+            if probe.status_code != requests.codes.not_modified:
+                # No support for ranges, download with a single connection
+                remove_partial_download(filename)
+                with filename.open("wb") as fhandle:
+                    _write_response(probe, fhandle, desc,
+                                    show_progress, chunk_size)
+        return probe
+
+    state = _load_download_state(filename, url, probe, total)
+    if state is None:
+        state = _new_download_state(filename, url, probe, total,
+                                    max_segments, min_segment_size)
+        _download_segments(url, filename, state, probe,
+                           desc, show_progress, chunk_size)
+    else:
+        probe.close()
+        _download_segments(url, filename, state, None,
+                           desc, show_progress, chunk_size)
+
+    downloaded = sum(segment[2] for segment in state["segments"])
+    if downloaded != total:
+        raise IOError(f"Incomplete download from {url}: "
+                      f"{downloaded} of {total} bytes.")
+    _state_filename(filename).unlink()
+    return probe
+
+
+def read_csv_filtered(source: Union[str, Path, IO[bytes]],
+                      filters: Optional[Mapping[str, Sequence[str]]] = None,
+                      usecols: Optional[Sequence[str]] = None,
+                      dtype: Optional[Dict[str, Any]] = None,
+                      parse_dates: Optional[Sequence[str]] = None,
+                      delimiter: str = ",",
+                      engine: Optional[str] = None,
+                      chunksize: int = 1_000_000) -> pd.DataFrame:
+    """Read a CSV file keeping only the rows where the columns match
+    any of the filter values. Only the requested columns are parsed, the
+    columns can have compact types and the dates are parsed only after
+    the filtering. Empty fields are the only values parsed as missing
+    (i.e. the "NA" country code of Namibia is kept).
+
+    :param source: the CSV file or a binary file object
+    :param filters: map from column name to the accepted values,
+                    i.e. {"country": ["BRA", "ARG"]}
+    :param usecols: the columns to read, default to all columns
+    :param dtype: map from column name to type (i.e. "float32", "category")
+    :param parse_dates: the columns to parse as dates after filtering
+    :param delimiter: the CSV delimiter
+    :param engine: "pyarrow" (multi-threaded, reads the whole file before
+                   filtering) or "c" (reads in chunks), default to
+                   "pyarrow" when it is installed.
+    :param chunksize: number of rows in each chunk for the "c" engine
+    :returns: the filtered dataframe
+    """
+    filters = filters or {}
+    parse_dates = list(parse_dates or [])
+    engine = engine or ("pyarrow" if has_pyarrow() else "c")
+    columns = None
+    if usecols is not None:
+        columns = list(usecols)
+        usecols = columns + [c for c in filters if c not in columns]
+
+    # Dates are read as strings and parsed only for the filtered rows
+    dtype = dict(dtype or {})
+    for column in parse_dates:
+        dtype[column] = str
+    for column in filters:
+        dtype.setdefault(column, str)
+
+    read_kwargs: Dict[str, Any] = {
+        "sep": delimiter,
+        "usecols": usecols,
+        "dtype": dtype,
+        "keep_default_na": False,
+        "na_values": [""],
+        "engine": engine,
+    }
+
+    def filter_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+        mask = np.ones(len(chunk), dtype=bool)
+        for column, values in filters.items():
+            mask &= chunk[column].isin(values).values
+        return chunk[mask]
+
+    if engine == "pyarrow":
+        df = filter_chunk(pd.read_csv(source, **read_kwargs))
+    else:
+        iter_csv = pd.read_csv(source, chunksize=chunksize, **read_kwargs)
+        df = pd.concat([filter_chunk(chunk) for chunk in iter_csv])
+
+    df = df.reset_index(drop=True)
+    for column in parse_dates:
+        df[column] = pd.to_datetime(df[column], format="%Y-%m-%d")
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def has_pyarrow() -> bool:
+    """Returns whether the optional pyarrow dependency, used for the
+    columnar (Parquet) cache, is installed."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _source_signature(source: Path) -> Dict[str, Any]:
+    stat = source.stat()
+    return {"source": source.name, "size": stat.st_size,
+            "mtime": stat.st_mtime}
+
+
+def write_source_signature(directory: Union[str, Path],
+                           source: Union[str, Path]) -> None:
+    """Record in a directory derived from a source file (i.e. a columnar
+    cache of a CSV) the signature of the source file, see
+    :func:`is_source_signature_valid`.
+
+    :param directory: the derived directory
+    :param source: the source file
+    """
+    signature_file = Path(directory) / SOURCE_SIGNATURE_FILENAME
+    with signature_file.open("w", encoding="utf-8") as fhandle:
+        json.dump(_source_signature(Path(source)), fhandle)
+
+
+def is_source_signature_valid(directory: Union[str, Path],
+                              source: Union[str, Path]) -> bool:
+    """Returns whether a directory derived from a source file exists and
+    was created from the current version of the source file.
+
+    :param directory: the derived directory
+    :param source: the source file used to create the directory
+    """
+    signature_file = Path(directory) / SOURCE_SIGNATURE_FILENAME
+    if not signature_file.exists():
+        return False
+    with signature_file.open("r", encoding="utf-8") as fhandle:
+        signature = json.load(fhandle)
+    return bool(signature == _source_signature(Path(source)))
+
+
+def csv_to_partitioned_parquet(source: Union[str, Path],
+                               dataset_dir: Union[str, Path],
+                               partition_column: str,
+                               column_types: Optional[Dict[str, str]] = None,
+                               delimiter: str = ",",
+                               block_size: int = 64 * 1024 * 1024,
+                               member: Optional[str] = None) -> Path:
+    """Convert a CSV file into a Parquet dataset partitioned by a column
+    (hive flavor, one directory per value). The CSV is streamed in blocks,
+    string columns are dictionary encoded and the columns can have
+    compact types (i.e. "float32"). The dataset is written into a
+    temporary directory and then renamed, and records the source file
+    signature (see :func:`is_source_signature_valid`). This requires
+    the optional pyarrow dependency.
+
+    :param source: the CSV file
+    :param dataset_dir: the output dataset directory
+    :param partition_column: the column used to partition the dataset
+    :param column_types: map from column name to a pyarrow type
+                         alias (i.e. "float32", "date32")
+    :param delimiter: the CSV delimiter
+    :param block_size: size in bytes of the blocks read from the CSV
+    :param member: when the source is a zip file, the name of the
+                   CSV file inside it
+    :returns: the dataset directory
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import csv
+
+    source = Path(source)
+    dataset_dir = Path(dataset_dir)
+    column_types = column_types or {}
+    convert_options = csv.ConvertOptions(
+        column_types={name: pa.type_for_alias(alias)
+                      for name, alias in column_types.items()},
+        null_values=[""],
+        strings_can_be_null=True,
+        auto_dict_encode=True,
+        auto_dict_max_cardinality=2 ** 31 - 1)
+    tmp_dir = Path(tempfile.mkdtemp(dir=dataset_dir.parent,
+                                    prefix=f".{dataset_dir.name}."))
+    try:
+        with contextlib.ExitStack() as stack:
+            input_file: Union[Path, IO[bytes]] = source
+            if member is not None:
+                zip_file = stack.enter_context(zipfile.ZipFile(source))
+                input_file = stack.enter_context(zip_file.open(member, "r"))
+            reader = csv.open_csv(input_file,
+                                  read_options=csv.ReadOptions(block_size=block_size),
+                                  parse_options=csv.ParseOptions(delimiter=delimiter),
+                                  convert_options=convert_options)
+            ds.write_dataset(reader, tmp_dir, format="parquet",
+                             partitioning=[partition_column],
+                             partitioning_flavor="hive",
+                             existing_data_behavior="overwrite_or_ignore")
+        write_source_signature(tmp_dir, source)
+        if dataset_dir.exists():
+            shutil.rmtree(dataset_dir)
+        os.replace(tmp_dir, dataset_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return dataset_dir
+
+
+def read_partitioned_parquet(dataset_dir: Union[str, Path],
+                             partition_column: str,
+                             values: Optional[Sequence[str]] = None,
+                             columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Read a dataset created by :func:`csv_to_partitioned_parquet`,
+    reading only the partitions of the requested values and only the
+    requested columns.
+
+    :param dataset_dir: the dataset directory
+    :param partition_column: the column used to partition the dataset
+    :param values: the partition values to read, all by default
+    :param columns: the columns to read, all by default
+    :returns: a dataframe with string columns as categoricals
+    """
+    import pyarrow.dataset as ds
+
+    partitioning = ds.HivePartitioning.discover(infer_dictionary=True)
+    dataset = ds.dataset(dataset_dir, format="parquet",
+                         partitioning=partitioning)
+    filter_expr = None
+    if values is not None:
+        filter_expr = ds.field(partition_column).isin(list(values))
+    table = dataset.to_table(columns=list(columns) if columns is not None else None,
+                             filter=filter_expr)
+    return table.to_pandas(date_as_object=False)
 
 
 def admissions_sample() -> pd.DataFrame:
@@ -78,7 +895,6 @@ def admissions_sample() -> pd.DataFrame:
 
     :returns: sample data w/ admission
     """
-    sample_fname = \
-        pkg_resources.resource_filename(__name__, "sample_data/admission_sample.csv")
+    sample_fname = Path(__file__).parent / "sample_data" / "admission_sample.csv"
     df = pd.read_csv(sample_fname, parse_dates=["DATE_START", "DATE_END"])
     return df
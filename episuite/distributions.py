@@ -1,5 +1,7 @@
+import threading
+import warnings
 from abc import ABC, abstractmethod
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Sequence, Union
 
 import numpy as np
 
@@ -16,6 +18,15 @@ class DurationDistribution(ABC):
         """
         raise NotImplementedError
 
+    def quantile(self, q: np.ndarray) -> np.ndarray:
+        """The quantile function (inverse CDF) of the distribution, used
+        to sample from uniform draws (see :class:`DurationSampler`).
+
+        :param q: the probabilities, in the interval [0, 1)
+        :returns: the durations
+        """
+        raise NotImplementedError(f"{type(self).__name__} has no quantile function.")
+
 
 class EmpiricalBootstrap(DurationDistribution):
     """This distribution will bootstrap from an empirical
@@ -27,6 +38,7 @@ class EmpiricalBootstrap(DurationDistribution):
                  replace: bool = True):
         self.samples = np.asarray(samples)
         self.replace = replace
+        self._sorted_samples: Optional[np.ndarray] = None
 
     def sample(self, size: Optional[int] = None) -> np.ndarray:
         """Sample from the duration distribution.
@@ -39,3 +51,154 @@ class EmpiricalBootstrap(DurationDistribution):
                                    size=size,
                                    replace=self.replace)
         return samples
+
+    def quantile(self, q: np.ndarray) -> np.ndarray:
+        """The quantile function (inverse CDF) of the empirical
+        distribution, sampling from it with uniform draws is the
+        same as bootstrapping with replacement.
+
+        :param q: the probabilities, in the interval [0, 1)
+        :returns: the durations
+        """
+        if self._sorted_samples is None:
+            self._sorted_samples = np.sort(self.samples)
+        num_samples = len(self._sorted_samples)
+        idx = np.minimum((np.asarray(q) * num_samples).astype(np.int64),
+                         num_samples - 1)
+        return self._sorted_samples[idx]
+
+
+class DurationSampler:
+    """This sampler draws the durations of the patients of each simulation
+    round from uniform draws and the quantile function of the duration
+    distribution, with optional variance reduction across the rounds:
+
+    * "random": independent pseudo-random draws for each round;
+    * "antithetic": the rounds are pairs, the second round of each pair
+      uses the draws `1 - u` of the first one;
+    * "sobol": each round is a point of a scrambled Sobol sequence with one
+      dimension per patient (quasi-Monte Carlo), the number of rounds should
+      be a power of 2 and the patients at most 21201. The rounds are points
+      of the same sequence only when they have the same number of patients,
+      so it can't be used with admission trajectories of different totals,
+      see :meth:`check_rounds`.
+
+    The draws of each round depend only on the seed and on the round index,
+    so simulations of different scenarios using the same seed share the
+    random numbers of each patient (common random numbers), which reduces
+    the noise of the differences between the scenarios. The scrambled
+    Sobol engine of each number of patients is built once and kept in the
+    sampler (also when it is sent to the workers), and the draws of many
+    rounds at once are taken with :meth:`batch_uniforms`.
+
+    :param method: "random", "antithetic" or "sobol"
+    :param seed: the seed, default to a random seed
+    """
+    METHODS = ("random", "antithetic", "sobol")
+
+    def __init__(self, method: str = "random", seed: Optional[int] = None):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown sampling method {method}, "
+                             f"available methods: {list(self.METHODS)}.")
+        self.method = method
+        self.seed = np.random.SeedSequence(seed).entropy
+        self._sobol_engines: Dict[int, Any] = {}
+        self._sobol_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_sobol_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._sobol_lock = threading.Lock()
+
+    def _generator(self, *key: int) -> np.random.Generator:
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key))
+
+    def _sobol_points(self, size: int, start: int, stop: int) -> np.ndarray:
+        # The points start..stop of the scrambled sequence, the engine of
+        # each size is kept and moved to the first point of each call,
+        # forward from its position when the rounds are drawn in order
+        from scipy.stats import qmc
+        if size > qmc.Sobol.MAXDIM:
+            raise ValueError(f"Sobol sampling supports at most {qmc.Sobol.MAXDIM} patients.")
+        if size == 0 or stop <= start:
+            return np.empty((max(stop - start, 0), size))
+        with self._sobol_lock:
+            engine = self._sobol_engines.get(size)
+            if engine is None:
+                engine = qmc.Sobol(d=size, scramble=True, seed=self._generator(1))
+                self._sobol_engines[size] = engine
+            if engine.num_generated > start:
+                engine.reset()
+            if start > engine.num_generated:
+                engine.fast_forward(start - engine.num_generated)
+            return engine.random(stop - start)
+
+    def uniforms(self, size: int, round_index: int) -> np.ndarray:
+        """Returns the uniform draws of a round.
+
+        :param size: the number of draws (patients)
+        :param round_index: the index of the round
+        """
+        if self.method == "random":
+            return self._generator(0, round_index).random(size)
+        if self.method == "antithetic":
+            draws = self._generator(0, round_index // 2).random(size)
+            return draws if round_index % 2 == 0 else 1.0 - draws
+        return self._sobol_points(size, round_index, round_index + 1)[0]
+
+    def batch_uniforms(self, size: int, start: int, stop: int) -> np.ndarray:
+        """Returns the uniform draws of the rounds from start to stop
+        (exclusive) with the same number of patients, the same draws of
+        :meth:`uniforms`. With the "sobol" sampling, they are drawn at once.
+
+        :param size: the number of draws (patients) of each round
+        :param start: the index of the first round
+        :param stop: the index after the last round
+        :returns: the draws with the shape (rounds, size)
+        """
+        if self.method == "sobol":
+            return self._sobol_points(size, start, stop)
+        if stop <= start:
+            return np.empty((0, size))
+        return np.stack([self.uniforms(size, round_index)
+                         for round_index in range(start, stop)])
+
+    def check_rounds(self, sizes: Union[Sequence[int], np.ndarray],
+                     num_rounds: Optional[int] = None) -> None:
+        """Check that the rounds keep the properties of the sampling. With
+        the "sobol" sampling, the rounds should have the same number of
+        patients (a ValueError is raised otherwise), and a warning is
+        issued when the number of rounds isn't a power of 2.
+
+        :param sizes: the number of patients of the rounds
+        :param num_rounds: the number of rounds, default to the number of sizes
+        """
+        if self.method != "sobol":
+            return
+        distinct_sizes = np.unique(np.asarray(sizes, dtype=np.int64))
+        if len(distinct_sizes) > 1:
+            raise ValueError("Sobol sampling requires the same number of patients in "
+                             f"every round, the rounds have from {distinct_sizes[0]} "
+                             f"to {distinct_sizes[-1]} patients.")
+        num_rounds = len(sizes) if num_rounds is None else num_rounds
+        if num_rounds & (num_rounds - 1) != 0:
+            warnings.warn(f"Sobol sampling with {num_rounds} rounds, the balance "
+                          "properties of the sequence require a power of 2.")
+
+    def sample(self, distribution: DurationDistribution, size: int,
+               round_index: int) -> np.ndarray:
+        """Sample the durations of a round.
+
+        :param distribution: the duration distribution, it must
+                             have a quantile function
+        :param size: the number of durations (patients)
+        :param round_index: the index of the round
+        """
+        return distribution.quantile(self.uniforms(size, round_index))
+
+    def __repr__(self) -> str:
+        return f"DurationSampler[Method={self.method}, Seed={self.seed}]"
@@ -1,10 +1,12 @@
-from typing import Any, Dict
+import contextlib
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from matplotlib import dates as mdates
-from matplotlib import pyplot as plt
 
 from episuite import distributions
 
@@ -22,6 +24,11 @@ class Durations:
         self.column_end = column_end
         self._check_dataframe()
 
+        # Stays without an end (i.e. patients still in the ICU) are only
+        # used for the census and the admissions
+        open_stays = self.df_durations[self.column_end].isna()
+        self.df_open_stays = self.df_durations[open_stays]
+
         # Filter only valid durations, where end is
         # greater than or equal to the start
         if self.filter_gt:
@@ -50,9 +57,225 @@ class Durations:
         stay_distribution: np.ndarray = self.get_stay_distribution()
         return distributions.EmpiricalBootstrap(stay_distribution)
 
+    def get_admissions(self) -> pd.Series:
+        """Returns the number of admissions (stays starting) of each date,
+        including the open stays, with zero for the dates without them."""
+        # Without the filter, the open stays are also in the durations
+        closed = self.df_durations[self.df_durations[self.column_end].notna()]
+        starts = pd.concat([closed[self.column_start],
+                            self.df_open_stays[self.column_start]])
+        starts = pd.to_datetime(starts).dt.normalize()
+        s_admissions = starts.groupby(starts).size().sort_index().resample("D").sum()
+        return s_admissions.rename("admissions")
+
+    def get_census(self, start_date: Optional[Union[str, pd.Timestamp]] = None,
+                   end_date: Optional[Union[str, pd.Timestamp]] = None) -> pd.Series:
+        """Returns the observed census (occupancy) of each date. A patient
+        occupies a bed from the start date up to the day before the end
+        date, as in the simulation (see :class:`episuite.icu.ICUSimulation`),
+        and the open stays (without an end date) are ongoing. The census
+        is the cumulative sum of the starts minus the ends of the stays.
+
+        :param start_date: the first date, default to the first start date
+        :param end_date: the last date, default to the last start or end date
+        :returns: a series with the census of each date
+        """
+        closed = self.df_durations[self.df_durations[self.column_end].notna()]
+        starts = pd.to_datetime(pd.concat([closed[self.column_start],
+                                           self.df_open_stays[self.column_start]])).dt.normalize()
+        ends = pd.to_datetime(closed[self.column_end]).dt.normalize()
+        if start_date is None:
+            start_date = starts.min()
+        if end_date is None:
+            end_date = pd.concat([starts, ends - pd.Timedelta(days=1)]).max()
+        dates = pd.date_range(start_date, end_date)
+
+        num_dates = len(dates)
+        start_idx = np.clip((starts - dates[0]).dt.days.values, 0, num_dates)
+        end_idx = np.full(len(starts), num_dates)
+        end_idx[:len(ends)] = np.clip((ends - dates[0]).dt.days.values, 0, num_dates)
+        end_idx = np.maximum(end_idx, start_idx)
+        delta = np.bincount(start_idx, minlength=num_dates + 1) \
+            - np.bincount(end_idx, minlength=num_dates + 1)
+        return pd.Series(np.cumsum(delta[:num_dates]), index=dates, name="census")
+
+    def get_bootstrap_by(self, column: str) -> Dict[Any, distributions.EmpiricalBootstrap]:
+        """Returns the bootstrap of the durations of each value of a
+        column, i.e. the "OUTCOME" of the patients.
+
+        :param column: the column
+        """
+        return {
+            value: distributions.EmpiricalBootstrap(group[self.COLUMN_STAY_DURATION].values)
+            for value, group in self.df_durations.groupby(column)
+        }
+
+
+def fingerprint(df_durations: pd.DataFrame,
+                column_start: str = "DATE_START",
+                column_end: str = "DATE_END",
+                filter_gt: bool = True) -> str:
+    """Returns the fingerprint of a line list, a hash of the start and
+    end columns and of the settings of :class:`Durations`. The other
+    columns don't change the durations and aren't hashed.
+
+    :param df_durations: the line list
+    :param column_start: the start column
+    :param column_end: the end column
+    :param filter_gt: the filter of the valid durations
+    :returns: the hexadecimal fingerprint
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    settings = f"{DurationsCache.FORMAT_VERSION}|{column_start}|{column_end}|{filter_gt}"
+    digest.update(settings.encode("utf-8"))
+    for column in (column_start, column_end):
+        series = df_durations[column]
+        if not pd.api.types.is_datetime64_any_dtype(series):
+            series = pd.to_datetime(series)
+        values = np.asarray(series.values, dtype="datetime64[ns]")
+        digest.update(np.ascontiguousarray(values.view(np.int64)).data)
+    return digest.hexdigest()
+
+
+class DurationsCache:
+    """On-disk memoization of the bootstrap distribution of the durations
+    (see :meth:`Durations.get_bootstrap`). The entries are keyed by the
+    fingerprint of the line list (see :func:`fingerprint`), so the jobs
+    that use the same extract build the distribution only once, and a
+    cache hit skips building :class:`Durations`. The durations are stored
+    in compact form, as the distinct durations and their counts, and the
+    least recently used entries are evicted when the cache grows beyond
+    the size limit. The entries are written atomically, so the cache can
+    be shared by concurrent jobs.
+
+    The bootstrap returned (from a hit or a miss) has the durations
+    sorted, so the sampling doesn't depend on the cache state.
+
+    :param cache_dir: the cache directory, default to the "durations"
+                      directory of the episuite cache directory.
+    :param max_size: maximum size of the cache in bytes, None for no limit.
+    """
+    FORMAT_VERSION: int = 1
+    DEFAULT_MAX_SIZE: int = 64 * 1024 * 1024
+    EXTENSION: str = ".npz"
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None,
+                 max_size: Optional[int] = DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            from episuite.data import get_cache_dir_file
+            cache_dir = get_cache_dir_file("durations")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"bootstrap_{key}{self.EXTENSION}"
+
+    def entries(self) -> List[Path]:
+        """Returns the files of the cache entries."""
+        return sorted(self.cache_dir.glob(f"*{self.EXTENSION}"))
+
+    @staticmethod
+    def _to_bootstrap(values: np.ndarray,
+                      counts: np.ndarray) -> distributions.EmpiricalBootstrap:
+        bootstrap = distributions.EmpiricalBootstrap(np.repeat(values, counts))
+        # The durations are already sorted for the quantile function
+        bootstrap._sorted_samples = bootstrap.samples
+        return bootstrap
+
+    def load(self, key: str) -> Optional[distributions.EmpiricalBootstrap]:
+        """Load the bootstrap of an entry and mark it as recently used.
+
+        :param key: the fingerprint of the line list
+        :returns: the bootstrap, or None if it isn't in the cache
+        """
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as entry:
+                values, counts = entry["values"], entry["counts"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # A missing or corrupted entry is a cache miss
+            return None
+        return self._to_bootstrap(values, counts)
+
+    def store(self, key: str, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Store the durations of an entry and evict the least recently
+        used entries over the size limit.
+
+        :param key: the fingerprint of the line list
+        :param samples: the durations
+        :returns: the distinct durations and their counts
+        """
+        values, counts = np.unique(np.asarray(samples), return_counts=True)
+        path = self._entry_path(key)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix=f".{path.name}.", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fhandle:
+                np.savez(fhandle, values=values, counts=counts.astype(np.int64))
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink()
+            raise
+        self._evict(keep=path)
+        return values, counts
+
+    def _evict(self, keep: Optional[Path] = None) -> None:
+        if self.max_size is None:
+            return
+        entries = []
+        for path in self.entries():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            with contextlib.suppress(OSError):
+                path.unlink()
+            total_size -= size
+
+    def get_bootstrap(self, df_durations: pd.DataFrame,
+                      column_start: str = "DATE_START",
+                      column_end: str = "DATE_END",
+                      filter_gt: bool = True) -> distributions.EmpiricalBootstrap:
+        """Returns the bootstrap of the durations of a line list, loaded
+        from the cache or built with :class:`Durations` and stored.
+
+        :param df_durations: the line list
+        :param column_start: the start column
+        :param column_end: the end column
+        :param filter_gt: the filter of the valid durations
+        :returns: the bootstrap distribution
+        """
+        key = fingerprint(df_durations, column_start, column_end, filter_gt)
+        bootstrap = self.load(key)
+        if bootstrap is None:
+            durations = Durations(df_durations, column_start, column_end, filter_gt)
+            values, counts = self.store(key, durations.get_stay_distribution())
+            bootstrap = self._to_bootstrap(values, counts)
+        return bootstrap
+
+    def clear(self) -> None:
+        """Remove all the entries from the cache."""
+        for path in self.entries():
+            with contextlib.suppress(OSError):
+                path.unlink()
+
+    def __repr__(self) -> str:
+        size = sum(path.stat().st_size for path in self.entries())
+        return f"DurationsCache[Dir={self.cache_dir}, Entries={len(self.entries())}, Size={size}]"
+
 
 class DurationsPlot:
-    """Makes plots for the durations
+    """Makes plots for the durations. The plotting libraries
+    (matplotlib and seaborn) are only imported when a plot is made.
 
     :param duration: the duration
     """
@@ -61,6 +284,7 @@ class DurationsPlot:
         self.duration = duration
 
     def histogram(self, **kwargs: Dict) -> Any:
+        import seaborn as sns
         df = self.duration.get_dataframe()
         ax = sns.histplot(
             df,
@@ -75,6 +299,8 @@ class DurationsPlot:
         return ax
 
     def density(self, **kwargs: Dict) -> Any:
+        import seaborn as sns
+        from matplotlib import pyplot as plt
         df = self.duration.get_dataframe()
         ax = sns.displot(
             df,
@@ -89,6 +315,9 @@ class DurationsPlot:
 
     def timeplot(self, locator: str = "month",
                  interval: int = 1, **kwargs: Dict) -> Any:
+        import seaborn as sns
+        from matplotlib import dates as mdates
+        from matplotlib import pyplot as plt
         df = self.duration.get_dataframe()
         ax = sns.lineplot(
             data=df,
@@ -0,0 +1,257 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Union
+
+
+class ExecutionBackend(ABC):
+    """Base class for the execution backends, which run many tasks (i.e.
+    simulation rounds) and yield their results as they complete. The
+    backends can be used as context managers, closing them on exit."""
+
+    @abstractmethod
+    def run(self, fn: Callable[..., Any],
+            tasks: Sequence[Sequence[Any]]) -> Iterator[Any]:
+        """Run the function for each task and yield the results in
+        the order they complete.
+
+        :param fn: the function, it must be picklable for the backends
+                   running on other processes
+        :param tasks: the positional arguments of each call
+        :returns: an iterator over the results
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the resources (i.e. workers) of the backend."""
+
+    def __enter__(self) -> 'ExecutionBackend':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class SerialBackend(ExecutionBackend):
+    """This backend runs the tasks in the current thread, it has no
+    startup cost and it is useful for short runs and debugging."""
+
+    def run(self, fn: Callable[..., Any],
+            tasks: Sequence[Sequence[Any]]) -> Iterator[Any]:
+        for args in tasks:
+            yield fn(*args)
+
+
+class PoolBackend(ExecutionBackend):
+    """This is the base class of the backends running the tasks on a
+    pool of workers from :mod:`concurrent.futures`.
+
+    :param max_workers: the number of workers, default to the number
+                        of cores in the machine.
+    :param persistent: if the pool should be kept between the runs, so
+                       the workers are warm for the next runs, it is
+                       shut down when the backend is closed.
+    """
+    def __init__(self, max_workers: Optional[int] = None,
+                 persistent: bool = False):
+        self.max_workers = max_workers
+        self.persistent = persistent
+        self._executor: Optional[concurrent.futures.Executor] = None
+
+    @abstractmethod
+    def _create_executor(self) -> concurrent.futures.Executor:
+        raise NotImplementedError
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+
+    def run(self, fn: Callable[..., Any],
+            tasks: Sequence[Sequence[Any]]) -> Iterator[Any]:
+        executor = self._get_executor()
+        try:
+            futures = [executor.submit(fn, *args) for args in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            if not self.persistent:
+                self.close()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class ThreadBackend(PoolBackend):
+    """This backend runs the tasks on a pool of threads, it is useful
+    when the tasks release the GIL (i.e. numpy vectorized code).
+    See :class:`PoolBackend` for the parameters."""
+
+    def _create_executor(self) -> concurrent.futures.Executor:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+
+class ProcessBackend(PoolBackend):
+    """This backend runs the tasks on a pool of processes.
+    See :class:`PoolBackend` for the parameters."""
+
+    def _create_executor(self) -> concurrent.futures.Executor:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+
+
+class JoblibBackend(ExecutionBackend):
+    """This backend runs the tasks with :class:`joblib.Parallel`, yielding
+    the results as they complete. This requires the optional joblib
+    dependency (joblib>=1.4).
+
+    :param n_jobs: the number of jobs, default to the number of cores
+    :param kwargs: extra arguments for :class:`joblib.Parallel`, i.e. the
+                   joblib backend ("loky", "threading", etc)
+    """
+    def __init__(self, n_jobs: Optional[int] = None, **kwargs: Any):
+        self.n_jobs = n_jobs or -1
+        self.kwargs = kwargs
+
+    def run(self, fn: Callable[..., Any],
+            tasks: Sequence[Sequence[Any]]) -> Iterator[Any]:
+        import joblib
+        parallel = joblib.Parallel(n_jobs=self.n_jobs, return_as="generator_unordered",
+                                   **self.kwargs)
+        yield from parallel(joblib.delayed(fn)(*args) for args in tasks)
+
+
+class DaskBackend(ExecutionBackend):
+    """This backend runs the tasks on a local dask.distributed cluster,
+    yielding the results as they complete. This requires the optional
+    dask distributed dependency.
+
+    :param scheduler: the workers of the cluster, "processes" or "threads"
+    :param num_workers: the number of workers, default to the
+                        number of cores in the machine.
+    :param persistent: if the cluster should be kept between the runs,
+                       see :class:`PoolBackend`.
+    """
+    SCHEDULERS = ("processes", "threads")
+
+    def __init__(self, scheduler: str = "processes",
+                 num_workers: Optional[int] = None,
+                 persistent: bool = False):
+        if scheduler not in self.SCHEDULERS:
+            raise ValueError(f"Unknown dask scheduler {scheduler}, "
+                             f"available schedulers: {list(self.SCHEDULERS)}.")
+        self.scheduler = scheduler
+        self.num_workers = num_workers
+        self.persistent = persistent
+        self._client: Any = None
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            from dask.distributed import Client, LocalCluster
+            num_workers = self.num_workers or os.cpu_count() or 1
+            if self.scheduler == "processes":
+                cluster = LocalCluster(n_workers=num_workers, threads_per_worker=1,
+                                       processes=True, dashboard_address=None)
+            else:
+                cluster = LocalCluster(n_workers=1, threads_per_worker=num_workers,
+                                       processes=False, dashboard_address=None)
+            self._client = Client(cluster)
+        return self._client
+
+    def run(self, fn: Callable[..., Any],
+            tasks: Sequence[Sequence[Any]]) -> Iterator[Any]:
+        from dask.distributed import as_completed
+        client = self._get_client()
+        try:
+            # The tasks aren't pure, i.e. the rounds with a random seed
+            futures = [client.submit(fn, *args, pure=False) for args in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            if not self.persistent:
+                self.close()
+
+    def close(self) -> None:
+        if self._client is not None:
+            cluster = self._client.cluster
+            self._client.close()
+            cluster.close()
+            self._client = None
+
+
+BACKENDS: Dict[str, Callable[[Optional[int]], ExecutionBackend]] = {
+    "serial": lambda max_workers: SerialBackend(),
+    "threads": lambda max_workers: ThreadBackend(max_workers),
+    "processes": lambda max_workers: ProcessBackend(max_workers),
+    "joblib": lambda max_workers: JoblibBackend(max_workers),
+    "dask": lambda max_workers: DaskBackend(num_workers=max_workers),
+}
+
+_DEFAULT_BACKEND: contextvars.ContextVar = contextvars.ContextVar(
+    "episuite_default_backend", default=None)
+
+
+def get_backend(backend: Optional[Union[str, ExecutionBackend]] = None,
+                max_workers: Optional[int] = None) -> ExecutionBackend:
+    """Returns an execution backend.
+
+    :param backend: a backend instance, or the name of a backend ("serial",
+                    "threads", "processes", "joblib" or "dask"), default
+                    to the backend set with :func:`use_backend` or to
+                    the "processes" backend.
+    :param max_workers: the number of workers of a backend created by name
+    :returns: the backend
+    """
+    if backend is None:
+        backend = _DEFAULT_BACKEND.get() or "processes"
+    if isinstance(backend, ExecutionBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, "
+                         f"available backends: {list(BACKENDS)}.")
+    return BACKENDS[backend](max_workers)
+
+
+@contextlib.contextmanager
+def use_backend(backend: Union[str, ExecutionBackend]) -> Iterator[None]:
+    """Context manager setting the default backend, used when a backend
+    isn't given (i.e. in :meth:`episuite.icu.ICUSimulation.simulate`).
+    A persistent backend keeps its workers warm between the runs::
+
+        with ProcessBackend(persistent=True) as backend, use_backend(backend):
+            results = simulation.simulate(100)
+            results_other = simulation_other.simulate(100)
+
+    :param backend: a backend instance or the name of a backend
+    """
+    token = _DEFAULT_BACKEND.set(backend)
+    try:
+        yield
+    finally:
+        _DEFAULT_BACKEND.reset(token)
+
+
+@contextlib.contextmanager
+def persistent_backend(backend: Optional[Union[str, ExecutionBackend]] = None,
+                       max_workers: Optional[int] = None) -> Iterator[ExecutionBackend]:
+    """Context manager returning a backend (see :func:`get_backend`) whose
+    pool of workers, if any, is kept between the runs inside the context,
+    i.e. for the batches of an adaptive simulation. A pool (or a dask
+    cluster) that wasn't persistent is shut down on exit.
+
+    :param backend: a backend instance or the name of a backend
+    :param max_workers: the number of workers of a backend created by name
+    """
+    executor = get_backend(backend, max_workers)
+    if not isinstance(executor, (PoolBackend, DaskBackend)) or executor.persistent:
+        yield executor
+        return
+    executor.persistent = True
+    try:
+        yield executor
+    finally:
+        executor.persistent = False
+        executor.close()
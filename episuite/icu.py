@@ -1,15 +1,20 @@
-import concurrent.futures
-from typing import Any, Optional
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import (Any, Callable, Dict, Iterator, List, Mapping, NamedTuple,
+                    Optional, Sequence, Set, Tuple, Union)
 
-import arviz as az
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from matplotlib import dates as mdates
-from matplotlib import pyplot as plt
-from tqdm.auto import tqdm
 
-from episuite.distributions import DurationDistribution
+from episuite.distributions import DurationDistribution, DurationSampler
+from episuite.executors import (ExecutionBackend, get_backend,
+                                persistent_backend)
 
 
 class ICUAdmissions:
@@ -63,6 +68,9 @@ class ICUAdmissionsPlot:
         self.icu_admissions = icu_admissions
 
     def bar(self, locator: str = "month", interval: int = 1) -> None:
+        import seaborn as sns
+        from matplotlib import dates as mdates
+        from matplotlib import pyplot as plt
         s_adm = self.icu_admissions.get_admissions_series()
         plt.bar(s_adm.index, s_adm.values)
         ax = plt.gca()
@@ -81,6 +89,113 @@ class ICUAdmissionsPlot:
         return ax
 
 
+def _max_rss() -> Optional[int]:
+    # The peak resident memory (bytes) of the current process, None
+    # where the resource module isn't available (i.e. on Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In kilobytes on Linux and in bytes on macOS
+    return int(max_rss if sys.platform == "darwin" else max_rss * 1024)
+
+
+class SimulationStats:
+    """This class holds the timing statistics of the stages of the
+    simulation, recorded when the simulation is profiled. Each record
+    has the stage name, the worker (process id) where it was executed,
+    the wall time in seconds, the number of samples processed, the
+    number of bytes produced (or transferred) by the stage and the peak
+    resident memory of the worker process at the end of the stage (None
+    where it isn't available), so the summary by worker has the peak
+    memory of each worker process.
+
+    The stages of a simulation round are "los_sampling", "expansion"
+    (of the patients into the dates of stay) and "aggregation", and
+    the stages of the simulation are "transfer" (of the round results
+    from the worker processes) and "concat".
+    """
+    def __init__(self) -> None:
+        self.records: List[Dict[str, Any]] = []
+
+    def record(self, stage: str, seconds: float, samples: int = 0,
+               nbytes: int = 0, worker: Optional[int] = None) -> None:
+        """Add a record of a stage.
+
+        :param stage: the stage name
+        :param seconds: the wall time of the stage
+        :param samples: number of samples processed in the stage
+        :param nbytes: number of bytes produced by the stage
+        :param worker: the worker, default to the current process id,
+                       the peak memory is only recorded for the
+                       current process.
+        """
+        self.records.append({
+            "stage": stage,
+            "worker": os.getpid() if worker is None else worker,
+            "seconds": seconds,
+            "samples": samples,
+            "bytes": nbytes,
+            "max_rss": _max_rss() if worker is None else None,
+        })
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[Dict[str, int]]:
+        """Context manager recording the wall time of a stage, it yields a
+        dictionary where the "samples" and "bytes" of the stage can be set.
+
+        :param stage: the stage name
+        """
+        counters = {"samples": 0, "bytes": 0}
+        start = time.perf_counter()
+        yield counters
+        self.record(stage, time.perf_counter() - start,
+                    counters["samples"], counters["bytes"])
+
+    def extend(self, records: List[Dict[str, Any]]) -> None:
+        """Add the records of another stats object (i.e. from a worker).
+
+        :param records: the records
+        """
+        self.records.extend(records)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns a dataframe with one row for each record."""
+        return pd.DataFrame(self.records,
+                            columns=["stage", "worker", "seconds", "samples",
+                                     "bytes", "max_rss"])
+
+    def summary(self, by_worker: bool = False) -> pd.DataFrame:
+        """Returns the total and mean wall time, the total samples
+        and bytes and the peak memory of each stage.
+
+        :param by_worker: if the summary should be also by worker
+        """
+        keys = ["stage", "worker"] if by_worker else ["stage"]
+        return self.to_dataframe().groupby(keys).agg(
+            calls=("seconds", "size"),
+            total_seconds=("seconds", "sum"),
+            mean_seconds=("seconds", "mean"),
+            samples=("samples", "sum"),
+            bytes=("bytes", "sum"),
+            max_rss=("max_rss", "max"),
+        )
+
+    def __repr__(self) -> str:
+        return f"SimulationStats[Records={len(self.records)}]"
+
+
+def _stage(stats: Optional[SimulationStats],
+           stage: str) -> contextlib.AbstractContextManager:
+    if stats is None:
+        return contextlib.nullcontext({"samples": 0, "bytes": 0})
+    return stats.stage(stage)
+
+
+ProgressCallback = Callable[[int, int, Optional[SimulationStats]], None]
+
+
 class ICUSimulation:
     """This is the main class for the simulation of ICU/beds occupancy
     based on observed admissions or predicted admission.
@@ -97,117 +212,743 @@ class ICUSimulation:
     :param duration_distribution: it can be a fitted distribution supporting
                                   the duration distribution or a empirical
                                   distribution.
+    :param admission_trajectories: the samples of an admissions forecast, a
+                                   dataframe with one row for each trajectory
+                                   and one column for each future date, after
+                                   the last date of the admissions. Each
+                                   simulation round uses the admissions
+                                   followed by one trajectory, the round i
+                                   uses the trajectory i modulo the number
+                                   of trajectories.
     """
     def __init__(self, admissions: ICUAdmissions,
-                 duration_distribution: DurationDistribution):
+                 duration_distribution: DurationDistribution,
+                 admission_trajectories: Optional[pd.DataFrame] = None):
         self.admissions = admissions
         self.duration_distribution = duration_distribution
+        self.admission_trajectories = admission_trajectories
+        self._admission_dates, self._admission_counts = self._combine_trajectories(
+            admissions, admission_trajectories)
+
+    @staticmethod
+    def _combine_trajectories(admissions: ICUAdmissions,
+                              trajectories: Optional[pd.DataFrame]) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        # The dates and the admission counts of each trajectory, with
+        # the shape (trajectories, dates), a single row without them
+        s_admissions = admissions.get_admissions_series()
+        dates = pd.DatetimeIndex(s_admissions.index)
+        counts = s_admissions.values.astype(np.int64)[np.newaxis]
+        if trajectories is None:
+            return dates, counts
+        if trajectories.empty:
+            raise ValueError("Empty admission trajectories.")
+        trajectories = trajectories.sort_index(axis=1)
+        future_dates = pd.DatetimeIndex(trajectories.columns).normalize()
+        if future_dates[0] <= dates.max():
+            raise ValueError("The admission trajectories should start after "
+                             "the last date of the admissions.")
+        values = trajectories.values.astype(np.float64)
+        if np.isnan(values).any() or (values < 0).any():
+            raise ValueError("Admission trajectories with missing or negative values.")
+        history = np.broadcast_to(counts, (len(values), counts.shape[1]))
+        counts = np.concatenate([history, np.rint(values).astype(np.int64)], axis=1)
+        return dates.append(future_dates), counts
 
     def get_admissions(self) -> ICUAdmissions:
         """Return the admissions."""
         return self.admissions
 
+    def get_admission_trajectories(self) -> Optional[pd.DataFrame]:
+        """Return the admission trajectories, or None without them."""
+        return self.admission_trajectories
+
     def get_duration_distribution(self) -> DurationDistribution:
         """Return the duration distribution."""
         return self.duration_distribution
 
-    def simulation_round(self) -> pd.Series:
-        """This method will perform a single simulation round."""
-        s_admissions = self.admissions.get_admissions_series()
-        admission_counts = s_admissions.values.astype(np.int32)
-        dates = s_admissions.index
-        dates_rep = np.repeat(dates, admission_counts)
+    def simulation_round(self, stats: Optional[SimulationStats] = None,
+                         sampler: Optional[DurationSampler] = None,
+                         round_index: int = 0) -> pd.Series:
+        """This method will perform a single simulation round.
+
+        :param stats: if provided, the timing statistics of the
+                      stages of the round are recorded on it.
+        :param sampler: if provided, the durations are drawn with the
+                        sampler instead of the distribution sampling.
+        :param round_index: the index of the round, used by the sampler and
+                            to choose the admission trajectory
+        """
+        admission_counts = self._admission_counts[round_index % len(self._admission_counts)]
+        dates_rep = np.repeat(self._admission_dates, admission_counts)
 
         num_samples = len(dates_rep)
-        los = self.duration_distribution.sample(num_samples)
+        with _stage(stats, "los_sampling") as counters:
+            if sampler is None:
+                los = self.duration_distribution.sample(num_samples)
+            else:
+                los = sampler.sample(self.duration_distribution, num_samples, round_index)
+            counters["samples"] = num_samples
+            counters["bytes"] = np.asarray(los).nbytes
 
-        ran = [pd.date_range(los_date, periods=los_sample)
-               for los_sample, los_date in zip(los, dates_rep)]
+        with _stage(stats, "expansion") as counters:
+            # The stays as offsets in days from the first admission date,
+            # as simulate_ensemble() does for all the rounds at once
+            first_date = self._admission_dates[0]
+            start = np.asarray((dates_rep - first_date).days, dtype=np.int64)
+            end = start + np.asarray(los, dtype=np.int64)
+            horizon = int(end.max(initial=0))
+            occupancy = _occupancy_from_stays(np.zeros_like(start), start, end,
+                                              1, horizon, np.int64)[0]
+            counters["samples"] = int(end.sum() - start.sum())
+            counters["bytes"] = occupancy.nbytes
 
-        new_dates_rep = pd.DatetimeIndex([]).append(ran)
-        vals = pd.Series(new_dates_rep).value_counts().sort_index()
+        with _stage(stats, "aggregation") as counters:
+            # Only the dates with patients, as the counts of the stay dates
+            offsets = np.flatnonzero(occupancy)
+            vals = pd.Series(occupancy[offsets],
+                             index=first_date + pd.to_timedelta(offsets, unit="D"))
+            counters["samples"] = len(vals)
+            counters["bytes"] = int(vals.memory_usage(index=True))
         return vals
 
+    def _profiled_simulation_round(self, sampler: Optional[DurationSampler] = None,
+                                   round_index: int = 0) -> Tuple[pd.Series, List[Dict[str, Any]], float]:
+        stats = SimulationStats()
+        vals = self.simulation_round(stats, sampler, round_index)
+        return vals, stats.records, time.time()
+
+    @staticmethod
+    def _get_sampler(sampling: Optional[Union[str, DurationSampler]],
+                     seed: Optional[int]) -> Optional[DurationSampler]:
+        if isinstance(sampling, DurationSampler):
+            return sampling
+        if sampling is None and seed is None:
+            return None
+        return DurationSampler(sampling or "random", seed)
+
+    def _check_sampler(self, sampler: Optional[DurationSampler], iterations: int,
+                       batch_size: Optional[int] = None) -> None:
+        # The number of patients of the rounds, which use the admission
+        # trajectories in turn, and the number of rounds run at once
+        if sampler is None:
+            return
+        sizes = self._admission_counts.sum(axis=1)[:iterations]
+        sampler.check_rounds(sizes, iterations if batch_size is None else batch_size)
+
+    def _simulate_rounds(self, executor: ExecutionBackend, round_indices: Sequence[int],
+                         sampler: Optional[DurationSampler],
+                         stats: Optional[SimulationStats],
+                         callback: Optional[ProgressCallback]) -> List[pd.Series]:
+        if stats is not None:
+            results = executor.run(self._profiled_simulation_round,
+                                   [(sampler, i) for i in round_indices])
+        else:
+            results = executor.run(self.simulation_round,
+                                   [(None, sampler, i) for i in round_indices])
+        simulations = []
+        for completed, result in enumerate(results, 1):
+            if stats is not None:
+                result = self._collect_round_stats(stats, *result)
+            simulations.append(result)
+            if callback is not None:
+                callback(completed, len(round_indices), stats)
+        return simulations
+
     def simulate(self, iterations: int = 10,
                  show_progress: bool = True,
-                 max_workers: Optional[int] = None) -> 'ICUSimulationResults':
+                 max_workers: Optional[int] = None,
+                 profile: bool = False,
+                 callback: Optional[ProgressCallback] = None,
+                 backend: Optional[Union[str, ExecutionBackend]] = None,
+                 sampling: Optional[Union[str, DurationSampler]] = None,
+                 seed: Optional[int] = None) -> 'ICUSimulationResults':
         """This method will perform many rounds of simulation.
 
         :param iterations: number of simulation rounds to incorporate
                            the uncertainty from the LoS distribution.
-        :param show_progress: show the progress of simulation
-        :param max_workers: the number of workers to use (processes), default
+        :param show_progress: show the progress of simulation, it is
+                              ignored when a callback is provided
+        :param max_workers: the number of workers to use, default
                             to the number of cores in the machine.
+        :param profile: if the timing statistics of the stages should be
+                        recorded, see :class:`SimulationStats`.
+        :param callback: a function called after each round with the number
+                         of rounds completed, the total of rounds and the
+                         stats (None if not profiled), it replaces the
+                         progress bar and can be used to export metrics.
+        :param backend: the execution backend or its name, default to the
+                        backend set with :func:`episuite.executors.use_backend`
+                        or to a pool of processes, see :mod:`episuite.executors`.
+        :param sampling: the sampling of the durations, "random", "antithetic"
+                         or "sobol" (variance reduction), or a sampler, see
+                         :class:`episuite.distributions.DurationSampler`. The
+                         default is to sample from the distribution.
+        :param seed: the seed of the sampling, the simulations of different
+                     scenarios with the same seed use common random numbers.
+
+        With admission trajectories, the round i uses the trajectory i
+        modulo the number of trajectories, see also :meth:`simulate_ensemble`.
         """
-        simulations = []
-        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(self.simulation_round)
-                       for _ in range(iterations)]
+        stats = SimulationStats() if profile else None
+        if callback is None:
+            callback = self._progress_bar(iterations, show_progress)
+
+        executor = get_backend(backend, max_workers)
+        sampler = self._get_sampler(sampling, seed)
+        self._check_sampler(sampler, iterations)
+        simulations = self._simulate_rounds(executor, range(iterations),
+                                            sampler, stats, callback)
 
-            for future in tqdm(concurrent.futures.as_completed(futures),
-                               total=len(futures), desc="Simulation",
-                               disable=not show_progress):
-                simulations.append(future.result())
+        with _stage(stats, "concat") as counters:
+            df_simulation = pd.concat(simulations, axis=1)
+            df_simulation = df_simulation.fillna(0)
+            counters["samples"] = df_simulation.size
+            counters["bytes"] = int(df_simulation.memory_usage(index=True).sum())
+        return ICUSimulationResults(self, df_simulation, stats)
 
-        df_simulation = pd.concat(simulations, axis=1)
-        df_simulation = df_simulation.fillna(0)
-        return ICUSimulationResults(self, df_simulation)
+    @staticmethod
+    def _collect_round_stats(stats: SimulationStats, vals: pd.Series,
+                             records: List[Dict[str, Any]],
+                             sent_at: float) -> pd.Series:
+        stats.extend(records)
+        stats.record("transfer", max(time.time() - sent_at, 0.0), len(vals),
+                     int(vals.memory_usage(index=True)), records[0]["worker"])
+        return vals
+
+    @staticmethod
+    def _progress_bar(iterations: int, show_progress: bool) -> ProgressCallback:
+        from tqdm.auto import tqdm
+        pbar = tqdm(total=iterations, desc="Simulation",
+                    disable=not show_progress)
+
+        def update(completed: int, total: int,
+                   stats: Optional[SimulationStats]) -> None:
+            pbar.total = total
+            pbar.update(completed - pbar.n)
+            if completed >= total:
+                pbar.close()
+        return update
+
+    def simulate_adaptive(self, tolerance: float = 1.0,
+                          batch_size: int = 100,
+                          max_iterations: int = 10000,
+                          time_budget: Optional[float] = None,
+                          num_groups: int = 10,
+                          show_progress: bool = True,
+                          max_workers: Optional[int] = None,
+                          callback: Optional[ProgressCallback] = None,
+                          backend: Optional[Union[str, ExecutionBackend]] = None,
+                          sampling: Optional[Union[str, DurationSampler]] = None,
+                          seed: Optional[int] = None) -> 'ICUSimulationResults':
+        """This method will perform simulation rounds in batches until the
+        Monte Carlo standard error of the mean and of the HDI bounds of
+        every date is under the tolerance, or until the time budget or the
+        maximum number of iterations is reached. The precision achieved is
+        available in :meth:`ICUSimulationResults.get_precision`.
+
+        The standard error is updated incrementally after each batch: the
+        mean error from running sums, and the error of the bounds with batch
+        means (see :func:`monte_carlo_standard_error`) over groups of the
+        same size, from `num_groups` to `2 * num_groups - 1` groups, whose
+        size doubles (merging pairs of groups) when there are more of them.
+
+        :param tolerance: the maximum standard error (in number of patients)
+        :param batch_size: number of simulation rounds of each batch
+        :param max_iterations: maximum number of simulation rounds
+        :param time_budget: maximum time in seconds, checked after each batch
+        :param num_groups: minimum number of groups of iterations used to
+                           estimate the standard error of the HDI bounds
+        :param show_progress: show the progress of simulation, it is
+                              ignored when a callback is provided
+        :param max_workers: the number of workers to use, default
+                            to the number of cores in the machine.
+        :param callback: a function called after each batch with the number
+                         of rounds completed and the maximum number of rounds
+                         (the number of rounds completed after the last batch)
+        :param backend: the execution backend or its name, see :meth:`simulate`
+        :param sampling: the sampling of the durations, see :meth:`simulate`
+        :param seed: the seed of the sampling, see :meth:`simulate`
+        """
+        if callback is None:
+            callback = self._progress_bar(max_iterations, show_progress)
+
+        start = time.perf_counter()
+        sampler = self._get_sampler(sampling, seed)
+        # With Sobol sampling, batches of a power of 2 rounds are
+        # balanced blocks of the sequence
+        self._check_sampler(sampler, max_iterations, min(batch_size, max_iterations))
+        accumulator = _AdaptiveAccumulator(num_groups, min(batch_size, max_iterations))
+        iterations = 0
+        stop_reason = None
+        with persistent_backend(backend, max_workers) as executor:
+            while stop_reason is None:
+                size = min(batch_size, max_iterations - iterations)
+                accumulator.add(self._simulate_rounds(
+                    executor, range(iterations, iterations + size), sampler, None, None))
+                iterations = accumulator.iterations
+                mcse = accumulator.standard_error()
+                elapsed = time.perf_counter() - start
+
+                if (mcse.values <= tolerance).all():
+                    stop_reason = "tolerance"
+                elif time_budget is not None and elapsed >= time_budget:
+                    stop_reason = "time_budget"
+                elif iterations >= max_iterations:
+                    stop_reason = "max_iterations"
+                callback(iterations, max_iterations if stop_reason is None else iterations, None)
+
+        results = ICUSimulationResults(self, accumulator.get_dataframe())
+        results.precision = SimulationPrecision(iterations, elapsed, stop_reason, mcse)
+        return results
+
+    def simulate_ensemble(self, iterations: Optional[int] = None,
+                          dtype: Any = np.int32,
+                          sampling: Optional[Union[str, DurationSampler]] = None,
+                          seed: Optional[int] = None) -> 'ICUSimulationResults':
+        """This method will perform all the simulation rounds in a single
+        vectorized pass, where the round i uses the admissions followed by
+        the admission trajectory i modulo the number of trajectories. With
+        the same sampling and seed, the results are the same of
+        :meth:`simulate`, but with all the dates from the first admission
+        to the last discharge.
+
+        :param iterations: number of simulation rounds, default to the
+                           number of admission trajectories or to 10
+                           without them.
+        :param dtype: the type of the occupancy
+        :param sampling: the sampling of the durations, see :meth:`simulate`
+        :param seed: the seed of the sampling, see :meth:`simulate`
+        """
+        num_trajectories = len(self._admission_counts)
+        if iterations is None:
+            iterations = 10 if self.admission_trajectories is None else num_trajectories
+        counts = self._admission_counts[np.arange(iterations) % num_trajectories]
+        round_idx, date_idx = np.nonzero(counts)
+        repeats = counts[round_idx, date_idx]
+        patient_round = np.repeat(round_idx, repeats)
+        offsets = np.asarray((self._admission_dates - self._admission_dates[0]).days)
+        patient_start = np.repeat(offsets[date_idx], repeats)
+
+        sampler = self._get_sampler(sampling, seed)
+        if sampler is None:
+            los = _sample_durations(self.duration_distribution, len(patient_round))
+        else:
+            # The patients of each round are drawn with the uniforms of the
+            # round, in the same order of simulation_round()
+            patients = np.bincount(patient_round, minlength=iterations)
+            sampler.check_rounds(patients)
+            if (patients == patients[0]).all():
+                uniforms = sampler.batch_uniforms(int(patients[0]), 0, iterations).ravel()
+            else:
+                uniforms = np.concatenate([sampler.uniforms(int(size), round_index)
+                                           for round_index, size in enumerate(patients)])
+            los = self.duration_distribution.quantile(uniforms)
+        patient_end = patient_start + np.asarray(los, dtype=np.int64)
+
+        horizon = max(int(offsets[-1]) + 1, int(patient_end.max(initial=0)))
+        occupancy = _occupancy_from_stays(patient_round, patient_start, patient_end,
+                                          iterations, horizon, dtype)
+        dates = pd.date_range(self._admission_dates[0], periods=horizon)
+        return ICUSimulationResults(self, pd.DataFrame(occupancy.T, index=dates))
+
+
+def _sample_durations(distribution: DurationDistribution, size: int,
+                      rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    # The durations of the patients, drawn with the quantile function
+    # and the uniforms of the generator when it is given
+    if size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if rng is None:
+        return np.asarray(distribution.sample(size), dtype=np.int64)
+    return np.asarray(distribution.quantile(rng.random(size)), dtype=np.int64)
+
+
+def _occupancy_from_stays(row: np.ndarray, start: np.ndarray, end: np.ndarray,
+                          num_rows: int, horizon: int, dtype: Any) -> np.ndarray:
+    # The occupancy of each row (i.e. iteration) with the shape (rows,
+    # horizon), as the cumulative sum of the admissions minus the
+    # discharges along the dates. The stays are from the start date
+    # (inclusive) to the end date (exclusive), as offsets in days.
+    size = num_rows * (horizon + 1)
+    delta = np.bincount((row * (horizon + 1) + start).ravel(), minlength=size)
+    delta -= np.bincount((row * (horizon + 1) + end).ravel(), minlength=size)
+    delta = delta.reshape(num_rows, horizon + 1)
+    return np.cumsum(delta[:, :horizon], axis=-1).astype(dtype)
+
+
+def monte_carlo_standard_error(samples: np.ndarray,
+                               num_groups: int = 10) -> pd.DataFrame:
+    """Estimates the Monte Carlo standard error of the mean and of the
+    95% and 50% HDI bounds of each row of the samples (i.e. the results
+    of a date), with the iterations in the columns. The error of the
+    bounds is estimated with batch means: the iterations are split into
+    groups, and the error is the standard deviation of the bounds of the
+    groups divided by the square root of the number of groups.
+
+    :param samples: the samples, with the iterations in the columns
+    :param num_groups: the number of groups of iterations
+    :returns: a dataframe with the standard error of "mean_val",
+              "lb95", "ub95", "lb50" and "ub50" of each row.
+    """
+    num_samples = samples.shape[1]
+    if num_samples < 2 * num_groups:
+        raise ValueError(f"At least {2 * num_groups} iterations are required.")
+    mcse = {"mean_val": np.std(samples, axis=1, ddof=1) / np.sqrt(num_samples)}
+    groups = np.array_split(np.asarray(samples), num_groups, axis=1)
+    for hdi_prob, suffix in ((0.95, "95"), (0.50, "50")):
+        bounds = np.stack([hdi_intervals(group, hdi_prob) for group in groups])
+        errors = np.std(bounds, axis=0, ddof=1) / np.sqrt(num_groups)
+        mcse[f"lb{suffix}"], mcse[f"ub{suffix}"] = errors
+    return pd.DataFrame(mcse)
+
+
+class _AdaptiveAccumulator:
+    # The results of the batches of the adaptive simulation, in a buffer
+    # (dates x iterations) that grows geometrically, with the statistics
+    # of the standard error updated for the new iterations only: the sums
+    # of the results and of their squares, and the HDI bounds of each
+    # complete group of iterations (batch means with groups of the same
+    # size, which doubles when there are 2 * num_groups groups).
+    def __init__(self, num_groups: int, first_batch_size: int):
+        self.num_groups = num_groups
+        self.group_size = max(first_batch_size // num_groups, 1)
+        self.dates = pd.DatetimeIndex([])
+        self.values = np.zeros((0, first_batch_size), dtype=np.int64)
+        self.iterations = 0
+        self.sums = np.zeros((2, 0))
+        self.group_bounds: List[np.ndarray] = []
+
+    def _extend_dates(self, dates: pd.DatetimeIndex) -> None:
+        # The previous iterations have no occupancy in the new dates
+        new_dates = self.dates.union(dates)
+        if len(new_dates) == len(self.dates):
+            return
+        rows = new_dates.get_indexer(self.dates)
+        values = np.zeros((len(new_dates), self.values.shape[1]), dtype=np.int64)
+        values[rows] = self.values
+        sums = np.zeros((2, len(new_dates)))
+        sums[:, rows] = self.sums
+        for i, bounds in enumerate(self.group_bounds):
+            self.group_bounds[i] = np.zeros((len(bounds), len(new_dates)))
+            self.group_bounds[i][:, rows] = bounds
+        self.dates, self.values, self.sums = new_dates, values, sums
+
+    def _bounds(self, group: int) -> np.ndarray:
+        start = group * self.group_size
+        samples = self.values[:, start:start + self.group_size]
+        return np.concatenate([hdi_intervals(samples, 0.95), hdi_intervals(samples, 0.50)])
+
+    def add(self, simulations: List[pd.Series]) -> None:
+        df_batch = pd.concat(simulations, axis=1)
+        self._extend_dates(pd.DatetimeIndex(df_batch.index))
+        batch = df_batch.reindex(self.dates).fillna(0).values.astype(np.int64)
+        end = self.iterations + batch.shape[1]
+        if end > self.values.shape[1]:
+            values = np.zeros((len(self.dates), max(end, 2 * self.values.shape[1])),
+                              dtype=np.int64)
+            values[:, :self.iterations] = self.values[:, :self.iterations]
+            self.values = values
+        self.values[:, self.iterations:end] = batch
+        self.iterations = end
+        self.sums += [batch.sum(axis=1), np.square(batch, dtype=np.float64).sum(axis=1)]
+
+        for group in range(len(self.group_bounds), self.iterations // self.group_size):
+            self.group_bounds.append(self._bounds(group))
+        while len(self.group_bounds) >= 2 * self.num_groups:
+            self.group_size *= 2
+            self.group_bounds = [self._bounds(group)
+                                 for group in range(self.iterations // self.group_size)]
+
+    def standard_error(self) -> pd.DataFrame:
+        if self.iterations < 2 * self.num_groups or len(self.group_bounds) < 2:
+            raise ValueError(f"At least {2 * self.num_groups} iterations are required.")
+        total, total_squares = self.sums
+        variance = (total_squares - total ** 2 / self.iterations) / (self.iterations - 1)
+        mcse = {"mean_val": np.sqrt(np.maximum(variance, 0.0) / self.iterations)}
+        bounds = np.stack(self.group_bounds)
+        errors = np.std(bounds, axis=0, ddof=1) / np.sqrt(len(bounds))
+        mcse["lb95"], mcse["ub95"], mcse["lb50"], mcse["ub50"] = errors
+        return pd.DataFrame(mcse, index=self.dates)
+
+    def get_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values[:, :self.iterations], index=self.dates)
+
+
+class SimulationPrecision(NamedTuple):
+    """The precision achieved by an adaptive simulation, see
+    :meth:`ICUSimulation.simulate_adaptive`."""
+    iterations: int
+    elapsed: float
+    stop_reason: str
+    mcse: pd.DataFrame
+
+    @property
+    def converged(self) -> bool:
+        """If the standard errors are under the tolerance."""
+        return self.stop_reason == "tolerance"
+
+    def max_error(self) -> float:
+        """Returns the maximum standard error over dates and statistics."""
+        return float(self.mcse.values.max())
 
 
 class ICUSimulationResults:
     """This class holds the results from many simulation rounds.
 
+    The results can be saved with :meth:`save` and loaded with
+    :meth:`load`, in which case the simulation instance isn't available.
+
     :param icu_simulation: the simulation instance that produced
                            the results.
     :param df_simulation: the results dataframe
+    :param stats: the timing statistics when the simulation was profiled
+    :param admissions: the admissions used for simulation, default to
+                       the admissions of the simulation instance
+
+    The summaries of the results (i.e. :meth:`hdi`) are computed once
+    and cached, the cache is cleared when the results dataframe is
+    replaced, and :meth:`invalidate_cache` must be called after the
+    dataframe is changed in place.
     """
-    def __init__(self, icu_simulation: ICUSimulation,
-                 df_simulation: pd.DataFrame):
+    OCCUPANCY_FILENAME: str = "occupancy.npy"
+    META_FILENAME: str = "meta.json"
+
+    def __init__(self, icu_simulation: Optional[ICUSimulation],
+                 df_simulation: pd.DataFrame,
+                 stats: Optional[SimulationStats] = None,
+                 admissions: Optional[ICUAdmissions] = None):
         self.df_simulation = df_simulation
         self.icu_simulation = icu_simulation
+        self.stats = stats
+        if admissions is None and icu_simulation is not None:
+            admissions = icu_simulation.get_admissions()
+        self.admissions = admissions
         self.plot = ICUSimulationResultsPlot(self)
+        self.precision: Optional[SimulationPrecision] = None
+
+    @property
+    def df_simulation(self) -> pd.DataFrame:
+        """The dataframe with the simulation results, with the dates
+        in the index and one column for each iteration."""
+        return self._df_simulation
+
+    @df_simulation.setter
+    def df_simulation(self, df_simulation: pd.DataFrame) -> None:
+        self._df_simulation = df_simulation
+        self.invalidate_cache()
+
+    def invalidate_cache(self) -> None:
+        """Clear the cached summaries of the results, this is needed
+        after the results dataframe is changed in place."""
+        self._cache: Dict[str, Any] = {}
+        self._cache_key: Optional[Tuple] = None
+
+    def _data_key(self) -> Tuple:
+        # Identifies the memory, shape and index of the results, so the
+        # cache is also cleared when the dataframe is replaced (in which
+        # case the memory of its values changes) without the setter,
+        # i.e. when a column or the index is assigned
+        values = self._df_simulation.values
+        return (values.__array_interface__["data"][0], values.shape,
+                values.dtype.str, id(self._df_simulation.index))
+
+    def _cached(self, name: str, compute: Callable[[], Any]) -> Any:
+        data_key = self._data_key()
+        if self._cache_key != data_key:
+            self._cache = {}
+            self._cache_key = data_key
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
 
     def get_admissions(self) -> ICUAdmissions:
         """Returns the admissions used for simulation."""
-        return self.icu_simulation.get_admissions()
+        if self.admissions is None:
+            raise ValueError("Simulation results without admissions.")
+        return self.admissions
+
+    @staticmethod
+    def _compact_dtype(values: np.ndarray) -> np.dtype:
+        max_occupancy = np.abs(values).max(initial=0)
+        for dtype in (np.int16, np.int32):
+            if max_occupancy <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+        return np.dtype(np.int64)
+
+    def save(self, directory: Union[str, Path]) -> Path:
+        """Save the results into a directory, with the occupancy as a
+        numpy file of the smallest integer type (int16 or int32) that
+        holds the maximum occupancy, and the dates and admissions in a
+        metadata file. The directory is written in a temporary directory
+        and then renamed. The simulation instance and stats aren't saved.
+
+        :param directory: the output directory
+        :returns: the output directory
+        """
+        directory = Path(directory)
+        values = self.df_simulation.values
+        dates = pd.DatetimeIndex(self.df_simulation.index)
+        meta: Dict[str, Any] = {
+            "start_date": dates.min().strftime("%Y-%m-%d"),
+            "date_offsets": (dates - dates.min()).days.tolist(),
+            "admissions": None,
+        }
+        if self.admissions is not None:
+            s_admissions = self.admissions.get_admissions_series()
+            meta["admissions"] = {
+                "dates": [str(date) for date in s_admissions.index],
+                "counts": s_admissions.values.tolist(),
+            }
+
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent,
+                                        prefix=f".{directory.name}."))
+        try:
+            np.save(tmp_dir / self.OCCUPANCY_FILENAME,
+                    np.ascontiguousarray(values, dtype=self._compact_dtype(values)))
+            with (tmp_dir / self.META_FILENAME).open("w", encoding="utf-8") as fhandle:
+                json.dump(meta, fhandle)
+            if directory.exists():
+                shutil.rmtree(directory)
+            os.replace(tmp_dir, directory)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return directory
+
+    @classmethod
+    def load(cls, directory: Union[str, Path],
+             mmap: bool = True) -> 'ICUSimulationResults':
+        """Load results saved with :meth:`save`.
+
+        :param directory: the results directory
+        :param mmap: if the occupancy should be memory-mapped (read-only),
+                     so it is only read from the disk when needed
+        :returns: the simulation results, without the simulation instance
+        """
+        directory = Path(directory)
+        with (directory / cls.META_FILENAME).open("r", encoding="utf-8") as fhandle:
+            meta = json.load(fhandle)
+        values = np.load(directory / cls.OCCUPANCY_FILENAME,
+                         mmap_mode="r" if mmap else None)
+        dates = pd.Timestamp(meta["start_date"]) \
+            + pd.to_timedelta(meta["date_offsets"], unit="D")
+        df_simulation = pd.DataFrame(values, index=dates, copy=False)
+
+        admissions = None
+        if meta["admissions"] is not None:
+            s_admissions = pd.Series(meta["admissions"]["counts"],
+                                     index=pd.to_datetime(meta["admissions"]["dates"]))
+            admissions = ICUAdmissions(s_admissions)
+        return cls(None, df_simulation, admissions=admissions)
 
     def get_simulation_results(self) -> pd.DataFrame:
         """Returns the dataframe with the simulation results."""
         return self.df_simulation
 
-    def hdi(self) -> pd.DataFrame:
+    def get_stats(self) -> Optional[SimulationStats]:
+        """Returns the timing statistics of the simulation, or None
+        if the simulation wasn't profiled."""
+        return self.stats
+
+    def get_precision(self) -> Optional[SimulationPrecision]:
+        """Returns the precision achieved when the results are from
+        an adaptive simulation, or None otherwise."""
+        return self.precision
+
+    def get_sorted_simulation(self) -> np.ndarray:
+        """Returns the simulation results of each date (row) sorted along
+        the iterations (columns), it is computed once and cached."""
+        return self._cached("sorted_simulation", lambda: np.sort(
+            self.df_simulation.values.astype(np.int64), axis=1))
+
+    def _shifted_simulation(self) -> Tuple[np.ndarray, int, int, int]:
+        # The sorted results of each date shifted to a disjoint range and
+        # flattened, to search the capacities of all the dates with a single
+        # binary search, see exceedance_probability()
+        def compute() -> Tuple[np.ndarray, int, int, int]:
+            sorted_simulation = self.get_sorted_simulation()
+            lowest = int(sorted_simulation.min(initial=0)) - 1
+            highest = int(sorted_simulation.max(initial=0))
+            span = highest - lowest + 1
+            offsets = np.arange(len(sorted_simulation), dtype=np.int64)[:, np.newaxis] * span
+            return (sorted_simulation - lowest + offsets).ravel(), lowest, highest, span
+        return self._cached("shifted_simulation", compute)
+
+    def _capacity_matrix(self, capacity: Union[float, Sequence[float],
+                                               pd.Series, pd.DataFrame]) -> pd.DataFrame:
+        dates = self.df_simulation.index
+        if isinstance(capacity, pd.DataFrame):
+            return capacity.reindex(dates).astype(np.float64)
+        if isinstance(capacity, pd.Series):
+            name = "capacity" if capacity.name is None else capacity.name
+            return capacity.reindex(dates).astype(np.float64).to_frame(name)
+        thresholds = np.atleast_1d(np.asarray(capacity, dtype=np.float64))
+        return pd.DataFrame(np.broadcast_to(thresholds, (len(dates), len(thresholds))),
+                            index=dates, columns=list(np.atleast_1d(capacity)))
+
+    def exceedance_probability(self, capacity: Union[float, Sequence[float],
+                                                     pd.Series, pd.DataFrame]) -> pd.DataFrame:
+        """Returns the probability that the occupancy exceeds (is greater
+        than) the capacity in each date. The queries are answered with a
+        binary search on the sorted simulation results of each date (see
+        :meth:`get_sorted_simulation`), which are sorted and shifted once
+        and cached, so each query takes O(log(dates * iterations)).
+
+        :param capacity: a capacity (number of beds), a list of capacities,
+                         a series with the capacity of each date or a
+                         dataframe with one capacity series per column.
+        :returns: a dataframe with the dates in the index and one column
+                  for each capacity, the probability is NaN for the dates
+                  without a capacity.
+        """
+        df_capacity = self._capacity_matrix(capacity)
+        num_dates, iterations = self.df_simulation.shape
+        shifted_simulation, lowest, highest, span = self._shifted_simulation()
+        thresholds = df_capacity.values
+        missing = np.isnan(thresholds)
+        # The occupancy is integer, so exceeding a capacity is the same
+        # as exceeding its floor, then the capacities are shifted as the
+        # results of their dates
+        thresholds = np.clip(np.floor(np.where(missing, lowest, thresholds)),
+                             lowest, highest).astype(np.int64)
+        offsets = np.arange(num_dates, dtype=np.int64)[:, np.newaxis] * span
+        positions = np.searchsorted(shifted_simulation,
+                                    thresholds - lowest + offsets, side="right")
+        not_exceeding = positions - np.arange(num_dates)[:, np.newaxis] * iterations
+        probability = 1.0 - not_exceeding / iterations
+        probability[missing] = np.nan
+        return pd.DataFrame(probability, index=df_capacity.index,
+                            columns=df_capacity.columns)
+
+    def hdi(self, chunk_size: int = 1024) -> pd.DataFrame:
         """Returns a dataframe with computed HPD (high density interval),
-        mean and median values."""
-        dates_idx = []
-        lb95_idx = []
-        ub95_idx = []
-        lb50_idx = []
-        ub50_idx = []
-        mean_idx = []
-        median_idx = []
-
-        for item in self.df_simulation.iterrows():
-            lb95, ub95 = az.hdi(item[1].values, hdi_prob=0.95)
-            lb50, ub50 = az.hdi(item[1].values, hdi_prob=0.50)
-            mean = np.mean(item[1].values)
-            median = np.median(item[1].values)
-            dates_idx.append(item[0])
-            lb95_idx.append(lb95)
-            ub95_idx.append(ub95)
-            lb50_idx.append(lb50)
-            ub50_idx.append(ub50)
-            mean_idx.append(mean)
-            median_idx.append(median)
-
-        df_final = pd.DataFrame({
-            "date": dates_idx,
-            "lb95": lb95_idx,
-            "ub95": ub95_idx,
-            "lb50": lb50_idx,
-            "ub50": ub50_idx,
-            "mean_val": mean_idx,
-            "median_val": median_idx,
-        })
+        mean and median values. It is computed once and cached, a copy
+        of the cached dataframe is returned.
+
+        :param chunk_size: number of dates processed at once, the results
+                           are read in chunks when memory-mapped.
+        """
+        return self._cached("hdi", lambda: self._compute_hdi(chunk_size)).copy()
+
+    def _compute_hdi(self, chunk_size: int) -> pd.DataFrame:
+        values = self.df_simulation.values
+        chunks = []
+        for start in range(0, len(values), chunk_size):
+            chunk = np.asarray(values[start:start + chunk_size])
+            lb95, ub95 = hdi_intervals(chunk, hdi_prob=0.95)
+            lb50, ub50 = hdi_intervals(chunk, hdi_prob=0.50)
+            chunks.append(pd.DataFrame({
+                "lb95": lb95,
+                "ub95": ub95,
+                "lb50": lb50,
+                "ub50": ub50,
+                "mean_val": np.mean(chunk, axis=1),
+                "median_val": np.median(chunk, axis=1),
+            }))
+
+        df_final = pd.concat(chunks, ignore_index=True)
+        df_final.insert(0, "date", self.df_simulation.index)
         return df_final
 
 
@@ -217,6 +958,9 @@ class ICUSimulationResultsPlot:
 
     def lineplot(self) -> Any:
         """Plot the simulation results and admissions used."""
+        import seaborn as sns
+        from matplotlib import pyplot as plt
+
         df_hdi = self.simulation_results.hdi()
         plt.plot(df_hdi.date, df_hdi.mean_val, color="orange", label="Estimated ICU Occupation")
         plt.fill_between(df_hdi.date, df_hdi.lb95, df_hdi.ub95, color="C1", alpha=0.3, label="95% credibility interval")
@@ -232,3 +976,613 @@ class ICUSimulationResultsPlot:
         plt.ylabel("ICU Occupancy (number of patients)")
         plt.legend()
         return plt.gca()
+
+    @staticmethod
+    def _date_edges(x: np.ndarray) -> np.ndarray:
+        # The edges of the cells centered on each date
+        if len(x) == 1:
+            return np.array([x[0] - 0.5, x[0] + 0.5])
+        middle = (x[1:] + x[:-1]) / 2.0
+        return np.concatenate([[2 * x[0] - middle[0]], middle,
+                               [2 * x[-1] - middle[-1]]])
+
+    def _occupancy_density(self, bins: int,
+                           chunk_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Fraction of the iterations in each occupancy bin of each date,
+        # the results are read in chunks when memory-mapped
+        values = self.simulation_results.df_simulation.values
+        num_dates, iterations = values.shape
+        lowest = float(values.min(initial=0))
+        highest = float(values.max(initial=0)) + 1.0
+        occupancy_edges = np.linspace(lowest, highest, bins + 1)
+        density = np.empty((num_dates, bins))
+        for start in range(0, num_dates, chunk_size):
+            chunk = np.asarray(values[start:start + chunk_size], dtype=np.float64)
+            bin_idx = np.clip(((chunk - lowest) * bins / (highest - lowest)).astype(np.int64),
+                              0, bins - 1)
+            bin_idx += np.arange(len(chunk))[:, np.newaxis] * bins
+            counts = np.bincount(bin_idx.ravel(), minlength=len(chunk) * bins)
+            density[start:start + len(chunk)] = counts.reshape(len(chunk), bins) / iterations
+        return occupancy_edges, density
+
+    def trajectories(self, mode: str = "lines",
+                     max_trajectories: Optional[int] = None,
+                     bins: int = 100, color: str = "C1",
+                     alpha: Optional[float] = None,
+                     chunk_size: int = 1024) -> Any:
+        """Plot the trajectories of the simulation iterations (spaghetti
+        plot) or their density in each date (fan chart), with the mean
+        occupancy. All the trajectories are drawn as a single line
+        collection and the density as a single pre-binned image, whose
+        rendering time doesn't depend on the number of iterations, so it
+        is recommended for many thousands of iterations.
+
+        :param mode: "lines" to draw each trajectory or "density" to
+                     draw the fraction of the iterations in each
+                     occupancy bin of each date.
+        :param max_trajectories: maximum number of trajectories drawn in
+                                 the "lines" mode, evenly spaced over the
+                                 iterations, default to all of them.
+        :param bins: number of occupancy bins in the "density" mode
+        :param color: color of the trajectories and of the mean
+        :param alpha: transparency of the trajectories, default to a
+                      value decreasing with the number of trajectories
+        :param chunk_size: number of dates binned at once
+        """
+        import seaborn as sns
+        from matplotlib import dates as mdates
+        from matplotlib import pyplot as plt
+        from matplotlib.collections import LineCollection
+
+        if mode not in ("lines", "density"):
+            raise ValueError(f"Unknown mode {mode}, use 'lines' or 'density'.")
+
+        df_simulation = self.simulation_results.df_simulation
+        x = mdates.date2num(pd.DatetimeIndex(df_simulation.index).to_pydatetime())
+        ax = plt.gca()
+        if mode == "lines":
+            iterations = df_simulation.shape[1]
+            columns = np.arange(iterations)
+            if max_trajectories is not None and max_trajectories < iterations:
+                columns = np.linspace(0, iterations - 1, max_trajectories).astype(np.int64)
+            segments = np.empty((len(columns), len(x), 2))
+            segments[:, :, 0] = x
+            segments[:, :, 1] = np.asarray(df_simulation.values[:, columns]).T
+            if alpha is None:
+                alpha = float(np.clip(10.0 / len(columns), 0.01, 1.0))
+            ax.add_collection(LineCollection(list(segments), colors=color, alpha=alpha,
+                                             linewidths=0.5, label="Simulated trajectories"))
+            ax.autoscale_view()
+        else:
+            occupancy_edges, density = self._occupancy_density(bins, chunk_size)
+            image = ax.pcolorfast(self._date_edges(x), occupancy_edges, density.T,
+                                  cmap="Oranges", alpha=alpha)
+            plt.colorbar(image, ax=ax, label="Fraction of the iterations")
+
+        df_hdi = self.simulation_results.hdi()
+        plt.plot(df_hdi.date, df_hdi.mean_val, color=color, lw=1.5,
+                 label="Estimated ICU Occupation")
+        ax.xaxis_date()
+        plt.grid(lw=0.5, linestyle=":", which="both")
+        sns.despine()
+        plt.xlabel("Date")
+        plt.ylabel("ICU Occupancy (number of patients)")
+        plt.legend()
+        return ax
+
+
+def hdi_intervals(samples: np.ndarray,
+                  hdi_prob: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes the HDI (highest density interval) along the last axis
+    of the samples, vectorized over the other axes. It is the same
+    interval computed by :func:`arviz.hdi` for unimodal distributions.
+
+    :param samples: the samples, with the draws in the last axis
+    :param hdi_prob: the probability of the interval
+    :returns: the lower and upper bounds of the intervals
+    """
+    sorted_samples = np.sort(samples, axis=-1)
+    num_samples = sorted_samples.shape[-1]
+    interval_idx_inc = int(np.floor(hdi_prob * num_samples))
+    num_intervals = num_samples - interval_idx_inc
+    if num_intervals <= 0:
+        raise ValueError("Too few samples for the HDI probability.")
+    interval_width = np.subtract(sorted_samples[..., interval_idx_inc:],
+                                 sorted_samples[..., :num_intervals],
+                                 dtype=np.float64)
+    min_idx = np.argmin(interval_width, axis=-1)[..., np.newaxis]
+    hdi_min = np.take_along_axis(sorted_samples, min_idx, axis=-1)[..., 0]
+    hdi_max = np.take_along_axis(sorted_samples, min_idx + interval_idx_inc,
+                                 axis=-1)[..., 0]
+    return hdi_min, hdi_max
+
+
+class MultiHospitalSimulation:
+    """This is the simulation of ICU/beds occupancy for many hospitals
+    at once. All hospitals are simulated in a vectorized pass over chunks
+    of simulation rounds, producing the occupancy for each hospital,
+    iteration and date. The occupancy of the groups of a hierarchy (i.e.
+    regions and states) is the sum of the occupancy of their hospitals
+    in each iteration, so the intervals of each level are computed from
+    its own draws and not from the intervals of the hospitals.
+
+    :param admissions: a dataframe with dates in the index, one column
+                       for each hospital and the admissions for each day,
+                       the dates without admissions can be omitted.
+    :param duration_distribution: the duration distribution shared by all
+                                  hospitals, or a mapping from the hospital
+                                  to its duration distribution.
+    :param hierarchy: a dataframe indexed by the hospitals, with one column
+                      for each level of the hierarchy (i.e. "region" and
+                      "state") with the group of the hospital in the level.
+    """
+    # The number of stays (patients x rounds) simulated at once by default
+    CHUNK_STAYS: int = 1 << 22
+
+    def __init__(self, admissions: pd.DataFrame,
+                 duration_distribution: Union[DurationDistribution,
+                                              Mapping[Any, DurationDistribution]],
+                 hierarchy: Optional[pd.DataFrame] = None):
+        if admissions.empty:
+            raise ValueError("Empty admission dataframe.")
+        # The row of each date is its day offset, so the admissions of
+        # duplicated dates are summed and the gaps are filled with zero
+        admissions = admissions.fillna(0).astype(np.int64)
+        admissions.index = pd.DatetimeIndex(admissions.index).normalize()
+        self.admissions = admissions.groupby(level=0).sum().asfreq("D", fill_value=0)
+        self.duration_distribution = duration_distribution
+        self.hierarchy = hierarchy
+        hospitals = set(self.admissions.columns)
+        if isinstance(duration_distribution, Mapping):
+            missing = hospitals.difference(duration_distribution)
+            if missing:
+                raise ValueError(f"Hospitals {sorted(missing)} without a duration distribution.")
+        if hierarchy is not None:
+            missing = hospitals.difference(hierarchy.index)
+            if missing:
+                raise ValueError(f"Hospitals {sorted(missing)} not found in the hierarchy.")
+            # Every hospital belongs to a group of each level, so the
+            # groups of a level sum to the total
+            levels = hierarchy.loc[self.hospitals]
+            for level in levels.columns:
+                missing = levels.index[levels[level].isna()]
+                if len(missing) > 0:
+                    raise ValueError(f"Hospitals {sorted(missing)} without a group "
+                                     f"in the level {level} of the hierarchy.")
+
+    @property
+    def hospitals(self) -> pd.Index:
+        """Returns the hospitals."""
+        return self.admissions.columns
+
+    def _sample_los(self, round_indices: range, patient_hospital: np.ndarray,
+                    sampler: Optional[DurationSampler]) -> np.ndarray:
+        # The durations with the shape (rounds, patients)
+        iterations, num_patients = len(round_indices), len(patient_hospital)
+        if sampler is not None:
+            uniforms = sampler.batch_uniforms(num_patients, round_indices.start,
+                                              round_indices.stop)
+            if not isinstance(self.duration_distribution, Mapping):
+                return np.asarray(self.duration_distribution.quantile(uniforms), dtype=np.int64)
+            los = np.empty((iterations, num_patients), dtype=np.int64)
+            for hospital_idx, hospital in enumerate(self.hospitals):
+                patients = patient_hospital == hospital_idx
+                los[:, patients] = self.duration_distribution[hospital].quantile(uniforms[:, patients])
+            return los
+
+        if not isinstance(self.duration_distribution, Mapping):
+            los = self.duration_distribution.sample(iterations * num_patients)
+            return np.asarray(los, dtype=np.int64).reshape(iterations, num_patients)
+
+        los = np.empty((iterations, num_patients), dtype=np.int64)
+        for hospital_idx, hospital in enumerate(self.hospitals):
+            patients = np.flatnonzero(patient_hospital == hospital_idx)
+            if len(patients) == 0:
+                continue
+            samples = self.duration_distribution[hospital].sample(iterations * len(patients))
+            los[:, patients] = np.asarray(samples).reshape(iterations, len(patients))
+        return los
+
+    def simulate(self, iterations: int = 10,
+                 dtype: Any = np.int32,
+                 sampling: Optional[Union[str, DurationSampler]] = None,
+                 seed: Optional[int] = None,
+                 chunk_size: Optional[int] = None) -> 'MultiHospitalSimulationResults':
+        """This method will perform many rounds of simulation for all
+        hospitals. Each patient occupies a bed from the admission date
+        for a length of stay drawn from the duration distribution. The
+        rounds are simulated in chunks, so the memory of the stays of the
+        patients is bounded by the chunk and the peak memory is about
+        the size of the occupancy array.
+
+        :param iterations: number of simulation rounds to incorporate
+                           the uncertainty from the LoS distribution.
+        :param dtype: the type of the occupancy array, which has the
+                      shape (hospitals, iterations, dates).
+        :param sampling: the sampling of the durations, see
+                         :meth:`ICUSimulation.simulate`
+        :param seed: the seed of the sampling, see :meth:`ICUSimulation.simulate`
+        :param chunk_size: number of rounds simulated at once, default to
+                           the rounds of about `CHUNK_STAYS` stays.
+                           With a sampling, the results don't depend on it.
+        :returns: the simulation results
+        """
+        counts = self.admissions.values
+        num_dates, num_hospitals = counts.shape
+        date_idx, hospital_idx = np.nonzero(counts)
+        repeats = counts[date_idx, hospital_idx]
+        patient_start = np.repeat(date_idx, repeats)
+        patient_hospital = np.repeat(hospital_idx, repeats)
+
+        sampler = ICUSimulation._get_sampler(sampling, seed)
+        if sampler is not None:
+            sampler.check_rounds([len(patient_hospital)], iterations)
+        if chunk_size is None:
+            chunk_size = max(self.CHUNK_STAYS // max(len(patient_hospital), 1), 1)
+
+        # Occupancy of each (hospital, iteration) along the dates, with the
+        # dates extended when the stays of a chunk end after the last one
+        occupancy = np.zeros((num_hospitals, iterations, num_dates), dtype=dtype)
+        for start in range(0, iterations, chunk_size):
+            round_indices = range(start, min(start + chunk_size, iterations))
+            chunk = len(round_indices)
+            patient_end = patient_start + self._sample_los(round_indices, patient_hospital, sampler)
+            horizon = max(num_dates, int(patient_end.max(initial=0)))
+            if horizon > occupancy.shape[2]:
+                extended = np.zeros((num_hospitals, iterations, horizon), dtype=dtype)
+                extended[..., :occupancy.shape[2]] = occupancy
+                occupancy = extended
+            row = patient_hospital * chunk + np.arange(chunk)[:, np.newaxis]
+            chunk_occupancy = _occupancy_from_stays(row, patient_start, patient_end,
+                                                    num_hospitals * chunk, horizon, dtype)
+            occupancy[:, start:start + chunk, :horizon] = \
+                chunk_occupancy.reshape(num_hospitals, chunk, horizon)
+        dates = pd.date_range(self.admissions.index[0], periods=occupancy.shape[2])
+        return MultiHospitalSimulationResults(self, occupancy, dates)
+
+
+class MultiHospitalSimulationResults:
+    """This class holds the results from the multi-hospital simulation,
+    see :class:`MultiHospitalSimulation`.
+
+    :param simulation: the simulation instance that produced the results.
+    :param occupancy: the occupancy with shape (hospitals, iterations, dates)
+    :param dates: the dates of the last axis of the occupancy
+    """
+    HOSPITAL_LEVEL: str = "hospital"
+    TOTAL_LEVEL: str = "total"
+
+    def __init__(self, simulation: MultiHospitalSimulation,
+                 occupancy: np.ndarray, dates: pd.DatetimeIndex):
+        self.simulation = simulation
+        self.occupancy = occupancy
+        self.dates = dates
+
+    def get_occupancy_array(self) -> np.ndarray:
+        """Returns the occupancy with shape (hospitals, iterations, dates)."""
+        return self.occupancy
+
+    def aggregate(self, level: str = HOSPITAL_LEVEL) -> Tuple[pd.Index, np.ndarray]:
+        """Sum the occupancy of each iteration for the groups of a level.
+
+        :param level: a level (column) of the hierarchy, "hospital" for
+                      the hospitals or "total" for the sum of all hospitals
+        :returns: the groups and the occupancy with the shape
+                  (groups, iterations, dates)
+        """
+        if level == self.HOSPITAL_LEVEL:
+            return self.simulation.hospitals, self.occupancy
+        if level == self.TOTAL_LEVEL:
+            return pd.Index([self.TOTAL_LEVEL]), self.occupancy.sum(axis=0, keepdims=True)
+        hierarchy = self.simulation.hierarchy
+        if hierarchy is None or level not in hierarchy.columns:
+            raise ValueError(f"Level {level} not found in the hierarchy.")
+        codes, groups = pd.factorize(hierarchy.loc[self.simulation.hospitals, level])
+        aggregated = np.stack([self.occupancy[codes == code].sum(axis=0)
+                               for code in range(len(groups))])
+        return pd.Index(groups), aggregated
+
+    def get_simulation_results(self, group: Any,
+                               level: str = HOSPITAL_LEVEL) -> pd.DataFrame:
+        """Returns the dataframe with the simulation results of a group,
+        with the dates in the index and one column for each iteration,
+        as in :meth:`ICUSimulationResults.get_simulation_results`.
+
+        :param group: the hospital or the group of the level
+        :param level: the level, see :meth:`aggregate`
+        """
+        groups, aggregated = self.aggregate(level)
+        return pd.DataFrame(aggregated[groups.get_loc(group)].T, index=self.dates)
+
+    def hdi(self, level: str = HOSPITAL_LEVEL) -> pd.DataFrame:
+        """Returns a dataframe with computed HPD (high density interval),
+        mean and median values for each group of a level and date.
+
+        :param level: the level, see :meth:`aggregate`
+        """
+        groups, aggregated = self.aggregate(level)
+        lb95, ub95 = hdi_intervals(aggregated.swapaxes(1, 2), 0.95)
+        lb50, ub50 = hdi_intervals(aggregated.swapaxes(1, 2), 0.50)
+        return pd.DataFrame({
+            level: np.repeat(groups.values, len(self.dates)),
+            "date": np.tile(self.dates.values, len(groups)),
+            "lb95": lb95.ravel(),
+            "ub95": ub95.ravel(),
+            "lb50": lb50.ravel(),
+            "ub50": ub50.ravel(),
+            "mean_val": aggregated.mean(axis=1).ravel(),
+            "median_val": np.median(aggregated, axis=1).ravel(),
+        })
+
+
+class PathwayStage(NamedTuple):
+    """A stage of the patient pathway (i.e. ward, ICU or step-down unit),
+    see :class:`PathwaySimulation`.
+
+    :param duration: the duration distribution of the stays in the stage,
+                     or a mapping from the outcome to its distribution.
+    :param transitions: a mapping from the next stages to the probability
+                        of moving to them at the end of the stay, or to a
+                        mapping from the outcome to the probability. The
+                        remaining probability is of leaving the pathway
+                        (i.e. discharge or death).
+    """
+    duration: Union[DurationDistribution, Mapping[Any, DurationDistribution]]
+    transitions: Optional[Mapping[str, Union[float, Mapping[Any, float]]]] = None
+
+
+class PathwaySimulation:
+    """This is the simulation of the occupancy of every stage of a patient
+    pathway (i.e. ward -> ICU -> step-down unit). The admitted patients
+    enter the pathway in the entry stage, stay in each stage for a duration
+    drawn from its distribution, and then move to one of the next stages
+    (on the same day of the discharge) or leave the pathway, according
+    to the transition probabilities. Each patient can have an outcome
+    (i.e. the "OUTCOME" column of :func:`episuite.data.admissions_sample`),
+    drawn at the admission, which selects the duration distributions and
+    the transition probabilities of the patient in every stage::
+
+        df = data.admissions_sample()
+        outcomes = df.OUTCOME.value_counts(normalize=True)
+        icu_durations = Durations(df).get_bootstrap_by("OUTCOME")
+        stages = {
+            "ward": PathwayStage(EmpiricalBootstrap([1, 2, 4]),
+                                 {"icu": {"DEATH": 0.6, "RECOVERY": 0.2}}),
+            "icu": PathwayStage(icu_durations, {"step-down": {"RECOVERY": 0.9}}),
+            "step-down": PathwayStage(EmpiricalBootstrap([2, 3])),
+        }
+        simulation = PathwaySimulation(admissions, stages, outcomes)
+
+    All stages and simulation rounds are simulated in a single vectorized
+    pass, with the stays as integer offsets of days. The stages are
+    processed in the order of the pathway, so it can't have cycles.
+
+    :param admissions: the admissions (observed or forecast)
+    :param stages: a mapping from the stage name to the stage
+    :param outcome_probabilities: a mapping (or series) from the outcome
+                                  to its probability, required when the
+                                  stages depend on the outcome.
+    :param entry_stage: the stage of the admitted patients, default
+                        to the first stage.
+    :param admission_trajectories: the samples of an admissions forecast,
+                                   see :class:`ICUSimulation`.
+    """
+    def __init__(self, admissions: ICUAdmissions,
+                 stages: Mapping[str, PathwayStage],
+                 outcome_probabilities: Optional[Union[Mapping[Any, float], pd.Series]] = None,
+                 entry_stage: Optional[str] = None,
+                 admission_trajectories: Optional[pd.DataFrame] = None):
+        if not stages:
+            raise ValueError("A pathway requires at least one stage.")
+        self.admissions = admissions
+        self.stages = dict(stages)
+        self.entry_stage = entry_stage or next(iter(self.stages))
+        if self.entry_stage not in self.stages:
+            raise ValueError(f"Entry stage {self.entry_stage} not found in the stages.")
+        self.admission_trajectories = admission_trajectories
+        self._admission_dates, self._admission_counts = ICUSimulation._combine_trajectories(
+            admissions, admission_trajectories)
+
+        self.outcomes: List[Any] = [None]
+        self._outcome_cdf = np.ones(1)
+        if outcome_probabilities is not None:
+            outcome_probabilities = dict(outcome_probabilities)
+            probabilities = np.asarray(list(outcome_probabilities.values()), dtype=np.float64)
+            if (probabilities < 0).any() or not np.isclose(probabilities.sum(), 1.0):
+                raise ValueError("The outcome probabilities should sum to 1.")
+            self.outcomes = list(outcome_probabilities)
+            self._outcome_cdf = np.cumsum(probabilities)
+            self._outcome_cdf[-1] = 1.0
+        self._order = self._stage_order()
+        self._transitions = {name: self._transition_matrix(name) for name in self.stages}
+        for name in self.stages:
+            self._check_outcomes(name, self.stages[name].duration)
+        self._check_durations()
+
+    def _stage_order(self) -> List[str]:
+        # The stages in the order of the pathway (topological sort), so the
+        # stays of a stage are known before the stages after it
+        incoming = {name: 0 for name in self.stages}
+        for name, stage in self.stages.items():
+            for target in stage.transitions or {}:
+                if target not in self.stages:
+                    raise ValueError(f"Transition from {name} to an unknown stage {target}.")
+                incoming[target] += 1
+        order = [name for name, count in incoming.items() if count == 0]
+        for name in order:
+            for target in self.stages[name].transitions or {}:
+                incoming[target] -= 1
+                if incoming[target] == 0:
+                    order.append(target)
+        if len(order) < len(self.stages):
+            raise ValueError("The pathway has a cycle between the stages "
+                             f"{sorted(set(self.stages) - set(order))}.")
+        return order
+
+    def _check_outcomes(self, name: str, value: Any) -> None:
+        if not isinstance(value, Mapping):
+            return
+        unknown = set(value).difference(self.outcomes)
+        if unknown or self.outcomes == [None]:
+            raise ValueError(f"Stage {name} with unknown outcomes {sorted(unknown, key=str)}, "
+                             f"the outcomes are {self.outcomes}.")
+
+    def _check_durations(self) -> None:
+        # The outcomes of the patients that can reach each stage, the
+        # durations by outcome should have all of them
+        probabilities = np.diff(self._outcome_cdf, prepend=0.0)
+        reachable: Dict[str, Set[int]] = {name: set() for name in self.stages}
+        reachable[self.entry_stage] = set(np.flatnonzero(probabilities > 0))
+        for name in self._order:
+            targets, cdf = self._transitions[name]
+            transitions = np.diff(cdf, axis=1, prepend=0.0)
+            for column, target in enumerate(targets):
+                reachable[target].update(code for code in reachable[name]
+                                         if transitions[code, column] > 0)
+            duration = self.stages[name].duration
+            if not isinstance(duration, Mapping):
+                continue
+            missing = [self.outcomes[code] for code in sorted(reachable[name])
+                       if self.outcomes[code] not in duration]
+            if missing:
+                raise ValueError(f"Stage {name} without durations for the outcomes {missing}.")
+
+    def _transition_matrix(self, name: str) -> Tuple[List[str], np.ndarray]:
+        # The next stages and the cumulative probabilities of moving to
+        # them, with the shape (outcomes, next stages)
+        transitions = self.stages[name].transitions or {}
+        probabilities = np.zeros((len(self.outcomes), len(transitions)))
+        for column, value in enumerate(transitions.values()):
+            self._check_outcomes(name, value)
+            if isinstance(value, Mapping):
+                probabilities[:, column] = [value.get(outcome, 0.0) for outcome in self.outcomes]
+            else:
+                probabilities[:, column] = value
+        if (probabilities < 0).any() or (probabilities.sum(axis=1) > 1.0 + 1e-9).any():
+            raise ValueError(f"The transition probabilities of stage {name} "
+                             "should be positive and sum to at most 1.")
+        return list(transitions), np.cumsum(probabilities, axis=1)
+
+    def _sample_stage_durations(self, name: str, outcome: np.ndarray,
+                                rng: Optional[np.random.Generator]) -> np.ndarray:
+        duration = self.stages[name].duration
+        if not isinstance(duration, Mapping):
+            return _sample_durations(duration, len(outcome), rng)
+        los = np.zeros(len(outcome), dtype=np.int64)
+        for code, outcome_name in enumerate(self.outcomes):
+            patients = np.flatnonzero(outcome == code)
+            if len(patients) > 0:
+                los[patients] = _sample_durations(duration[outcome_name], len(patients), rng)
+        return los
+
+    @staticmethod
+    def _concat_entries(entries: List[Tuple[np.ndarray, ...]]) -> Tuple[np.ndarray, ...]:
+        # The rounds, entry dates and outcomes of the patients entering a
+        # stage, from the admissions or from the previous stages
+        if not entries:
+            return (np.zeros(0, dtype=np.int64),) * 3
+        return tuple(np.concatenate(values) for values in zip(*entries))
+
+    def simulate(self, iterations: Optional[int] = None,
+                 dtype: Any = np.int32,
+                 seed: Optional[int] = None) -> 'PathwaySimulationResults':
+        """This method will perform many rounds of simulation for all the
+        stages of the pathway.
+
+        :param iterations: number of simulation rounds, default to the
+                           number of admission trajectories or to 10
+                           without them.
+        :param dtype: the type of the occupancy array, which has the
+                      shape (stages, iterations, dates).
+        :param seed: the seed of the outcomes, transitions and durations,
+                     which are drawn with the quantile functions of the
+                     distributions when it is given.
+        :returns: the simulation results
+        """
+        num_trajectories = len(self._admission_counts)
+        if iterations is None:
+            iterations = 10 if self.admission_trajectories is None else num_trajectories
+        counts = self._admission_counts[np.arange(iterations) % num_trajectories]
+        round_idx, date_idx = np.nonzero(counts)
+        repeats = counts[round_idx, date_idx]
+        offsets = np.asarray((self._admission_dates - self._admission_dates[0]).days)
+
+        rng = np.random.default_rng(seed)
+        patient_round = np.repeat(round_idx, repeats)
+        patient_outcome = np.searchsorted(self._outcome_cdf, rng.random(len(patient_round)),
+                                          side="right")
+        patient_outcome = np.minimum(patient_outcome, len(self.outcomes) - 1)
+        entries: Dict[str, List[Tuple[np.ndarray, ...]]] = {name: [] for name in self.stages}
+        entries[self.entry_stage].append((patient_round, np.repeat(offsets[date_idx], repeats),
+                                          patient_outcome))
+
+        stays = {}
+        for name in self._order:
+            stage_round, start, outcome = self._concat_entries(entries[name])
+            end = start + self._sample_stage_durations(name, outcome,
+                                                       None if seed is None else rng)
+            stays[name] = (stage_round, start, end)
+            targets, cdf = self._transitions[name]
+            next_stage = (rng.random(len(outcome))[:, np.newaxis] >= cdf[outcome]).sum(axis=1)
+            for column, target in enumerate(targets):
+                moving = next_stage == column
+                entries[target].append((stage_round[moving], end[moving], outcome[moving]))
+
+        horizon = max([int(offsets[-1]) + 1] + [int(end.max(initial=0))
+                                                for _, _, end in stays.values()])
+        occupancy = np.stack([_occupancy_from_stays(*stays[name], iterations, horizon, dtype)
+                              for name in self.stages])
+        dates = pd.date_range(self._admission_dates[0], periods=horizon)
+        return PathwaySimulationResults(self, occupancy, dates)
+
+
+class PathwaySimulationResults:
+    """This class holds the results from the pathway simulation, see
+    :class:`PathwaySimulation`.
+
+    :param simulation: the simulation instance that produced the results.
+    :param occupancy: the occupancy with shape (stages, iterations, dates)
+    :param dates: the dates of the last axis of the occupancy
+    """
+    def __init__(self, simulation: PathwaySimulation,
+                 occupancy: np.ndarray, dates: pd.DatetimeIndex):
+        self.simulation = simulation
+        self.occupancy = occupancy
+        self.dates = dates
+
+    @property
+    def stages(self) -> List[str]:
+        """Returns the stages, in the order of the first axis of the occupancy."""
+        return list(self.simulation.stages)
+
+    def get_occupancy_array(self) -> np.ndarray:
+        """Returns the occupancy with shape (stages, iterations, dates)."""
+        return self.occupancy
+
+    def get_simulation_results(self, stage: str) -> ICUSimulationResults:
+        """Returns the simulation results of a stage, with the summaries
+        and plots of :class:`ICUSimulationResults`.
+
+        :param stage: the stage
+        """
+        if stage not in self.simulation.stages:
+            raise ValueError(f"Stage {stage} not found in the pathway.")
+        df_simulation = pd.DataFrame(self.occupancy[self.stages.index(stage)].T,
+                                     index=self.dates)
+        return ICUSimulationResults(None, df_simulation, admissions=self.simulation.admissions)
+
+    def hdi(self) -> pd.DataFrame:
+        """Returns a dataframe with computed HPD (high density interval),
+        mean and median values for each stage and date."""
+        lb95, ub95 = hdi_intervals(self.occupancy.swapaxes(1, 2), 0.95)
+        lb50, ub50 = hdi_intervals(self.occupancy.swapaxes(1, 2), 0.50)
+        return pd.DataFrame({
+            "stage": np.repeat(self.stages, len(self.dates)),
+            "date": np.tile(self.dates.values, len(self.stages)),
+            "lb95": lb95.ravel(),
+            "ub95": ub95.ravel(),
+            "lb50": lb50.ravel(),
+            "ub50": ub50.ravel(),
+            "mean_val": self.occupancy.mean(axis=1).ravel(),
+            "median_val": np.median(self.occupancy, axis=1).ravel(),
+        })
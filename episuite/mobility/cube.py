@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from episuite import data
+
+
+class MobilityCube:
+    """This is a dense representation of mobility data as an array of
+    float32 values with the shape (regions, dates, categories), where the
+    dates are contiguous days. The region labels are dictionary encoded,
+    each label maps to its index in the first axis of the array, so the
+    time series of a region is a view of the array. Missing values are
+    represented as NaN. The cube can be saved and then loaded as a
+    memory-mapped array that is shared by many processes without copies.
+
+    :param values: array with the shape (regions, dates, categories)
+    :param regions: the labels of the regions
+    :param start_date: the date of the first element of the dates axis
+    :param categories: the names of the mobility categories
+    """
+    VALUES_FILENAME: str = "values.npy"
+    META_FILENAME: str = "meta.json"
+
+    def __init__(self, values: np.ndarray,
+                 regions: Sequence[str],
+                 start_date: Union[str, pd.Timestamp],
+                 categories: Sequence[str]):
+        self.values = values
+        self.regions = pd.Index(regions)
+        self.start_date = pd.Timestamp(start_date)
+        self.categories = list(categories)
+        expected_shape = (len(self.regions), self.values.shape[1],
+                          len(self.categories))
+        if self.values.shape != expected_shape:
+            raise ValueError(f"Values with shape {self.values.shape}, "
+                             f"expected {expected_shape}.")
+        self._region_codes: Dict[str, int] = {
+            region: i for i, region in enumerate(self.regions)}
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame,
+                       region_columns: Sequence[str],
+                       date_column: str,
+                       value_columns: Sequence[str],
+                       categories: Optional[Sequence[str]] = None,
+                       separator: str = "|") -> 'MobilityCube':
+        """Build the cube from a long dataframe, with one row for
+        each region and date.
+
+        :param df: the dataframe
+        :param region_columns: the columns identifying the region, the
+                               label of the region is the join of the
+                               non-empty values of these columns
+        :param date_column: the date column
+        :param value_columns: the columns with the values of
+                              each mobility category
+        :param categories: the names of the categories, default to
+                           the value columns
+        :param separator: separator of the region columns in the label
+        :returns: the mobility cube
+        """
+        if len(df) == 0:
+            raise ValueError("Empty mobility dataframe.")
+        keys = pd.DataFrame({
+            column: df[column].astype(object).where(df[column].notna(), "").astype(str)
+            for column in region_columns
+        })
+        codes, uniques = pd.MultiIndex.from_frame(keys).factorize()
+        regions = [separator.join(value for value in key if value)
+                   for key in uniques]
+
+        dates = pd.to_datetime(df[date_column]).dt.normalize()
+        start_date = dates.min()
+        date_idx = (dates - start_date).dt.days.values
+        num_dates = int(date_idx.max()) + 1
+
+        values = np.full((len(regions), num_dates, len(value_columns)),
+                         np.nan, dtype=np.float32)
+        values[codes, date_idx] = df[list(value_columns)].to_numpy(dtype=np.float32)
+        return cls(values, regions, start_date, categories or value_columns)
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        """Returns the dates of the dates axis."""
+        return pd.date_range(self.start_date, periods=self.values.shape[1])
+
+    def region_code(self, region: str) -> int:
+        """Returns the index of the region in the first axis.
+
+        :param region: the region label
+        """
+        try:
+            return self._region_codes[region]
+        except KeyError:
+            raise KeyError(f"Region {region} not found in the cube.") from None
+
+    def region_values(self, region: str) -> np.ndarray:
+        """Returns the values of a region with the shape (dates, categories),
+        which is a view of the cube values.
+
+        :param region: the region label
+        """
+        return self.values[self.region_code(region)]
+
+    def region_series(self, region: str) -> pd.DataFrame:
+        """Returns the time series of a region as a dataframe indexed
+        by date and with one column for each category.
+
+        :param region: the region label
+        """
+        return pd.DataFrame(self.region_values(region),
+                            index=self.dates, columns=self.categories)
+
+    def save(self, directory: Union[str, Path],
+             source: Optional[Union[str, Path]] = None) -> Path:
+        """Save the cube into a directory, with the values as a numpy
+        file that can be memory-mapped. The directory is written in a
+        temporary directory and then renamed.
+
+        :param directory: the output directory
+        :param source: the source file used to build the cube, its
+                       signature is recorded in the directory (see
+                       :func:`episuite.data.is_source_signature_valid`)
+        :returns: the output directory
+        """
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent,
+                                        prefix=f".{directory.name}."))
+        try:
+            np.save(tmp_dir / self.VALUES_FILENAME,
+                    np.ascontiguousarray(self.values, dtype=np.float32))
+            meta = {
+                "regions": [str(region) for region in self.regions],
+                "start_date": self.start_date.strftime("%Y-%m-%d"),
+                "categories": self.categories,
+            }
+            with (tmp_dir / self.META_FILENAME).open("w", encoding="utf-8") as fhandle:
+                json.dump(meta, fhandle)
+            if source is not None:
+                data.write_source_signature(tmp_dir, source)
+            if directory.exists():
+                shutil.rmtree(directory)
+            os.replace(tmp_dir, directory)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return directory
+
+    @classmethod
+    def load(cls, directory: Union[str, Path],
+             mmap: bool = True) -> 'MobilityCube':
+        """Load a cube saved with :meth:`save`.
+
+        :param directory: the cube directory
+        :param mmap: if the values should be memory-mapped (read-only)
+        :returns: the mobility cube
+        """
+        directory = Path(directory)
+        with (directory / cls.META_FILENAME).open("r", encoding="utf-8") as fhandle:
+            meta = json.load(fhandle)
+        values = np.load(directory / cls.VALUES_FILENAME,
+                         mmap_mode="r" if mmap else None)
+        return cls(values, meta["regions"], meta["start_date"],
+                   meta["categories"])
+
+    @staticmethod
+    def cache_name(prefix: str, codes: Optional[List[str]]) -> str:
+        """Returns the name of the cube in the cache directory.
+
+        :param prefix: the dataset prefix
+        :param codes: the country codes of the cube or None for all
+        """
+        suffix = "all" if codes is None else "_".join(sorted(codes))
+        return f"{prefix}_cube_{suffix}"
+
+    def __repr__(self) -> str:
+        regions, dates, categories = self.values.shape
+        return f"MobilityCube[Regions={regions}, Dates={dates}, " \
+            f"Categories={categories}]"
@@ -1,36 +1,223 @@
+import concurrent.futures
 import datetime
+import hashlib
 import io
+import itertools
 import json
+import os
 import re
+import tempfile
+import time
 import typing
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 from zipfile import ZipFile
 
 import pandas as pd
 import requests
-import seaborn as sns
 from bs4 import BeautifulSoup
-from matplotlib import dates as mdates
-from matplotlib import pyplot as plt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from episuite import data
+from episuite.mobility.cube import MobilityCube
+
+
+class SurveyQuery(typing.NamedTuple):
+    country_name: str
+    region_name: str
+    indicator: str
+    type_: str
+
+
+class SurveyResponseCache:
+    """This is an incremental on-disk cache of the responses of the
+    COVID-19 World Survey Data API. The responses of each query (country,
+    region, indicator and type) are stored in a Parquet file, and the
+    date ranges already requested are recorded in an index, so only the
+    missing date ranges need to be requested. This requires the
+    optional pyarrow dependency.
+
+    :param cache_dir: the cache directory, default to a directory
+                      inside the episuite cache directory.
+    """
+    INDEX_FILENAME: str = "index.json"
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None \
+            else data.get_cache_dir_file("survey_cache")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_dir / self.INDEX_FILENAME
+
+    @staticmethod
+    def _entry_name(query: SurveyQuery) -> str:
+        return hashlib.sha1("|".join(query).encode("utf-8")).hexdigest()
+
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        if not self.index_file.exists():
+            return {}
+        with self.index_file.open("r", encoding="utf-8") as fhandle:
+            index: Dict[str, Dict[str, Any]] = json.load(fhandle)
+        return index
+
+    def coverage(self, query: SurveyQuery) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """Returns the date ranges already requested for a query.
+
+        :param query: the survey query
+        """
+        entry = self._read_index().get(self._entry_name(query))
+        if entry is None:
+            return []
+        return [(pd.Timestamp(start), pd.Timestamp(end))
+                for start, end in entry["coverage"]]
+
+    def missing_ranges(self, query: SurveyQuery, start: pd.Timestamp,
+                       end: pd.Timestamp) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """Returns the date ranges between start and end (inclusive)
+        that were not requested yet for a query.
+
+        :param query: the survey query
+        :param start: the start date
+        :param end: the end date
+        """
+        missing = []
+        current = start
+        for covered_start, covered_end in self.coverage(query):
+            if covered_end < current:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > current:
+                missing.append((current, covered_start - pd.Timedelta(days=1)))
+            current = max(current, covered_end + pd.Timedelta(days=1))
+        if current <= end:
+            missing.append((current, end))
+        return missing
+
+    def update(self, query: SurveyQuery, df: pd.DataFrame,
+               date_ranges: List[Tuple[pd.Timestamp, pd.Timestamp]]) -> None:
+        """Merge the responses of the requested date ranges into the cache.
+        The dates after the last survey date returned aren't recorded as
+        covered, since they may not be published yet, so they are
+        requested again in the next updates.
+
+        :param query: the survey query
+        :param df: the responses
+        :param date_ranges: the date ranges requested
+        """
+        name = self._entry_name(query)
+        fname = self.cache_dir / f"{name}.parquet"
+        if len(df) > 0:
+            if fname.exists():
+                df = pd.concat([pd.read_parquet(fname), df], ignore_index=True)
+            df = df.drop_duplicates(subset="survey_date", keep="last")
+            df = df.sort_values("survey_date").reset_index(drop=True)
+            df.to_parquet(fname, index=False)
+        elif fname.exists():
+            df = pd.read_parquet(fname, columns=["survey_date"])
+        if len(df) == 0:
+            return
+
+        # Only the requested dates up to the last survey date are covered
+        last_date = df.survey_date.max()
+        date_ranges = [(range_start, min(range_end, last_date))
+                       for range_start, range_end in date_ranges
+                       if range_start <= last_date]
+        if len(date_ranges) == 0:
+            return
+
+        # Merge the overlapping or adjacent date ranges
+        ranges = sorted(self.coverage(query) + list(date_ranges))
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            last_start, last_end = merged[-1]
+            if range_start <= last_end + pd.Timedelta(days=1):
+                merged[-1] = (last_start, max(last_end, range_end))
+            else:
+                merged.append((range_start, range_end))
+
+        index = self._read_index()
+        index[name] = {
+            "query": list(query),
+            "coverage": [[f"{s:%Y-%m-%d}", f"{e:%Y-%m-%d}"] for s, e in merged],
+        }
+        self._write_index(index)
+
+    def _write_index(self, index: Dict[str, Dict[str, Any]]) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix=f".{self.INDEX_FILENAME}.",
+                                        suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as fhandle:
+            json.dump(index, fhandle, indent=2)
+        os.replace(tmp_name, self.index_file)
+
+    def load(self, query: SurveyQuery, start: pd.Timestamp,
+             end: pd.Timestamp) -> pd.DataFrame:
+        """Load the cached responses of a query between start and
+        end (inclusive).
+
+        :param query: the survey query
+        :param start: the start date
+        :param end: the end date
+        """
+        fname = self.cache_dir / f"{self._entry_name(query)}.parquet"
+        if not fname.exists():
+            return pd.DataFrame()
+        df = pd.read_parquet(fname)
+        df = df[(df.survey_date >= start) & (df.survey_date <= end)]
+        return df.reset_index(drop=True)
 
 
 class FacebookSymptomSurvey:
     """This is a class implementing a client for the COVID-19 World Survey Data API
-    from Facebook and the University of Maryland.
+    from Facebook and the University of Maryland. The client keeps a pool
+    of connections, retries failed requests with an exponential backoff
+    and runs concurrent requests with a bounded number of threads.
 
     .. seealso:: Please see :cite:t:`Maryland2021` for more information
                  about the COVID-19 World Survey Data API.
+
+    :param base_url: the base url of the API
+    :param max_workers: maximum number of concurrent requests
+    :param timeout: timeout in seconds of each request
+    :param retries: number of retries of each failed request
+    :param backoff_factor: backoff factor of the retries, the sleep between
+                           retries is backoff_factor * (2 ** retry)
+    :param max_days_per_request: date ranges longer than this number of
+                                 days are split in many requests
     """
-    def __init__(self, base_url: str = "https://covidmap.umd.edu/api") -> None:
+    RETRY_STATUS: Sequence[int] = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url: str = "https://covidmap.umd.edu/api",
+                 max_workers: int = 8,
+                 timeout: float = 60.0,
+                 retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 max_days_per_request: int = 90) -> None:
         self.base_url = base_url
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_days_per_request = max_days_per_request
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.RETRY_STATUS,
+                      allowed_methods=["GET"])
+        adapter = HTTPAdapter(max_retries=retry,
+                              pool_connections=max_workers,
+                              pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get_data(self, endpoint: str,
+                  payload: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        r = self.session.get(f"{self.base_url}/{endpoint}", params=payload,
+                             timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()["data"]
 
     def get_survey_country_region(self) -> pd.DataFrame:
         """Get the survey country/region list."""
-        r = requests.get(f"{self.base_url}/region")
-        return pd.DataFrame(r.json()["data"])
+        return pd.DataFrame(self._get_data("region"))
 
     def get_survey_date_avail(self, country_name: str, region_name: str) -> pd.DataFrame:
         """Retrieve all dates for survey responses for a place.
@@ -42,18 +229,92 @@ class FacebookSymptomSurvey:
             "country": country_name,
             "region": region_name,
         }
-        base_url = f"{self.base_url}/datesavail"
-        r = requests.get(base_url, params=payload)
-        return pd.DataFrame(r.json()["data"])
+        return pd.DataFrame(self._get_data("datesavail", payload))
+
+    def _split_date_range(self, start: pd.Timestamp,
+                          end: pd.Timestamp) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        starts = pd.date_range(start, end,
+                               freq=f"{self.max_days_per_request}D")
+        return [(s, min(s + pd.Timedelta(days=self.max_days_per_request - 1), end))
+                for s in starts]
+
+    @staticmethod
+    def _add_confidence_intervals(df: pd.DataFrame) -> pd.DataFrame:
+        if {"percent_cli", "cli_se"}.issubset(df.columns):
+            df["percent_cli_95_upper_ci"] = (df.percent_cli + (1.96 * df.cli_se)) * 100.0
+            df["percent_cli_95_lower_ci"] = (df.percent_cli - (1.96 * df.cli_se)) * 100.0
+        return df
+
+    def _fetch_resources(self, payloads: List[Dict[str, str]]) -> List[pd.DataFrame]:
+        def get_resource(payload: Dict[str, str]) -> pd.DataFrame:
+            df = pd.DataFrame(self._get_data("resources", payload))
+            if "survey_date" in df.columns:
+                df["survey_date"] = pd.to_datetime(df.survey_date.astype(str),
+                                                   format="%Y%m%d")
+            return df
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(get_resource, payloads))
+
+    def _get_resources(self, queries: List[SurveyQuery],
+                       start_date: str, end_date: str,
+                       labels: bool = False,
+                       cache: bool = False) -> pd.DataFrame:
+        start = pd.to_datetime(start_date, format="%Y%m%d")
+        end = pd.to_datetime(end_date, format="%Y%m%d")
+        response_cache = SurveyResponseCache() if cache else None
+
+        # Plan the requests of each query, only the missing
+        # date ranges are requested when using the cache
+        query_ranges: List[List[Tuple[pd.Timestamp, pd.Timestamp]]] = []
+        payloads: List[Dict[str, str]] = []
+        owners: List[int] = []
+        for i, query in enumerate(queries):
+            date_ranges = [(start, end)] if response_cache is None \
+                else response_cache.missing_ranges(query, start, end)
+            query_ranges.append(date_ranges)
+            for date_range in date_ranges:
+                for range_start, range_end in self._split_date_range(*date_range):
+                    payloads.append({
+                        "indicator": query.indicator,
+                        "type": query.type_,
+                        "country": query.country_name,
+                        "region": query.region_name,
+                        "daterange": f"{range_start:%Y%m%d}-{range_end:%Y%m%d}",
+                    })
+                    owners.append(i)
+
+        fetched = self._fetch_resources(payloads)
+        frames = []
+        for i, query in enumerate(queries):
+            query_frames = [frame for frame, owner in zip(fetched, owners)
+                            if owner == i and len(frame) > 0]
+            df = pd.concat(query_frames, ignore_index=True) \
+                if len(query_frames) > 0 else pd.DataFrame()
+            if response_cache is not None:
+                response_cache.update(query, df, query_ranges[i])
+                df = response_cache.load(query, start, end)
+            if labels:
+                df["indicator"] = query.indicator
+                df["type"] = query.type_
+            frames.append(df)
+
+        frames = [frame for frame in frames if len(frame) > 0]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        return self._add_confidence_intervals(df)
 
     def get_survey_range(self, country_name: str,
                          region_name: str,
                          start_date: str, end_date: str,
                          type_: str = "daily",
-                         indicator: str = "covid") -> pd.DataFrame:
+                         indicator: str = "covid",
+                         cache: bool = False) -> pd.DataFrame:
         """Retrieve data for a particular indicator. This method
         will return a DataFrame with pre-computed confidence
         intervals (percent_cli_95_upper_ci/percent_cli_95_lower_ci).
+        Long date ranges are split and requested concurrently.
 
         .. seealso:: Please see :cite:t:`Maryland2021` for more information
                     about the COVID-19 World Survey Data API.
@@ -66,23 +327,42 @@ class FacebookSymptomSurvey:
                          example: 20200921.
         :param type_: can be "daily" or "smoothed"
         :param indicator: can be "covid", "mask" or "vaccine_acpt"
+        :param cache: if the responses should be cached, in this case
+                      only the dates not cached yet are requested,
+                      see :class:`SurveyResponseCache`.
         """
-        payload: Dict[str, str] = {
-            "indicator": indicator,
-            "type": type_,
-            "country": country_name,
-            "region": region_name,
-            "daterange": f"{start_date}-{end_date}",
-        }
-        base_url = f"{self.base_url}/resources"
-        r = requests.get(base_url, params=payload)
-        r = r.json()["data"]
-
-        df = pd.DataFrame(r)
-        df["survey_date"] = pd.to_datetime(df.survey_date, format="%Y%m%d")
-        df["percent_cli_95_upper_ci"] = (df.percent_cli + (1.96 * df.cli_se)) * 100.0
-        df["percent_cli_95_lower_ci"] = (df.percent_cli - (1.96 * df.cli_se)) * 100.0
-        return df
+        query = SurveyQuery(country_name, region_name, indicator, type_)
+        return self._get_resources([query], start_date, end_date,
+                                   cache=cache)
+
+    def get_survey_ranges(self, country_name: str,
+                          region_names: Sequence[str],
+                          start_date: str, end_date: str,
+                          types: Sequence[str] = ("daily",),
+                          indicators: Sequence[str] = ("covid",),
+                          cache: bool = False) -> pd.DataFrame:
+        """Retrieve data for all the combinations of regions, indicators
+        and types concurrently, see :meth:`get_survey_range`. The results
+        are returned in a single DataFrame with the columns "indicator"
+        and "type" identifying each request.
+
+        :param country_name: the name of the country
+        :param region_names: the names of the regions
+        :param start_date: start date in the format (YYYYMMDD),
+                           example: 20200921.
+        :param end_date: start date in the format (YYYYMMDD),
+                         example: 20200921.
+        :param types: the types, can be "daily" or "smoothed"
+        :param indicators: the indicators, can be "covid", "mask"
+                           or "vaccine_acpt"
+        :param cache: if the responses should be cached, see
+                      :meth:`get_survey_range`.
+        """
+        queries = [SurveyQuery(country_name, region_name, indicator, type_)
+                   for region_name, indicator, type_
+                   in itertools.product(region_names, indicators, types)]
+        return self._get_resources(queries, start_date, end_date,
+                                   labels=True, cache=cache)
 
     @staticmethod
     def plot_region_percent_cli(df_survey_range: pd.DataFrame,
@@ -96,6 +376,10 @@ class FacebookSymptomSurvey:
                         location of ticks in the plot for the dates
         :param interval: interval to show the date labels in the plot
         """
+        import seaborn as sns
+        from matplotlib import dates as mdates
+        from matplotlib import pyplot as plt
+
         plt.plot(df_survey_range["survey_date"],
                  df_survey_range.percent_cli * 100.0, color="red", lw=0.8,
                  marker='o', markersize=5, markerfacecolor='w')
@@ -136,11 +420,31 @@ class MovementRangeResource(typing.NamedTuple):
 class FacebookMovementRange:
     """This is a client API for Facebook Movement Range data.
 
+    The metadata of the last available resource is cached for
+    `resource_ttl` seconds. When the optional pyarrow is installed,
+    the movement range file is converted on the first load into a
+    columnar cache (Parquet) partitioned by country, so the next loads
+    only read the requested countries.
+
     .. seealso:: Please look at `HDX Movement Range Maps
                  <https://data.humdata.org/dataset/movement-range-maps>`_
                  for more information about this data.
+
+    :param resource_ttl: time-to-live in seconds of the cached metadata
+                         of the last available resource.
     """
     MAIN_RESOURCE_URL = "https://data.humdata.org/dataset/movement-range-maps"
+    RESOURCE_FILENAME: str = "movement_range_resource.json"
+    PARTITION_COLUMN: str = "country"
+    REGION_COLUMN: str = "polygon_id"
+    COLUMN_TYPES: Dict[str, str] = {
+        "ds": "date32",
+        "all_day_bing_tiles_visited_relative_change": "float32",
+        "all_day_ratio_single_tile_users": "float32",
+    }
+
+    def __init__(self, resource_ttl: float = 6 * 60 * 60):
+        self.resource_ttl = resource_ttl
 
     def _get_last_date_available(self) -> MovementRangeResource:
         with io.BytesIO() as bio:
@@ -167,6 +471,38 @@ class FacebookMovementRange:
 
         return MovementRangeResource(last_available.date(), url, schema_name)
 
+    def get_last_resource(self, invalidate: bool = False) -> MovementRangeResource:
+        """Returns the last available resource, using the cached metadata
+        when it is not older than the resource TTL.
+
+        :param invalidate: if the cached metadata should be ignored
+        :returns: the last available resource
+        """
+        resource_file = data.get_cache_dir_file(self.RESOURCE_FILENAME)
+        if resource_file.exists() and not invalidate:
+            try:
+                with resource_file.open("r", encoding="utf-8") as fhandle:
+                    cached = json.load(fhandle)
+                if time.time() - cached["fetched_at"] < self.resource_ttl:
+                    return MovementRangeResource(
+                        datetime.date.fromisoformat(cached["date"]),
+                        cached["url"], cached["filename"])
+            except (ValueError, KeyError):
+                # A corrupted metadata file is fetched again
+                pass
+
+        resource = self._get_last_date_available()
+        fd, tmp_name = tempfile.mkstemp(dir=resource_file.parent,
+                                        prefix=f".{resource_file.name}.",
+                                        suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as fhandle:
+            json.dump({"date": resource.date.isoformat(),
+                       "url": resource.url,
+                       "filename": resource.filename,
+                       "fetched_at": time.time()}, fhandle)
+        os.replace(tmp_name, resource_file)
+        return resource
+
     def _download_cache_resource(self, resource: MovementRangeResource,
                                  show_progress: bool = True) -> Path:
         cached_file = data.load_from_cache(resource.url, resource.filename,
@@ -174,30 +510,96 @@ class FacebookMovementRange:
                                            show_progress=show_progress)
         return cached_file
 
-    def load_movement_range(self, country_code: Optional[str] = None,
-                            show_progress: bool = True) -> pd.DataFrame:
+    @staticmethod
+    def _movement_range_member(zip_file: ZipFile) -> str:
+        fname = "<not found>"
+        for fobj in zip_file.filelist:
+            if fobj.filename.startswith("movement-range"):
+                fname = fobj.filename
+        return fname
+
+    def load_movement_range(self, country_code: Optional[Union[str, Sequence[str]]] = None,
+                            show_progress: bool = True,
+                            columns: Optional[Sequence[str]] = None,
+                            engine: Optional[str] = None,
+                            columnar: Optional[bool] = None) -> pd.DataFrame:
         """This method will load the movement range data and optionally
         filter for the specified country code.
 
-        :param country_code: country code (i.e. 'BRA' for Brazil)
+        :param country_code: country code (i.e. 'BRA' for Brazil) or
+                             a list of country codes
         :param show_progress: show download progress
+        :param columns: the columns to load, default to all columns
+        :param engine: the CSV engine when the columnar cache is not used,
+                       see :func:`episuite.data.read_csv_filtered`
+        :param columnar: if the columnar cache should be used, default to
+                         use it when the optional pyarrow is installed
         :returns: a DataFrame with the movement range dataset
         """
-        last_resource = self._get_last_date_available()
+        last_resource = self.get_last_resource()
         cached_file = self._download_cache_resource(last_resource, show_progress)
-        zip_file = ZipFile(cached_file)
+        with ZipFile(cached_file) as zip_file:
+            fname = self._movement_range_member(zip_file)
+
+        codes = None
+        if country_code is not None:
+            codes = [country_code] if isinstance(country_code, str) \
+                else list(country_code)
+
+        if columnar is None:
+            columnar = data.has_pyarrow()
+        if columnar:
+            dataset_dir = cached_file.with_name(f"{cached_file.stem}.parquet")
+            if not data.is_source_signature_valid(dataset_dir, cached_file):
+                data.csv_to_partitioned_parquet(cached_file, dataset_dir,
+                                                self.PARTITION_COLUMN,
+                                                self.COLUMN_TYPES,
+                                                delimiter="\t", member=fname)
+            return data.read_partitioned_parquet(dataset_dir,
+                                                 self.PARTITION_COLUMN,
+                                                 codes, columns)
+
+        filters = {self.PARTITION_COLUMN: codes} if codes is not None else None
+        dtype = {column: column_type for column, column_type
+                 in self.COLUMN_TYPES.items() if column != "ds"}
+        parse_dates = ["ds"] if columns is None or "ds" in columns else None
+        with ZipFile(cached_file) as zip_file:
+            with zip_file.open(fname, "r") as mrange:
+                df = data.read_csv_filtered(mrange, filters, columns,
+                                            dtype, parse_dates,
+                                            delimiter="\t", engine=engine)
+        return df
 
-        fname = "<not found>"
-        for fobj in zip_file.filelist:
-            if fobj.filename.startswith("movement-range"):
-                fname = fobj.filename
+    def load_cube(self, country_code: Optional[Union[str, Sequence[str]]] = None,
+                  show_progress: bool = True,
+                  mmap: bool = True) -> MobilityCube:
+        """Load the movement range data as a dense cube of polygons x dates
+        x metrics, see :class:`episuite.mobility.cube.MobilityCube`. The
+        region labels are the polygon ids.
 
-        with zip_file.open(fname, "r") as mrange:
-            if country_code is None:
-                df = pd.read_csv(mrange, delimiter="\t", low_memory=False)
-            else:
-                iter_csv = pd.read_csv(mrange, delimiter="\t",
-                                       iterator=True, chunksize=5000)
-                df = pd.concat([chunk[chunk['country'] == country_code]
-                               for chunk in iter_csv])
-        return df
+        The cube is saved in the cache directory on the first load and
+        rebuilt only when a new resource is available, the next loads
+        memory-map it, so it can be shared by many workers without copies.
+
+        :param country_code: country code (i.e. 'BRA' for Brazil) or
+                             a list of country codes
+        :param show_progress: show download progress
+        :param mmap: if the cube values should be memory-mapped
+        :returns: the mobility cube
+        """
+        last_resource = self.get_last_resource()
+        cached_file = self._download_cache_resource(last_resource, show_progress)
+        codes = None
+        if country_code is not None:
+            codes = [country_code] if isinstance(country_code, str) \
+                else list(country_code)
+        cube_dir = cached_file.with_name(MobilityCube.cache_name(cached_file.stem, codes))
+        if not data.is_source_signature_valid(cube_dir, cached_file):
+            value_columns = [column for column in self.COLUMN_TYPES
+                             if column != "ds"]
+            df = self.load_movement_range(codes, show_progress=show_progress,
+                                          columns=["ds", self.REGION_COLUMN, *value_columns])
+            cube = MobilityCube.from_dataframe(df, [self.REGION_COLUMN], "ds",
+                                               value_columns)
+            cube.save(cube_dir, source=cached_file)
+        return MobilityCube.load(cube_dir, mmap=mmap)
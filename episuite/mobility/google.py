@@ -1,8 +1,10 @@
-from typing import Optional
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
 
 import pandas as pd
 
 from episuite import data
+from episuite.mobility.cube import MobilityCube
 
 
 class GoogleMobility:
@@ -14,36 +16,134 @@ class GoogleMobility:
             Community Mobility Report website.
 
     :param report_url: alternative report download link
+    :param compression: compression of the cached report, "gzip", "zstd"
+                        or None for no compression, see
+                        :class:`episuite.data.CacheManager`.
     """
     DEFAULT_REPORT_URL: str = \
         "https://www.gstatic.com/covid19/mobility/Global_Mobility_Report.csv"
+    REPORT_FILENAME: str = "google_mobility.csv"
+    DATASET_DIRNAME: str = "google_mobility.parquet"
+    PARTITION_COLUMN: str = "country_region_code"
+    REGION_COLUMNS: Sequence[str] = (
+        "country_region_code",
+        "sub_region_1",
+        "sub_region_2",
+        "metro_area",
+    )
+    MOBILITY_CATEGORIES: Sequence[str] = (
+        "retail_and_recreation",
+        "grocery_and_pharmacy",
+        "parks",
+        "transit_stations",
+        "workplaces",
+        "residential",
+    )
 
-    def __init__(self, report_url: Optional[str] = None):
+    def __init__(self, report_url: Optional[str] = None,
+                 compression: Optional[str] = None):
         self.report_url = report_url or GoogleMobility.DEFAULT_REPORT_URL
+        self.compression = compression
 
-    def load_report(self, country_region_code: Optional[str] = None,
-                    show_progress: bool = True, cache: bool = True) -> pd.DataFrame:
+    @classmethod
+    def column_types(cls) -> Dict[str, str]:
+        """Returns the compact types of the report columns."""
+        column_types = {"date": "date32"}
+        for category in cls.MOBILITY_CATEGORIES:
+            column_types[f"{category}_percent_change_from_baseline"] = "float32"
+        return column_types
+
+    def _report_file(self, show_progress: bool, cache: bool) -> Path:
+        return data.load_from_cache(self.report_url, self.REPORT_FILENAME,
+                                    "Google Mobility Report",
+                                    show_progress=show_progress,
+                                    invalidate=not cache,
+                                    compression=self.compression)
+
+    @staticmethod
+    def _country_codes(country_region_code: Optional[Union[str, Sequence[str]]]) -> Optional[List[str]]:
+        if country_region_code is None:
+            return None
+        return [country_region_code] if isinstance(country_region_code, str) \
+            else list(country_region_code)
+
+    def load_report(self, country_region_code: Optional[Union[str, Sequence[str]]] = None,
+                    show_progress: bool = True, cache: bool = True,
+                    columns: Optional[Sequence[str]] = None,
+                    columnar: Optional[bool] = None,
+                    engine: Optional[str] = None) -> pd.DataFrame:
         """Load the report from Google and optionally cache it or fitler
         by a country code. Given that the mobility report is a large file,
         it is highly recommended to specify the country region code.
 
+        On the first load, the report is converted into a columnar cache
+        (Parquet) partitioned by the country region code and with compact
+        types (categoricals and float32), the next loads will read only
+        the requested countries and columns from it.
+
         :param country_region_code: The country region code, i.e. "BR"
-                                    for Brazil.
+                                    for Brazil, or a list of codes.
         :param show_progress: Show a progress bar for the download
         :param cache: If cache should be done or not, default to True
+        :param columns: the columns to load, default to all columns
+        :param columnar: if the columnar cache should be used, default to
+                         use it when the optional pyarrow is installed
+        :param engine: the CSV engine when the columnar cache is not used,
+                       see :func:`episuite.data.read_csv_filtered`
         :returns: a dataframe with the results already filtered and parsed
         """
-        fpath = data.load_from_cache(self.report_url, "google_mobility.csv",
-                                     "Google Mobility Report",
-                                     show_progress=show_progress,
-                                     invalidate=not cache)
-        if country_region_code is None:
-            df = pd.read_csv(fpath, low_memory=False,
-                             parse_dates=["date"])
-        else:
-            iter_csv = pd.read_csv(fpath, low_memory=False,
-                                   parse_dates=["date"],
-                                   iterator=True, chunksize=5000)
-            df = pd.concat([chunk[chunk['country_region_code'] == country_region_code]
-                            for chunk in iter_csv])
-        return df
+        fpath = self._report_file(show_progress, cache)
+        codes = self._country_codes(country_region_code)
+
+        if columnar is None:
+            columnar = data.has_pyarrow()
+        if columnar:
+            dataset_dir = fpath.with_name(self.DATASET_DIRNAME)
+            if not data.is_source_signature_valid(dataset_dir, fpath):
+                data.csv_to_partitioned_parquet(fpath, dataset_dir,
+                                                self.PARTITION_COLUMN,
+                                                self.column_types())
+            return data.read_partitioned_parquet(dataset_dir,
+                                                 self.PARTITION_COLUMN,
+                                                 codes, columns)
+
+        filters = {self.PARTITION_COLUMN: codes} if codes is not None else None
+        dtype = {column: column_type for column, column_type
+                 in self.column_types().items() if column != "date"}
+        parse_dates = ["date"] if columns is None or "date" in columns else None
+        return data.read_csv_filtered(fpath, filters, columns, dtype,
+                                      parse_dates, engine=engine)
+
+    def load_cube(self, country_region_code: Optional[Union[str, Sequence[str]]] = None,
+                  show_progress: bool = True, cache: bool = True,
+                  mmap: bool = True) -> MobilityCube:
+        """Load the report as a dense cube of regions x dates x mobility
+        categories, see :class:`episuite.mobility.cube.MobilityCube`. The
+        region labels are the country region code, the sub regions and the
+        metro area joined by "|", i.e. "BR|State of Rio Grande do Sul".
+
+        The cube is saved in the cache directory on the first load and
+        rebuilt only when the report changes, the next loads memory-map
+        it, so it can be shared by many workers without copies.
+
+        :param country_region_code: The country region code, i.e. "BR"
+                                    for Brazil, or a list of codes.
+        :param show_progress: Show a progress bar for the download
+        :param cache: If cache should be done or not, default to True
+        :param mmap: if the cube values should be memory-mapped
+        :returns: the mobility cube
+        """
+        fpath = self._report_file(show_progress, cache)
+        codes = self._country_codes(country_region_code)
+        cube_dir = fpath.with_name(MobilityCube.cache_name("google_mobility", codes))
+        if not data.is_source_signature_valid(cube_dir, fpath):
+            df = self.load_report(codes, show_progress=show_progress)
+            region_columns = [column for column in self.REGION_COLUMNS
+                              if column in df.columns]
+            value_columns = [f"{category}_percent_change_from_baseline"
+                             for category in self.MOBILITY_CATEGORIES]
+            cube = MobilityCube.from_dataframe(df, region_columns, "date",
+                                               value_columns,
+                                               self.MOBILITY_CATEGORIES)
+            cube.save(cube_dir, source=fpath)
+        return MobilityCube.load(cube_dir, mmap=mmap)
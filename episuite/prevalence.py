@@ -1,8 +1,14 @@
-from typing import Any
+from pathlib import Path
+from typing import Any, Sequence, Tuple, Union
 
+import numpy as np
 import numpyro
 import numpyro.distributions as dist
+import pandas as pd
+from jax import random
+from numpyro.diagnostics import hpdi
 from numpyro.distributions import Distribution
+from numpyro.infer import MCMC, NUTS, init_to_feasible
 
 
 def true_prevalence_model(obs_positive: int, obs_total: int,
@@ -60,3 +66,206 @@ def apparent_prevalence_model(x_se: int, n_se: int,
                           dist.Binomial(probs=apparent_p,
                                         total_count=obs_total),
                           obs=obs_positive)
+
+
+class ApparentPrevalenceTable:
+    """This is a precomputed lookup table of posterior summaries of the
+    true prevalence from the :func:`apparent_prevalence_model` for a fixed
+    assay (sensitivity and specificity validation results). The posterior
+    is computed for a grid of observed totals and observed proportions of
+    positive samples and the queries are answered with a bilinear
+    interpolation over that grid, which avoids running inference at query
+    time. The posterior of each grid point is computed for the nearest
+    number of positives of its total, so the proportions are interpolated
+    over these realized proportions (the number of positives over the
+    total) and not over the grid proportions, which differ for small totals.
+
+    :param assay: the assay validation parameters as an array of
+                  (x_se, n_se, x_sp, n_sp).
+    :param obs_totals: the grid of observed totals (ascending).
+    :param proportions: the grid of observed proportions of positive
+                        samples (ascending, between 0 and 1).
+    :param summaries: the posterior summaries for each grid point, with shape
+                      (obs_totals, proportions, statistics).
+    """
+    STATISTICS: Tuple[str, ...] = ("mean_val", "median_val",
+                                   "lb95", "ub95", "lb50", "ub50")
+
+    def __init__(self, assay: np.ndarray,
+                 obs_totals: np.ndarray,
+                 proportions: np.ndarray,
+                 summaries: np.ndarray):
+        self.assay = np.asarray(assay)
+        self.obs_totals = np.asarray(obs_totals)
+        self.proportions = np.asarray(proportions)
+        self.summaries = summaries
+        expected_shape = (len(self.obs_totals), len(self.proportions),
+                          len(self.STATISTICS))
+        if self.summaries.shape != expected_shape:
+            raise ValueError(f"Summaries with shape {self.summaries.shape}, "
+                             f"expected {expected_shape}.")
+        self.obs_positives = self.realized_positives(self.obs_totals, self.proportions)
+        self.realized_proportions = self.obs_positives / self.obs_totals[:, np.newaxis]
+
+    @staticmethod
+    def realized_positives(obs_totals: np.ndarray, proportions: np.ndarray) -> np.ndarray:
+        """Returns the number of positives of each grid point, the nearest
+        to the proportion of the total, with shape (obs_totals, proportions).
+
+        :param obs_totals: the grid of observed totals
+        :param proportions: the grid of observed proportions
+        """
+        totals = np.asarray(obs_totals, dtype=np.int64)[:, np.newaxis]
+        return np.round(np.asarray(proportions) * totals).astype(np.int64)
+
+    @classmethod
+    def build(cls, x_se: int, n_se: int, x_sp: int, n_sp: int,
+              obs_totals: Sequence[int],
+              proportions: Sequence[float],
+              num_warmup: int = 500,
+              num_samples: int = 1000,
+              seed: int = 0,
+              true_p_prior: Distribution = dist.Beta(1, 1)) -> 'ApparentPrevalenceTable':
+        """Precompute the posterior summaries over the grid of observed
+        totals and observed proportions. The model is compiled only
+        once and reused for all grid points.
+
+        :param x_se: sensitivity parameter, see :func:`apparent_prevalence_model`.
+        :param n_se: sensitivity parameter, see :func:`apparent_prevalence_model`.
+        :param x_sp: specificity parameter, see :func:`apparent_prevalence_model`.
+        :param n_sp: specificity parameter, see :func:`apparent_prevalence_model`.
+        :param obs_totals: grid of observed totals
+        :param proportions: grid of observed proportion of positives
+        :param num_warmup: number of warmup steps for each grid point
+        :param num_samples: number of posterior samples for each grid point
+        :param seed: random seed
+        :param true_p_prior: prior for the true prevalence
+        :returns: the lookup table
+        """
+        totals_grid = np.unique(np.asarray(obs_totals, dtype=np.int64))
+        proportions_grid = np.unique(np.asarray(proportions, dtype=np.float64))
+        if totals_grid.min() <= 0:
+            raise ValueError("Observed totals should be positive.")
+        if proportions_grid.min() < 0.0 or proportions_grid.max() > 1.0:
+            raise ValueError("Proportions should be between 0 and 1.")
+
+        kernel = NUTS(apparent_prevalence_model,
+                      init_strategy=init_to_feasible())
+        mcmc = MCMC(kernel, num_warmup=num_warmup,
+                    num_samples=num_samples, num_chains=1,
+                    progress_bar=False, jit_model_args=True)
+        rng_key = random.PRNGKey(seed)
+
+        summaries = np.zeros((len(totals_grid), len(proportions_grid),
+                              len(cls.STATISTICS)), dtype=np.float32)
+        positives_grid = cls.realized_positives(totals_grid, proportions_grid)
+        for i, obs_total in enumerate(totals_grid):
+            for j, obs_positive in enumerate(positives_grid[i].tolist()):
+                if j > 0 and obs_positive == positives_grid[i, j - 1]:
+                    # The proportions with the same number of
+                    # positives have the same posterior
+                    summaries[i, j] = summaries[i, j - 1]
+                    continue
+                rng_key, rng_key_ = random.split(rng_key)
+                mcmc.run(rng_key_, x_se=x_se, n_se=n_se,
+                         x_sp=x_sp, n_sp=n_sp,
+                         obs_total=int(obs_total),
+                         obs_positive=obs_positive,
+                         true_p_prior=true_p_prior)
+                true_p = np.asarray(mcmc.get_samples()["true_p"])
+                lb95, ub95 = hpdi(true_p, prob=0.95)
+                lb50, ub50 = hpdi(true_p, prob=0.50)
+                summaries[i, j] = (true_p.mean(), np.median(true_p),
+                                   lb95, ub95, lb50, ub50)
+
+        assay = np.array([x_se, n_se, x_sp, n_sp], dtype=np.int64)
+        return cls(assay, totals_grid, proportions_grid, summaries)
+
+    @staticmethod
+    def _grid_position(grid: np.ndarray, values: np.ndarray,
+                       name: str) -> Tuple[np.ndarray, np.ndarray]:
+        if np.any(values < grid[0]) or np.any(values > grid[-1]):
+            raise ValueError(f"Queried {name} outside of the table range "
+                             f"[{grid[0]}, {grid[-1]}].")
+        if len(grid) == 1:
+            zeros = np.zeros(len(values), dtype=np.int64)
+            return zeros, np.zeros(len(values))
+        idx = np.clip(np.searchsorted(grid, values, side="right") - 1,
+                      0, len(grid) - 2)
+        weight = (values - grid[idx]) / (grid[idx + 1] - grid[idx])
+        return idx, weight
+
+    def _interpolate_row(self, row: np.ndarray, proportions: np.ndarray) -> np.ndarray:
+        # Linear interpolation of the summaries of the rows (totals) over
+        # their realized proportions, which are ascending in each row but
+        # can be repeated. The proportions outside of the realized range
+        # of a row use its nearest grid point.
+        grid = self.realized_proportions
+        num_proportions = grid.shape[1]
+        if num_proportions == 1:
+            return self.summaries[row, 0]
+        # Each row is shifted to a disjoint range to search all of
+        # them with a single binary search
+        flat_grid = (grid + 2.0 * np.arange(len(grid))[:, np.newaxis]).ravel()
+        position = np.searchsorted(flat_grid, proportions + 2.0 * row, side="right") - 1
+        idx = np.clip(position - row * num_proportions, 0, num_proportions - 2)
+        lower, upper = grid[row, idx], grid[row, idx + 1]
+        width = upper - lower
+        weight = np.divide(proportions - lower, width,
+                           out=np.zeros(len(row)), where=width > 0)
+        weight = np.clip(weight, 0.0, 1.0)[:, np.newaxis]
+        return self.summaries[row, idx] * (1.0 - weight) + self.summaries[row, idx + 1] * weight
+
+    def query(self, obs_positive: Union[int, Sequence[int], np.ndarray],
+              obs_total: Union[int, Sequence[int], np.ndarray]) -> pd.DataFrame:
+        """Answer the posterior summaries for one or many observed
+        counts by interpolating the precomputed grid.
+
+        :param obs_positive: number of observed positive counts
+        :param obs_total: the total of observed samples
+        :returns: a dataframe with one row for each query and the columns
+                  with the posterior summaries of the true prevalence.
+        """
+        positives = np.atleast_1d(np.asarray(obs_positive, dtype=np.float64))
+        totals = np.atleast_1d(np.asarray(obs_total, dtype=np.float64))
+        positives, totals = np.broadcast_arrays(positives, totals)
+        if np.any(positives > totals):
+            raise ValueError("Observed positives greater than observed total.")
+
+        proportions = positives / totals
+        ti, tw = self._grid_position(self.obs_totals.astype(np.float64),
+                                     totals, "totals")
+        self._grid_position(self.proportions, proportions, "proportions")
+        ti_next = np.minimum(ti + 1, len(self.obs_totals) - 1)
+
+        tw = tw[:, np.newaxis]
+        values = (self._interpolate_row(ti, proportions) * (1.0 - tw)
+                  + self._interpolate_row(ti_next, proportions) * tw)
+
+        df = pd.DataFrame(values, columns=list(self.STATISTICS))
+        df.insert(0, "obs_total", totals.astype(np.int64))
+        df.insert(0, "obs_positive", positives.astype(np.int64))
+        return df
+
+    def save(self, filename: Union[str, Path]) -> None:
+        """Save the table to an uncompressed numpy (npz) file. The file
+        is written with the given name, without appending the extension.
+
+        :param filename: the output file name
+        """
+        with open(filename, "wb") as fhandle:
+            np.savez(fhandle, assay=self.assay,
+                     obs_totals=self.obs_totals,
+                     proportions=self.proportions,
+                     summaries=self.summaries)
+
+    @classmethod
+    def load(cls, filename: Union[str, Path]) -> 'ApparentPrevalenceTable':
+        """Load a table previously saved with :meth:`save`.
+
+        :param filename: the file name
+        :returns: the lookup table
+        """
+        with np.load(filename) as arrays:
+            return cls(arrays["assay"], arrays["obs_totals"],
+                       arrays["proportions"], arrays["summaries"])
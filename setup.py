@@ -10,6 +10,7 @@ development_requires: List[str] = [
     "mypy>=0.812",
     "flake8>=3.8.4",
     "pytest-cov>=2.11.1",
+    "pytest-benchmark>=3.2.3",
     "sphinx>=3.5.2",
     "pydata-sphinx-theme>=0.5.0",
     "sphinx-tabs>=2.1.0",
@@ -22,6 +23,8 @@ development_requires: List[str] = [
     "sphinx-autobuild>=2021.3.14",
     "ipywidgets>=7.6.3",
     "sphinxcontrib-bibtex>=2.2.0",
+    "pyarrow>=3.0.0",
+    "zstandard>=0.15.2",
 ]
 
 setuptools.setup(
@@ -35,6 +38,7 @@ setuptools.setup(
     url="https://github.com/perone/episuite",
     install_requires=[
         "numpy>=1.20.1",
+        "scipy>=1.7.0",
         "matplotlib>=3.3.4",
         "pandas>=1.2.3",
         "numpyro>=0.6.0",
@@ -47,6 +51,10 @@ setuptools.setup(
     ],
     extras_require={
         'dev': development_requires,
+        'parquet': ["pyarrow>=3.0.0"],
+        'zstd': ["zstandard>=0.15.2"],
+        'joblib': ["joblib>=1.4.0"],
+        'dask': ["dask[distributed]>=2021.3.0"],
     },
     project_urls={
         "Bug Tracker": "https://github.com/perone/episuite/issues",
@@ -56,6 +64,9 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
+    entry_points={
+        "console_scripts": ["episuite=episuite.cli:main"],
+    },
     packages=setuptools.find_packages(),
     python_requires=">=3.7",
     include_package_data=True,
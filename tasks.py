@@ -11,6 +11,20 @@ def test_ci(c):
     c.run("python -m pytest --cov=episuite -m \"not slow\" tests/")
 
 
+@task
+def bench(c, save=False, compare=False, baseline=""):
+    # --compare uses the last results saved on this machine and
+    # --baseline a named baseline of any machine, i.e. "reference"
+    args = " --benchmark-storage=benchmarks/baselines"
+    if save:
+        args += " --benchmark-autosave"
+    if compare:
+        args += " --benchmark-compare"
+    if baseline:
+        args += f" --benchmark-compare='*/*_{baseline}'"
+    c.run(f"python -m pytest{args} benchmarks/")
+
+
 @task
 def lint(c, docstyle=False):
     print("Running flake8...")
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import threading
+import urllib.parse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+from episuite import data
+
+
+class LocalHTTPServer:
+    """A local HTTP server serving files from a directory, with
+    support for ETag and Last-Modified validators and range requests.
+    The connection of the next response can be dropped after a number
+    of bytes with `truncate_next` to simulate interrupted downloads.
+    Dynamic JSON endpoints can be registered in `routes`, mapping a
+    path to a function receiving the query and returning the status
+    and the JSON object of the response."""
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.requests: List[Dict[str, str]] = []
+        self.support_ranges = True
+        self.truncate_next: Optional[int] = None
+        self.lock = threading.Lock()
+        self.routes: Dict[str, Callable[[Dict[str, List[str]]], Tuple[int, Any]]] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    def url(self, filename: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/{filename}"
+
+    def write(self, filename: str, content: bytes) -> str:
+        (self.root / filename).write_bytes(content)
+        return self.url(filename)
+
+    def _handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                with server.lock:
+                    server.requests.append({"path": self.path, **dict(self.headers)})
+                parsed = urllib.parse.urlparse(self.path)
+                if parsed.path in server.routes:
+                    status, obj = server.routes[parsed.path](
+                        urllib.parse.parse_qs(parsed.query))
+                    content = json.dumps(obj).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+                fname = server.root / self.path.lstrip("/")
+                if not fname.is_file():
+                    self.send_error(404)
+                    return
+                content = fname.read_bytes()
+                etag = '"' + hashlib.md5(content).hexdigest() + '"'
+                last_modified = formatdate(fname.stat().st_mtime, usegmt=True)
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                byte_range = self._byte_range(len(content), etag)
+                if byte_range is None:
+                    self.send_response(200)
+                    body = content
+                else:
+                    start, end = byte_range
+                    self.send_response(206)
+                    self.send_header("Content-Range",
+                                     f"bytes {start}-{end}/{len(content)}")
+                    body = content[start:end + 1]
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                with server.lock:
+                    truncate = server.truncate_next
+                    if truncate is not None and truncate < len(body):
+                        server.truncate_next = None
+                    else:
+                        truncate = None
+                if truncate is not None:
+                    self.wfile.write(body[:truncate])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def _byte_range(self, size: int, etag: str) -> Optional[Tuple[int, int]]:
+                value = self.headers.get("Range")
+                if not server.support_ranges or value is None:
+                    return None
+                if self.headers.get("If-Range", etag) != etag:
+                    return None
+                start, end = value.replace("bytes=", "").split("-")
+                return int(start), min(int(end) if end else size - 1, size - 1)
+
+        return Handler
+
+
+@pytest.fixture
+def http_server(tmp_path: Path) -> Iterator[LocalHTTPServer]:
+    root = tmp_path / "www"
+    root.mkdir()
+    server = LocalHTTPServer(root)
+    server.thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+@pytest.fixture
+def cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Replace the episuite cache directory by a temporary directory."""
+    cache_path = tmp_path / "cache"
+    cache_path.mkdir()
+
+    def get_cache_dir_file(filename: Optional[str] = None) -> Path:
+        return cache_path if filename is None else cache_path / filename
+
+    monkeypatch.setattr(data, "get_cache_dir_file", get_cache_dir_file)
+    return cache_path
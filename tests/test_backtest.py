@@ -0,0 +1,85 @@
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from episuite import backtest, distributions, durations
+
+
+class TestBacktest:
+    @pytest.fixture
+    def line_list(self) -> durations.Durations:
+        rng = np.random.default_rng(0)
+        starts = pd.Timestamp("2021-01-01") + pd.to_timedelta(rng.integers(0, 60, 600), unit="D")
+        ends = starts + pd.to_timedelta(rng.integers(1, 10, 600), unit="D")
+        return durations.Durations(pd.DataFrame({"DATE_START": starts, "DATE_END": ends}))
+
+    def test_observed_admissions(self, line_list: durations.Durations) -> None:
+        cutoffs = pd.date_range("2021-01-20", periods=5, freq="5D")
+        # The bootstrap of the whole line list, known only after the cutoffs
+        results = backtest.backtest(line_list, cutoffs, horizon=7, iterations=40,
+                                    duration_distribution=line_list.get_bootstrap(),
+                                    seed=0, backend="threads", max_workers=2,
+                                    show_progress=False)
+        df_forecasts = results.get_forecasts()
+        assert len(df_forecasts) == 5 * 7
+        assert list(df_forecasts.cutoff.unique()) == list(cutoffs)
+        assert (df_forecasts.date - df_forecasts.cutoff == pd.to_timedelta(df_forecasts.horizon, unit="D")).all()
+        census = line_list.get_census()
+        np.testing.assert_array_equal(df_forecasts.observed, census[df_forecasts.date].values)
+
+        metrics = results.metrics()
+        assert list(metrics.index) == list(range(1, 8))
+        assert (metrics.cutoffs == 5).all()
+        # The durations are the bootstrap of the line list and the admissions
+        # are observed, so the intervals should be calibrated
+        assert metrics.coverage_95.mean() > 0.8
+        assert (metrics.rmse >= metrics.mae).all()
+        assert "Cutoffs=5" in repr(results)
+
+    def test_forecaster(self, line_list: durations.Durations) -> None:
+        calls = []
+
+        def forecaster(history: pd.Series, dates: pd.DatetimeIndex) -> pd.DataFrame:
+            calls.append((history.index[-1], dates[0]))
+            return pd.DataFrame(np.zeros((3, len(dates))), columns=dates)
+
+        results = backtest.backtest(line_list, ["2021-01-30"], horizon=20, iterations=6,
+                                    duration_distribution=distributions.EmpiricalBootstrap([1]),
+                                    admission_forecaster=forecaster, backend="serial",
+                                    show_progress=False)
+        assert calls == [(pd.Timestamp("2021-01-30"), pd.Timestamp("2021-01-31"))]
+        df_forecasts = results.get_forecasts()
+        # Without admissions after the cutoff and one day of stay
+        assert (df_forecasts.mean_val == 0).all()
+        assert (results.metrics().coverage_95 == 0).all()
+
+    def test_cutoff_durations(self, line_list: durations.Durations,
+                              monkeypatch: pytest.MonkeyPatch) -> None:
+        fitted = {}
+        simulate_cutoff = backtest._simulate_cutoff
+
+        def spy(cutoff: pd.Timestamp, s_admissions: pd.Series,
+                duration_distribution: distributions.EmpiricalBootstrap,
+                *args: Any) -> Any:
+            fitted[cutoff] = duration_distribution.samples
+            return simulate_cutoff(cutoff, s_admissions, duration_distribution, *args)
+
+        monkeypatch.setattr(backtest, "_simulate_cutoff", spy)
+        cutoffs = pd.to_datetime(["2021-01-10", "2021-02-10"])
+        backtest.backtest(line_list, cutoffs, horizon=3, iterations=4,
+                          backend="serial", show_progress=False)
+        df = line_list.get_dataframe()
+        for cutoff in cutoffs:
+            # Only the stays ended up to the cutoff are fitted
+            expected = df[df.DATE_END <= cutoff][durations.Durations.COLUMN_STAY_DURATION]
+            np.testing.assert_array_equal(np.sort(fitted[cutoff]), np.sort(expected.values))
+        assert len(fitted[cutoffs[0]]) < len(fitted[cutoffs[1]]) < len(df)
+        assert fitted[cutoffs[0]].mean() < fitted[cutoffs[1]].mean()
+
+    def test_invalid_cutoff(self, line_list: durations.Durations) -> None:
+        with pytest.raises(ValueError, match="before the first admission"):
+            backtest.backtest(line_list, ["2020-12-01"], show_progress=False)
+        with pytest.raises(ValueError, match="No stays ended"):
+            backtest.backtest(line_list, ["2021-01-01"], show_progress=False)
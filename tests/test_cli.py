@@ -0,0 +1,106 @@
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from episuite import cli, data
+
+
+class TestCli:
+    @pytest.fixture
+    def admissions(self, tmp_path: Path) -> List[str]:
+        counts = pd.DataFrame({
+            "DATE": ["2021-01-01", "2021-01-02", "2021-01-04"],
+            "ADMISSIONS": [2, 3, 1],
+        })
+        counts.to_csv(tmp_path / "counts.csv", index=False)
+        rows = pd.DataFrame({"DATE": ["2021-01-01", "2021-01-01", "2021-01-03"]})
+        rows.to_csv(tmp_path / "rows.csv", index=False)
+        return [str(tmp_path / "counts.csv"), str(tmp_path / "rows.csv")]
+
+    @pytest.fixture
+    def line_list(self, tmp_path: Path) -> str:
+        df = pd.DataFrame({
+            "DATE_START": ["2021-01-01", "2021-01-02", "2021-01-02"],
+            "DATE_END": ["2021-01-03", "2021-01-03", "2021-01-06"],
+        })
+        df.to_csv(tmp_path / "line_list.csv", index=False)
+        return str(tmp_path / "line_list.csv")
+
+    def test_read_admissions(self, admissions: List[str]) -> None:
+        s_counts = cli.read_admissions(Path(admissions[0]), "DATE", "ADMISSIONS")
+        assert list(s_counts.values) == [2, 3, 0, 1]
+        assert s_counts.index[0] == pd.Timestamp("2021-01-01")
+        s_rows = cli.read_admissions(Path(admissions[1]), "DATE", "ADMISSIONS")
+        assert list(s_rows.values) == [2, 0, 1]
+
+    def test_make_jobs(self) -> None:
+        jobs = cli.make_jobs(["a/x.csv", "b/y.csv"], ["l.csv"])
+        assert [job.name for job in jobs] == ["x", "y"]
+        assert jobs[1].line_list == Path("l.csv")
+        with pytest.raises(ValueError, match="line lists"):
+            cli.make_jobs(["x.csv", "y.csv", "z.csv"], ["l1.csv", "l2.csv"])
+        with pytest.raises(ValueError, match="same name"):
+            cli.make_jobs(["a/x.csv", "b/x.csv"], ["l.csv"])
+
+    @pytest.mark.parametrize("output_format", [
+        "csv",
+        pytest.param("parquet", marks=pytest.mark.skipif(not data.has_pyarrow(),
+                                                         reason="requires pyarrow")),
+    ])
+    def test_icu_simulate(self, admissions: List[str], line_list: str,
+                          tmp_path: Path, output_format: str,
+                          capsys: pytest.CaptureFixture) -> None:
+        output_dir = tmp_path / "output"
+        exit_code = cli.main(["icu-simulate", "--admissions", *admissions,
+                              "--line-list", line_list, "--output-dir", str(output_dir),
+                              "--iterations", "8", "--capacity", "2", "4.5",
+                              "--format", output_format, "--seed", "0",
+                              "--backend", "threads", "--workers", "2"])
+        assert exit_code == 0
+        read = pd.read_parquet if output_format == "parquet" else pd.read_csv
+        df_hdi = read(output_dir / f"counts_hdi.{output_format}")
+        assert pd.Timestamp(df_hdi.date[0]) == pd.Timestamp("2021-01-01")
+        assert len(df_hdi) >= 4
+        assert {"date", "lb95", "ub95", "mean_val"}.issubset(df_hdi.columns)
+        df_exceedance = read(output_dir / f"rows_exceedance.{output_format}")
+        assert list(df_exceedance.columns) == ["date", "capacity_2", "capacity_4.5"]
+        assert np.all((df_exceedance.iloc[:, 1:] >= 0) & (df_exceedance.iloc[:, 1:] <= 1))
+        df_report = read(output_dir / f"report.{output_format}")
+        assert set(df_report.job) == {"counts", "rows"}
+        assert df_report.error.isna().all()
+        stderr = capsys.readouterr().err
+        assert "[2/2]" in stderr
+        assert "2 jobs (0 failed)" in stderr
+
+    def test_icu_simulate_failed_job(self, admissions: List[str], line_list: str,
+                                     tmp_path: Path) -> None:
+        missing = str(tmp_path / "missing.csv")
+        exit_code = cli.main(["icu-simulate", "--admissions", admissions[0], missing,
+                              "--line-list", line_list, "--output-dir", str(tmp_path / "out"),
+                              "--iterations", "2", "--backend", "serial"])
+        assert exit_code == 1
+        df_report = pd.read_csv(tmp_path / "out" / "report.csv").set_index("job")
+        assert pd.isna(df_report.loc["counts", "error"])
+        assert "FileNotFoundError" in df_report.loc["missing", "error"]
+        assert (tmp_path / "out" / "counts_hdi.csv").exists()
+
+    def test_icu_simulate_cache_durations(self, admissions: List[str], line_list: str,
+                                          tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        cache_dir = tmp_path / "cache"
+        monkeypatch.setattr(data, "get_cache_dir_file", lambda filename=None: cache_dir)
+        exit_code = cli.main(["icu-simulate", "--admissions", *admissions,
+                              "--line-list", line_list, "--output-dir", str(tmp_path / "out"),
+                              "--iterations", "2", "--backend", "serial", "--cache-durations"])
+        assert exit_code == 0
+        assert len(list(cache_dir.glob("*.npz"))) == 1
+
+    def test_usage_errors(self, line_list: str, tmp_path: Path) -> None:
+        with pytest.raises(SystemExit):
+            cli.main([])
+        with pytest.raises(SystemExit):
+            cli.main(["icu-simulate", "--admissions", "x.csv", "y.csv", "z.csv",
+                      "--line-list", line_list, line_list,
+                      "--output-dir", str(tmp_path)])
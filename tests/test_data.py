@@ -1,8 +1,15 @@
+import concurrent.futures
 import io
 import json
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
 from episuite import data
+from tests.conftest import LocalHTTPServer
 
 
 class TestSampleData:
@@ -40,3 +47,248 @@ class TestUtils:
         fcache.unlink()
         assert not fcache.exists()
         assert not fcache_again.exists()
+
+
+class TestCacheManager:
+    def test_get_cached(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.txt", b"episuite")
+        cache = data.CacheManager(tmp_path / "cache")
+        fcache = cache.get(url, "file.txt", show_progress=False)
+        assert fcache.read_bytes() == b"episuite"
+        fcache_again = cache.get(url, "file.txt", show_progress=False)
+        assert fcache_again == fcache
+        assert len(http_server.requests) == 1
+
+        index = cache.read_index()
+        assert index["file.txt"]["url"] == url
+        assert index["file.txt"]["size"] == len(b"episuite")
+        assert index["file.txt"]["etag"] is not None
+
+    def test_failed_download(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        cache = data.CacheManager(tmp_path / "cache")
+        with pytest.raises(requests.HTTPError):
+            cache.get(http_server.url("missing.txt"), "missing.txt",
+                      show_progress=False)
+        assert list(cache.cache_dir.iterdir()) == []
+
+    def test_revalidation(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.txt", b"episuite")
+        cache = data.CacheManager(tmp_path / "cache")
+        cache.get(url, "file.txt", show_progress=False, ttl=0)
+
+        # Expired entry not modified on the server
+        fcache = cache.get(url, "file.txt", show_progress=False, ttl=0)
+        assert "If-None-Match" in http_server.requests[-1]
+        assert fcache.read_bytes() == b"episuite"
+
+        # Expired entry modified on the server
+        http_server.write("file.txt", b"episuite v2")
+        fcache = cache.get(url, "file.txt", show_progress=False, ttl=0)
+        assert fcache.read_bytes() == b"episuite v2"
+
+        # Entry still fresh
+        cache.get(url, "file.txt", show_progress=False, ttl=3600)
+        assert len(http_server.requests) == 3
+
+    def test_stored_ttl(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.txt", b"episuite")
+        cache = data.CacheManager(tmp_path / "cache")
+        cache.get(url, "file.txt", show_progress=False, ttl=0)
+        # Without a TTL in the call, the entry expires with the stored TTL
+        cache.get(url, "file.txt", show_progress=False)
+        assert len(http_server.requests) == 2
+        assert "If-None-Match" in http_server.requests[-1]
+        assert cache.read_index()["file.txt"]["ttl"] == 0
+
+    def test_concurrent_index(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        names = [f"file{i}.txt" for i in range(16)]
+        urls = [http_server.write(name, name.encode()) for name in names]
+
+        def get(url: str, name: str) -> Path:
+            # A cache manager for each caller, as in separate processes
+            cache = data.CacheManager(tmp_path / "cache")
+            return cache.get(url, name, show_progress=False)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(get, urls, names))
+        cache = data.CacheManager(tmp_path / "cache")
+        assert set(cache.read_index()) == set(names)
+        assert not cache.index_lock_file.exists()
+
+    def test_lru_eviction(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        cache = data.CacheManager(tmp_path / "cache", max_size=25)
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            url = http_server.write(name, b"x" * 10)
+            cache.get(url, name, show_progress=False)
+            # Touch the first entry to make it the most recently used
+            cache.get(http_server.url("a.txt"), "a.txt", show_progress=False)
+
+        index = cache.read_index()
+        assert set(index) == {"a.txt", "c.txt"}
+        assert not (cache.cache_dir / "b.txt").exists()
+
+    def test_adopt_and_remove(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        cache = data.CacheManager(tmp_path / "cache")
+        (cache.cache_dir / "old.txt").write_bytes(b"old")
+        fcache = cache.get(http_server.url("old.txt"), "old.txt",
+                           show_progress=False)
+        assert fcache.read_bytes() == b"old"
+        assert len(http_server.requests) == 0
+
+        cache.remove("old.txt")
+        assert not fcache.exists()
+        assert "old.txt" not in cache.read_index()
+
+
+class TestDownloadFile:
+    CONTENT: bytes = bytes(range(256)) * 40
+
+    def test_segments(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.bin", self.CONTENT)
+        fname = tmp_path / "file.bin"
+        resp = data.download_file(url, fname, show_progress=False,
+                                  max_segments=4, min_segment_size=1024)
+        assert resp.status_code == 206
+        assert fname.read_bytes() == self.CONTENT
+        # The first request is reused for the first segment
+        ranges = sorted(r["Range"] for r in http_server.requests)
+        assert ranges == ["bytes=0-", "bytes=2560-5119",
+                          "bytes=5120-7679", "bytes=7680-10239"]
+        assert not (tmp_path / "file.bin.state").exists()
+
+    def test_no_range_support(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        http_server.support_ranges = False
+        url = http_server.write("file.bin", self.CONTENT)
+        fname = tmp_path / "file.bin"
+        resp = data.download_file(url, fname, show_progress=False,
+                                  min_segment_size=1024)
+        assert resp.status_code == 200
+        assert fname.read_bytes() == self.CONTENT
+        assert len(http_server.requests) == 1
+
+    def test_resume(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.bin", self.CONTENT)
+        fname = tmp_path / "file.bin"
+        http_server.truncate_next = 3000
+        with pytest.raises((IOError, requests.RequestException)):
+            data.download_file(url, fname, show_progress=False,
+                               max_segments=1, chunk_size=1000)
+        assert (tmp_path / "file.bin.state").exists()
+
+        data.download_file(url, fname, show_progress=False,
+                           max_segments=1, chunk_size=1000)
+        assert fname.read_bytes() == self.CONTENT
+        assert http_server.requests[-1]["Range"] == f"bytes=3000-{len(self.CONTENT) - 1}"
+
+    def test_resource_changed(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.bin", self.CONTENT)
+        fname = tmp_path / "file.bin"
+        http_server.truncate_next = 3000
+        with pytest.raises((IOError, requests.RequestException)):
+            data.download_file(url, fname, show_progress=False,
+                               max_segments=1, chunk_size=1000)
+
+        new_content = self.CONTENT[::-1]
+        http_server.write("file.bin", new_content)
+        data.download_file(url, fname, show_progress=False, max_segments=1)
+        assert fname.read_bytes() == new_content
+
+    def test_cache_resume(self, http_server: LocalHTTPServer, tmp_path: Path) -> None:
+        url = http_server.write("file.bin", self.CONTENT)
+        cache = data.CacheManager(tmp_path / "cache", max_segments=1,
+                                  chunk_size=1000)
+        http_server.truncate_next = 3000
+        with pytest.raises((IOError, requests.RequestException)):
+            cache.get(url, "file.bin", show_progress=False)
+        assert not (cache.cache_dir / "file.bin").exists()
+
+        fcache = cache.get(url, "file.bin", show_progress=False)
+        assert fcache.read_bytes() == self.CONTENT
+        assert sorted(p.name for p in cache.cache_dir.iterdir()) == \
+            ["cache_index.json", "file.bin"]
+
+    def test_locked_partial_download(self, http_server: LocalHTTPServer,
+                                     tmp_path: Path) -> None:
+        url = http_server.write("file.bin", self.CONTENT)
+        cache = data.CacheManager(tmp_path / "cache", max_segments=1,
+                                  chunk_size=1000)
+        http_server.truncate_next = 3000
+        with pytest.raises((IOError, requests.RequestException)):
+            cache.get(url, "file.bin", show_progress=False)
+        partial = cache.cache_dir / ".file.bin.part"
+        state = partial.with_name(partial.name + ".state")
+        partial_content, state_content = partial.read_bytes(), state.read_bytes()
+
+        # Another process is resuming the partial download
+        with data._file_lock(partial.with_name(partial.name + ".lock")):
+            fcache = cache.get(url, "file.bin", show_progress=False)
+        assert fcache.read_bytes() == self.CONTENT
+        assert http_server.requests[-1]["Range"] == "bytes=0-"
+        assert partial.read_bytes() == partial_content
+        assert state.read_bytes() == state_content
+        assert sorted(p.name for p in cache.cache_dir.iterdir()) == \
+            [".file.bin.part", ".file.bin.part.state", "cache_index.json", "file.bin"]
+
+
+class TestReadCSVFiltered:
+    @pytest.fixture
+    def csv_file(self, tmp_path: Path) -> Path:
+        df = pd.DataFrame({
+            "country": ["BR", "NA", "US", "BR"],
+            "date": ["2020-01-01", "2020-01-02", "2020-01-03", "2020-01-04"],
+            "value": [1.0, 2.0, None, 4.0],
+        })
+        fname = tmp_path / "data.csv"
+        df.to_csv(fname, index=False)
+        return fname
+
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_filter(self, csv_file: Path, engine: str) -> None:
+        if engine == "pyarrow":
+            pytest.importorskip("pyarrow")
+        df = data.read_csv_filtered(csv_file, {"country": ["BR", "NA"]},
+                                    usecols=["date", "value"],
+                                    dtype={"value": "float32"},
+                                    parse_dates=["date"], engine=engine,
+                                    chunksize=2)
+        assert list(df.columns) == ["date", "value"]
+        assert len(df) == 3
+        assert df.value.dtype == np.float32
+        assert df.date.iloc[-1] == pd.Timestamp("2020-01-04")
+
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_no_filter(self, csv_file: Path, engine: str) -> None:
+        if engine == "pyarrow":
+            pytest.importorskip("pyarrow")
+        df = data.read_csv_filtered(csv_file, engine=engine)
+        assert len(df) == 4
+        assert df.country.tolist() == ["BR", "NA", "US", "BR"]
+        assert df.value.isna().sum() == 1
+
+
+class TestCompression:
+    @pytest.mark.parametrize("compression", ["gzip", "zstd"])
+    def test_cache_compression(self, http_server: LocalHTTPServer,
+                               tmp_path: Path, compression: str) -> None:
+        if compression == "zstd":
+            pytest.importorskip("zstandard")
+        content = pd.DataFrame({"a": range(1000), "b": ["x"] * 1000}).to_csv(index=False)
+        url = http_server.write("data.csv", content.encode("utf-8"))
+        cache = data.CacheManager(tmp_path / "cache", compression=compression)
+        fcache = cache.get(url, "data.csv", show_progress=False)
+        assert fcache.name == "data.csv" + data.COMPRESSION_EXTENSIONS[compression]
+        assert fcache.stat().st_size < len(content)
+        assert cache.read_index()["data.csv"]["compression"] == compression
+        df = pd.read_csv(fcache)
+        assert len(df) == 1000
+
+        # Cached entry is found with the compressed name
+        assert cache.get(url, "data.csv", show_progress=False) == fcache
+        assert len(http_server.requests) == 1
+
+        cache.remove("data.csv")
+        assert not fcache.exists()
+
+    def test_unknown_compression(self, tmp_path: Path) -> None:
+        with pytest.raises(ValueError, match="Unknown compression"):
+            data.CacheManager(tmp_path, compression="lz4")
@@ -1,3 +1,5 @@
+import pickle
+
 import numpy as np
 import pytest
 
@@ -10,3 +12,87 @@ class TestEmpiricalBootstrap:
         dist = distributions.EmpiricalBootstrap(ones)
         samples = dist.sample(100)
         assert (samples==1).sum() == 100
+
+    def test_quantile(self) -> None:
+        dist = distributions.EmpiricalBootstrap([5, 1, 3, 2])
+        quantiles = dist.quantile(np.array([0.0, 0.24, 0.25, 0.6, 0.99]))
+        np.testing.assert_array_equal(quantiles, [1, 1, 2, 3, 5])
+
+
+class TestDurationSampler:
+    def test_unknown_method(self) -> None:
+        with pytest.raises(ValueError, match="Unknown sampling"):
+            distributions.DurationSampler("latin")
+
+    def test_no_quantile(self) -> None:
+        class Constant(distributions.DurationDistribution):
+            def sample(self, size: int) -> np.ndarray:
+                return np.ones(size)
+
+        sampler = distributions.DurationSampler(seed=0)
+        with pytest.raises(NotImplementedError, match="no quantile"):
+            sampler.sample(Constant(), 10, 0)
+
+    @pytest.mark.parametrize("method", ["random", "antithetic", "sobol"])
+    def test_common_random_numbers(self, method: str) -> None:
+        first = distributions.DurationSampler(method, seed=42)
+        second = distributions.DurationSampler(method, seed=42)
+        other = distributions.DurationSampler(method, seed=7)
+        np.testing.assert_array_equal(first.uniforms(50, 3), second.uniforms(50, 3))
+        assert not np.array_equal(first.uniforms(50, 3), other.uniforms(50, 3))
+        assert not np.array_equal(first.uniforms(50, 3), first.uniforms(50, 2))
+        uniforms = first.uniforms(1000, 5)
+        assert ((uniforms >= 0) & (uniforms < 1)).all()
+
+    def test_antithetic(self) -> None:
+        sampler = distributions.DurationSampler("antithetic", seed=0)
+        np.testing.assert_allclose(sampler.uniforms(20, 4) + sampler.uniforms(20, 5), 1.0)
+
+    def test_sobol_stratification(self) -> None:
+        sampler = distributions.DurationSampler("sobol", seed=0)
+        uniforms = np.stack([sampler.uniforms(8, i) for i in range(64)])
+        counts = np.stack([np.histogram(column, bins=8, range=(0, 1))[0]
+                           for column in uniforms.T])
+        assert (counts == 8).all()
+        with pytest.raises(ValueError, match="at most"):
+            sampler.uniforms(30000, 0)
+
+    @pytest.mark.parametrize("method", ["random", "antithetic", "sobol"])
+    def test_batch_uniforms(self, method: str) -> None:
+        sampler = distributions.DurationSampler(method, seed=0)
+        expected = np.stack([sampler.uniforms(20, i) for i in range(3, 11)])
+        # The same draws out of order, in a batch and in another sampler
+        np.testing.assert_array_equal(sampler.uniforms(20, 5), expected[2])
+        np.testing.assert_array_equal(sampler.batch_uniforms(20, 3, 11), expected)
+        other = distributions.DurationSampler(method, seed=0)
+        np.testing.assert_array_equal(other.batch_uniforms(20, 3, 11), expected)
+        assert sampler.batch_uniforms(20, 3, 3).shape == (0, 20)
+
+    def test_sobol_engine(self) -> None:
+        sampler = distributions.DurationSampler("sobol", seed=0)
+        uniforms = sampler.batch_uniforms(30, 0, 4)
+        engine = sampler._sobol_engines[30]
+        sampler.uniforms(30, 2)
+        assert sampler._sobol_engines[30] is engine
+        # The engine is sent with the sampler to the workers
+        copy = pickle.loads(pickle.dumps(sampler))
+        assert 30 in copy._sobol_engines
+        np.testing.assert_array_equal(copy.batch_uniforms(30, 0, 4), uniforms)
+
+    def test_check_rounds(self) -> None:
+        sampler = distributions.DurationSampler("sobol", seed=0)
+        sampler.check_rounds([10] * 8)
+        with pytest.raises(ValueError, match="from 9 to 10 patients"):
+            sampler.check_rounds([10, 9, 10, 10])
+        with pytest.warns(UserWarning, match="power of 2"):
+            sampler.check_rounds([10] * 6)
+        with pytest.warns(UserWarning, match="power of 2"):
+            sampler.check_rounds([10], 100)
+        distributions.DurationSampler("random", seed=0).check_rounds([10, 9, 8])
+
+    def test_sample(self) -> None:
+        dist = distributions.EmpiricalBootstrap([1, 2, 3, 4])
+        sampler = distributions.DurationSampler("random", seed=1)
+        samples = sampler.sample(dist, 1000, 0)
+        assert set(samples) == {1, 2, 3, 4}
+        assert abs(samples.mean() - 2.5) < 0.2
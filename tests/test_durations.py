@@ -1,8 +1,12 @@
+import os
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import pytest
 from matplotlib import pyplot as plt
 
-from episuite.durations import Durations
+from episuite.durations import Durations, DurationsCache, fingerprint
 
 
 class TestDurations:
@@ -29,6 +33,41 @@ class TestDurations:
         assert len(distr) == 10
         assert (distr==10).all()
 
+    def test_get_bootstrap_by(self, mock_duration: pd.DataFrame) -> None:
+        mock_duration["DATE_END"] += pd.to_timedelta([0, 1] * 5, unit="D")
+        mock_duration["OUTCOME"] = ["DEATH", "RECOVERY"] * 5
+        bootstraps = Durations(mock_duration).get_bootstrap_by("OUTCOME")
+        assert set(bootstraps) == {"DEATH", "RECOVERY"}
+        assert (bootstraps["DEATH"].samples == 10).all()
+        assert (bootstraps["RECOVERY"].samples == 11).all()
+
+    def test_census(self) -> None:
+        df = pd.DataFrame({
+            "DATE_START": pd.to_datetime(["2021-01-01", "2021-01-02", "2021-01-03", "2021-01-02"]),
+            "DATE_END": pd.to_datetime(["2021-01-03", "2021-01-02", None, "2021-01-01"]),
+        })
+        dur = Durations(df)
+        census = dur.get_census()
+        assert list(census.index) == list(pd.date_range("2021-01-01", "2021-01-03"))
+        assert list(census) == [1, 1, 1]
+        assert list(dur.get_census("2021-01-02", "2021-01-05")) == [1, 1, 1, 1]
+        assert list(dur.get_admissions()) == [1, 1, 1]
+
+        unfiltered = Durations(df, filter_gt=False)
+        assert list(unfiltered.get_admissions()) == [1, 2, 1]
+        assert list(unfiltered.get_census()) == [1, 1, 1]
+
+    def test_census_simulation(self) -> None:
+        rng = np.random.default_rng(0)
+        starts = pd.Timestamp("2021-01-01") + pd.to_timedelta(rng.integers(0, 30, 200), unit="D")
+        ends = starts + pd.to_timedelta(rng.integers(0, 10, 200), unit="D")
+        dur = Durations(pd.DataFrame({"DATE_START": starts, "DATE_END": ends}))
+        census = dur.get_census()
+        expected = pd.Series(0, index=census.index)
+        for start, end in zip(starts, ends):
+            expected[start:end - pd.Timedelta(days=1)] += 1
+        pd.testing.assert_series_equal(census, expected, check_names=False)
+
     def test_plot(self, mock_duration: pd.DataFrame) -> None:
         dur = Durations(mock_duration)
 
@@ -40,3 +79,66 @@ class TestDurations:
 
         dur.plot.timeplot()
         plt.close()
+
+
+class TestDurationsCache:
+    @pytest.fixture
+    def line_list(self) -> pd.DataFrame:
+        rng = np.random.default_rng(0)
+        starts = pd.Timestamp("2021-01-01") + pd.to_timedelta(rng.integers(0, 30, 500), unit="D")
+        ends = starts + pd.to_timedelta(rng.integers(-1, 20, 500), unit="D")
+        return pd.DataFrame({"DATE_START": starts, "DATE_END": ends, "OTHER": 1})
+
+    def test_fingerprint(self, line_list: pd.DataFrame) -> None:
+        key = fingerprint(line_list)
+        assert key == fingerprint(line_list.drop(columns="OTHER"))
+        assert key != fingerprint(line_list, filter_gt=False)
+        changed = line_list.copy()
+        changed.loc[0, "DATE_END"] += pd.Timedelta(days=1)
+        assert key != fingerprint(changed)
+
+    def test_get_bootstrap(self, line_list: pd.DataFrame, tmp_path: Path) -> None:
+        cache = DurationsCache(tmp_path)
+        bootstrap = cache.get_bootstrap(line_list)
+        expected = np.sort(Durations(line_list).get_stay_distribution())
+        np.testing.assert_array_equal(bootstrap.samples, expected)
+        assert len(cache.entries()) == 1
+
+        cached = cache.get_bootstrap(line_list)
+        np.testing.assert_array_equal(cached.samples, expected)
+        q = np.linspace(0, 1, 11)[:-1]
+        np.testing.assert_array_equal(cached.quantile(q), bootstrap.quantile(q))
+
+        unfiltered = cache.get_bootstrap(line_list, filter_gt=False)
+        assert len(unfiltered.samples) == len(line_list)
+        assert len(cache.entries()) == 2
+
+    def test_corrupted_entry(self, line_list: pd.DataFrame, tmp_path: Path) -> None:
+        cache = DurationsCache(tmp_path)
+        cache.get_bootstrap(line_list)
+        cache.entries()[0].write_bytes(b"corrupted")
+        assert cache.load(fingerprint(line_list)) is None
+        assert len(cache.get_bootstrap(line_list).samples) > 0
+        cache.clear()
+        assert cache.entries() == []
+
+    def test_eviction(self, line_list: pd.DataFrame, tmp_path: Path) -> None:
+        cache = DurationsCache(tmp_path, max_size=None)
+        first = cache._entry_path(fingerprint(line_list))
+        cache.get_bootstrap(line_list)
+        os.utime(first, (0, 0))
+        cache.max_size = int(2.5 * first.stat().st_size)
+        changed = line_list.copy()
+        changed["DATE_END"] += pd.Timedelta(days=1)
+        cache.get_bootstrap(changed)
+        assert first in cache.entries()
+        second = cache._entry_path(fingerprint(changed))
+        os.utime(second, (1, 1))
+
+        # A hit marks the entry as recently used
+        cache.get_bootstrap(line_list)
+        changed["DATE_END"] += pd.Timedelta(days=1)
+        cache.get_bootstrap(changed)
+        entries = cache.entries()
+        assert len(entries) == 2
+        assert first in entries and second not in entries
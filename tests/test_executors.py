@@ -0,0 +1,110 @@
+import os
+import time
+from typing import Any, List
+
+import pandas as pd
+import pytest
+
+from episuite import distributions, executors, icu
+
+
+def square(value: int) -> int:
+    return value * value
+
+
+def worker_pid() -> int:
+    return os.getpid()
+
+
+def sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+class TestBackends:
+    @pytest.mark.parametrize("backend", ["serial", "threads", "processes",
+                                         "joblib", "dask"])
+    def test_run(self, backend: str) -> None:
+        if backend in ("joblib", "dask"):
+            pytest.importorskip(backend)
+        executor = executors.get_backend(backend, max_workers=2)
+        results = executor.run(square, [(value,) for value in range(5)])
+        assert sorted(results) == [0, 1, 4, 9, 16]
+
+    @pytest.mark.parametrize("backend", ["threads", "processes", "joblib", "dask"])
+    def test_streaming(self, backend: str) -> None:
+        if backend in ("joblib", "dask"):
+            pytest.importorskip(backend)
+        if backend == "dask":
+            pytest.importorskip("dask.distributed")
+        executor = executors.get_backend(backend, max_workers=2)
+        results = executor.run(sleep, [(2.0,), (0.0,)])
+        # The fast task is yielded while the slow one is still running
+        assert next(results) == 0.0
+        first_at = time.perf_counter()
+        assert list(results) == [2.0]
+        assert time.perf_counter() - first_at > 1.0
+
+    def test_dask_scheduler(self) -> None:
+        with pytest.raises(ValueError, match="Unknown dask scheduler"):
+            executors.DaskBackend("synchronous")
+
+    def test_unknown_backend(self) -> None:
+        with pytest.raises(ValueError, match="Unknown backend"):
+            executors.get_backend("mpi")
+
+    def test_persistent(self) -> None:
+        with executors.ProcessBackend(max_workers=1, persistent=True) as backend:
+            first = list(backend.run(worker_pid, [()]))
+            second = list(backend.run(worker_pid, [()]))
+            assert first == second
+            assert backend._executor is not None
+        assert backend._executor is None
+
+    def test_not_persistent(self) -> None:
+        backend = executors.ThreadBackend(max_workers=2)
+        assert list(backend.run(square, [(3,)])) == [9]
+        assert backend._executor is None
+
+    def test_persistent_backend(self) -> None:
+        backend = executors.ProcessBackend(max_workers=1)
+        with executors.persistent_backend(backend) as executor:
+            assert executor is backend
+            first = list(executor.run(worker_pid, [()]))
+            assert list(executor.run(worker_pid, [()])) == first
+        assert not backend.persistent
+        assert backend._executor is None
+        with executors.persistent_backend("serial") as executor:
+            assert isinstance(executor, executors.SerialBackend)
+
+    def test_use_backend(self) -> None:
+        assert isinstance(executors.get_backend(), executors.ProcessBackend)
+        with executors.use_backend("serial"):
+            assert isinstance(executors.get_backend(), executors.SerialBackend)
+            serial = executors.SerialBackend()
+            with executors.use_backend(serial):
+                assert executors.get_backend() is serial
+        assert isinstance(executors.get_backend(), executors.ProcessBackend)
+
+
+class TestSimulateBackends:
+    @pytest.fixture
+    def simulation(self) -> icu.ICUSimulation:
+        s_admissions = pd.Series([1, 3, 2], index=pd.date_range("2021-01-01", periods=3))
+        return icu.ICUSimulation(icu.ICUAdmissions(s_admissions),
+                                 distributions.EmpiricalBootstrap([2]))
+
+    @pytest.mark.parametrize("backend", ["serial", "threads",
+                                         executors.ProcessBackend(max_workers=1)])
+    def test_simulate(self, simulation: icu.ICUSimulation, backend: Any) -> None:
+        results = simulation.simulate(3, show_progress=False, backend=backend)
+        df_simulation = results.get_simulation_results()
+        assert df_simulation.shape == (4, 3)
+        assert (df_simulation.sum() == 12).all()
+
+    def test_simulate_default(self, simulation: icu.ICUSimulation) -> None:
+        calls: List[int] = []
+        with executors.use_backend("serial"):
+            simulation.simulate(2, profile=True,
+                                callback=lambda completed, total, stats: calls.append(completed))
+        assert calls == [1, 2]
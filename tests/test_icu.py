@@ -1,3 +1,8 @@
+import sys
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -81,3 +86,607 @@ class TestICUSimulation:
 
         results.plot.lineplot()
         plt.close()
+
+    def test_simulate_profile(self) -> None:
+        s_admissions = pd.Series([1, 3, 2, 0, 4],
+                                 index=pd.date_range("2021-01-01", periods=5))
+        admissions = icu.ICUAdmissions(s_admissions)
+        icu_sim = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([2, 3, 4]))
+        progress = []
+
+        def callback(completed: int, total: int,
+                     stats: Optional[icu.SimulationStats]) -> None:
+            assert stats is not None
+            progress.append((completed, total))
+
+        results = icu_sim.simulate(3, max_workers=2, profile=True, callback=callback)
+        assert progress == [(1, 3), (2, 3), (3, 3)]
+        stats = results.get_stats()
+        assert stats is not None
+        df_stats = stats.to_dataframe()
+        assert set(df_stats.stage) == {"los_sampling", "expansion", "aggregation",
+                                       "transfer", "concat"}
+        summary = stats.summary()
+        assert summary.loc["los_sampling", "calls"] == 3
+        assert summary.loc["los_sampling", "samples"] == 3 * 10
+        assert summary.loc["concat", "calls"] == 1
+        assert (df_stats.seconds >= 0).all()
+        assert len(stats.summary(by_worker=True)) >= 5
+        if sys.platform != "win32":
+            # The peak memory of the worker processes running the rounds
+            by_worker = stats.summary(by_worker=True).loc["los_sampling"]
+            assert (by_worker.max_rss > 0).all()
+            assert summary.loc["concat", "max_rss"] > 0
+
+    def test_simulate_no_profile(self) -> None:
+        s_admissions = pd.Series([1, 2], index=pd.date_range("2021-01-01", periods=2))
+        icu_sim = icu.ICUSimulation(icu.ICUAdmissions(s_admissions),
+                                    distributions.EmpiricalBootstrap([1]))
+        results = icu_sim.simulate(2, show_progress=False, max_workers=1)
+        assert results.get_stats() is None
+
+    def test_simulation_round_stats(self) -> None:
+        s_admissions = pd.Series([2, 2], index=pd.date_range("2021-01-01", periods=2))
+        icu_sim = icu.ICUSimulation(icu.ICUAdmissions(s_admissions),
+                                    distributions.EmpiricalBootstrap([3]))
+        stats = icu.SimulationStats()
+        vals = icu_sim.simulation_round(stats)
+        assert vals.sum() == 12
+        df_stats = stats.to_dataframe().set_index("stage")
+        assert df_stats.loc["expansion", "samples"] == 12
+        assert df_stats.loc["aggregation", "samples"] == len(vals)
+
+
+class TestAdaptiveSimulation:
+    @pytest.fixture
+    def simulation(self) -> icu.ICUSimulation:
+        s_admissions = pd.Series([5, 8, 3, 6], index=pd.date_range("2021-01-01", periods=4))
+        return icu.ICUSimulation(icu.ICUAdmissions(s_admissions),
+                                 distributions.EmpiricalBootstrap([1, 2, 3, 5, 8]))
+
+    @pytest.mark.parametrize("tolerance, time_budget, reason, iterations", [
+        (100.0, None, "tolerance", 40),
+        (1e-6, None, "max_iterations", 120),
+        (1e-6, 0.0, "time_budget", 40),
+    ])
+    def test_stop_reason(self, simulation: icu.ICUSimulation, tolerance: float,
+                         time_budget: Optional[float], reason: str, iterations: int) -> None:
+        progress = []
+        results = simulation.simulate_adaptive(
+            tolerance, batch_size=40, max_iterations=120, time_budget=time_budget,
+            backend="serial", callback=lambda completed, total, stats: progress.append((completed, total)))
+        precision = results.get_precision()
+        assert precision is not None
+        assert precision.stop_reason == reason
+        assert precision.converged == (reason == "tolerance")
+        assert precision.iterations == iterations
+        assert results.get_simulation_results().shape[1] == iterations
+        assert list(precision.mcse.columns) == ["mean_val", "lb95", "ub95", "lb50", "ub50"]
+        assert list(precision.mcse.index) == list(results.get_simulation_results().index)
+        assert progress[-1] == (iterations, iterations)
+        if reason == "tolerance":
+            assert precision.max_error() <= tolerance
+
+    def test_monte_carlo_standard_error(self) -> None:
+        rng = np.random.default_rng(0)
+        samples = rng.normal(100, 10, (3, 4000))
+        mcse = icu.monte_carlo_standard_error(samples, num_groups=20)
+        np.testing.assert_allclose(mcse.mean_val, 10 / np.sqrt(4000), rtol=0.1)
+        assert (mcse[["lb95", "ub95"]].values > mcse[["mean_val"]].values).all()
+        with pytest.raises(ValueError, match="iterations are required"):
+            icu.monte_carlo_standard_error(samples[:, :10], num_groups=10)
+
+    def test_incremental_standard_error(self) -> None:
+        rng = np.random.default_rng(0)
+        dates = pd.date_range("2021-01-01", periods=6)
+        accumulator = icu._AdaptiveAccumulator(num_groups=4, first_batch_size=8)
+        batches = []
+        for start in (2, 0, 1):
+            # Each batch has occupancy in other dates
+            batch = [pd.Series(rng.integers(1, 20, 6 - start), index=dates[start:])
+                     for _ in range(8)]
+            batches.extend(batch)
+            accumulator.add(batch)
+        df_simulation = pd.concat(batches, axis=1).fillna(0)
+        pd.testing.assert_frame_equal(accumulator.get_dataframe(), df_simulation,
+                                      check_dtype=False, check_names=False,
+                                      check_column_type=False, check_freq=False)
+        # 12 groups of 2 iterations are merged into 6 groups of 4
+        assert accumulator.group_size == 4
+        mcse = accumulator.standard_error()
+        expected = icu.monte_carlo_standard_error(df_simulation.values, num_groups=6)
+        np.testing.assert_allclose(mcse.values, expected.values)
+        with pytest.raises(ValueError, match="iterations are required"):
+            icu._AdaptiveAccumulator(num_groups=4, first_batch_size=4).standard_error()
+
+
+class TestVarianceReduction:
+    @pytest.fixture
+    def admissions(self) -> icu.ICUAdmissions:
+        return icu.ICUAdmissions(pd.Series([5, 8, 3, 6],
+                                           index=pd.date_range("2021-01-01", periods=4)))
+
+    @pytest.mark.parametrize("sampling", ["random", "antithetic", "sobol"])
+    def test_seed(self, admissions: icu.ICUAdmissions, sampling: str) -> None:
+        simulation = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([1, 2, 3, 5, 8]))
+        serial = simulation.simulate(8, backend="serial", sampling=sampling, seed=3)
+        processes = simulation.simulate(8, max_workers=2, sampling=sampling, seed=3)
+        df_serial = serial.get_simulation_results()
+        df_processes = processes.get_simulation_results()
+        # The rounds complete in any order, but each round is reproducible
+        assert sorted(map(tuple, df_serial.T.values)) == sorted(map(tuple, df_processes.T.values))
+
+    def test_common_random_numbers(self, admissions: icu.ICUAdmissions) -> None:
+        baseline = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([2, 4, 6, 8]))
+        scenario = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([1, 2, 3, 4]))
+        sampler = distributions.DurationSampler(seed=0)
+        for round_index in range(3):
+            vals_baseline = baseline.simulation_round(sampler=sampler, round_index=round_index)
+            vals_scenario = scenario.simulation_round(sampler=sampler, round_index=round_index)
+            # Each patient stays half of the time in the scenario
+            assert vals_scenario.sum() * 2 == vals_baseline.sum()
+
+    def test_antithetic_pairs(self, admissions: icu.ICUAdmissions) -> None:
+        simulation = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([1, 2, 3, 4]))
+        sampler = distributions.DurationSampler("antithetic", seed=0)
+        total = simulation.simulation_round(sampler=sampler, round_index=0).sum() \
+            + simulation.simulation_round(sampler=sampler, round_index=1).sum()
+        # The durations of each patient in a pair sum to 5 days
+        assert total == 5 * 22
+
+    def test_multi_hospital(self, admissions: icu.ICUAdmissions) -> None:
+        df_admissions = pd.DataFrame({"h1": [1, 2, 0], "h2": [3, 0, 1]},
+                                     index=pd.date_range("2021-01-01", periods=3))
+        dist = distributions.EmpiricalBootstrap([1, 2, 3, 4])
+        first = icu.MultiHospitalSimulation(df_admissions, dist).simulate(4, seed=1)
+        second = icu.MultiHospitalSimulation(df_admissions, {"h1": dist, "h2": dist}).simulate(4, seed=1)
+        np.testing.assert_array_equal(first.get_occupancy_array(), second.get_occupancy_array())
+        antithetic = icu.MultiHospitalSimulation(df_admissions, dist).simulate(2, sampling="antithetic")
+        assert antithetic.get_occupancy_array().sum() == 5 * 7
+
+
+class TestICUSimulationResults:
+    @pytest.fixture
+    def results(self) -> icu.ICUSimulationResults:
+        index = pd.date_range("2021-01-01", periods=3)
+        df_simulation = pd.DataFrame([[1.0, 5.0, 3.0, 2.0],
+                                      [0.0, 0.0, 10.0, 4.0],
+                                      [7.0, 7.0, 7.0, 7.0]], index=index)
+        return icu.ICUSimulationResults(None, df_simulation)
+
+    def test_exceedance_scalar(self, results: icu.ICUSimulationResults) -> None:
+        df_prob = results.exceedance_probability(3)
+        assert list(df_prob.columns) == [3]
+        np.testing.assert_allclose(df_prob[3], [0.25, 0.5, 1.0])
+
+    def test_exceedance_many(self, results: icu.ICUSimulationResults) -> None:
+        df_prob = results.exceedance_probability([-1, 0, 2.5, 7, 100])
+        expected = (results.df_simulation.values[:, :, np.newaxis]
+                    > np.array([-1, 0, 2.5, 7, 100])).mean(axis=1)
+        np.testing.assert_allclose(df_prob.values, expected)
+
+    def test_exceedance_series(self, results: icu.ICUSimulationResults) -> None:
+        capacity = pd.Series([1, 3], index=pd.date_range("2021-01-02", periods=2),
+                             name="beds")
+        df_prob = results.exceedance_probability(capacity)
+        assert list(df_prob.columns) == ["beds"]
+        assert np.isnan(df_prob.beds.iloc[0])
+        np.testing.assert_allclose(df_prob.beds.iloc[1:], [0.5, 1.0])
+
+        df_capacity = pd.DataFrame({"a": [1, 1, 1], "b": [10, 10, 6]},
+                                   index=results.df_simulation.index)
+        df_prob = results.exceedance_probability(df_capacity)
+        np.testing.assert_allclose(df_prob.values, [[0.75, 0.0], [0.5, 0.0], [1.0, 1.0]])
+
+    def test_exceedance_random(self) -> None:
+        rng = np.random.default_rng(0)
+        occupancy = rng.poisson(20, (30, 200))
+        results = icu.ICUSimulationResults(None, pd.DataFrame(occupancy))
+        thresholds = [0, 10, 15.5, 20, 30, 60]
+        df_prob = results.exceedance_probability(thresholds)
+        expected = (occupancy[:, :, np.newaxis] > np.array(thresholds)).mean(axis=1)
+        np.testing.assert_allclose(df_prob.values, expected)
+
+    def test_exceedance_cache(self, results: icu.ICUSimulationResults,
+                              monkeypatch: pytest.MonkeyPatch) -> None:
+        calls = []
+        get_sorted_simulation = results.get_sorted_simulation
+
+        def counting_sort() -> np.ndarray:
+            calls.append(1)
+            return get_sorted_simulation()
+
+        monkeypatch.setattr(results, "get_sorted_simulation", counting_sort)
+        for capacity in (1, 3, [2, 7]):
+            results.exceedance_probability(capacity)
+        assert len(calls) == 1
+
+        results.df_simulation = results.df_simulation * 2
+        np.testing.assert_allclose(results.exceedance_probability(3)[3], [0.75, 0.5, 1.0])
+        assert len(calls) == 2
+
+    def test_hdi(self) -> None:
+        import arviz as az
+        rng = np.random.default_rng(0)
+        df_simulation = pd.DataFrame(rng.poisson(30, (40, 100)).astype(np.float64),
+                                     index=pd.date_range("2021-01-01", periods=40))
+        results = icu.ICUSimulationResults(None, df_simulation)
+        df_hdi = results.hdi(chunk_size=16)
+        assert len(df_hdi) == 40
+        assert (df_hdi.date == df_simulation.index).all()
+        for i, (_, row) in enumerate(df_simulation.iterrows()):
+            np.testing.assert_array_equal(df_hdi.loc[i, ["lb95", "ub95"]],
+                                          az.hdi(row.values, hdi_prob=0.95))
+            np.testing.assert_array_equal(df_hdi.loc[i, ["lb50", "ub50"]],
+                                          az.hdi(row.values, hdi_prob=0.50))
+        np.testing.assert_allclose(df_hdi.mean_val, df_simulation.mean(axis=1))
+
+    @pytest.mark.parametrize("scale, dtype", [(1, np.int16), (100000, np.int32)])
+    def test_save_load(self, results: icu.ICUSimulationResults, tmp_path: Path,
+                       scale: int, dtype: type) -> None:
+        results.df_simulation = results.df_simulation * scale
+        results.df_simulation = results.df_simulation.drop(
+            results.df_simulation.index[1])
+        results.admissions = icu.ICUAdmissions(
+            pd.Series([1, 2], index=pd.date_range("2020-12-30", periods=2)))
+        results.save(tmp_path / "results")
+
+        loaded = icu.ICUSimulationResults.load(tmp_path / "results")
+        occupancy = np.load(tmp_path / "results" / loaded.OCCUPANCY_FILENAME, mmap_mode="r")
+        assert occupancy.dtype == dtype
+        base = loaded.df_simulation.values
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        assert isinstance(base, np.memmap)
+        assert list(loaded.df_simulation.index) == list(results.df_simulation.index)
+        np.testing.assert_array_equal(loaded.df_simulation.values,
+                                      results.df_simulation.values)
+        pd.testing.assert_frame_equal(loaded.hdi(), results.hdi(), check_dtype=False)
+        assert loaded.get_admissions().get_admissions_series().sum() == 3
+        loaded.plot.lineplot()
+        plt.close()
+
+        in_memory = icu.ICUSimulationResults.load(tmp_path / "results", mmap=False)
+        np.testing.assert_array_equal(in_memory.df_simulation.values,
+                                      results.df_simulation.values)
+
+    def test_without_admissions(self, results: icu.ICUSimulationResults) -> None:
+        with pytest.raises(ValueError, match="without admissions"):
+            results.get_admissions()
+
+    def test_hdi_cache(self, results: icu.ICUSimulationResults,
+                       monkeypatch: pytest.MonkeyPatch) -> None:
+        calls = []
+        compute_hdi = results._compute_hdi
+
+        def counting_hdi(chunk_size: int) -> pd.DataFrame:
+            calls.append(chunk_size)
+            return compute_hdi(chunk_size)
+
+        monkeypatch.setattr(results, "_compute_hdi", counting_hdi)
+        df_hdi = results.hdi()
+        df_hdi.loc[0, "mean_val"] = -1
+        assert results.hdi().loc[0, "mean_val"] == pytest.approx(2.75)
+        assert len(calls) == 1
+
+        results.df_simulation = results.df_simulation + 1
+        assert results.hdi().loc[0, "mean_val"] == pytest.approx(3.75)
+        results.df_simulation[0] = 0.0
+        assert results.hdi().loc[0, "mean_val"] == pytest.approx(3.25)
+        results.df_simulation.iloc[0, 1] = 10.0
+        results.invalidate_cache()
+        assert results.hdi().loc[0, "mean_val"] == pytest.approx(4.25)
+        assert len(calls) == 4
+
+    @pytest.mark.parametrize("mode", ["lines", "density"])
+    def test_trajectories(self, mode: str) -> None:
+        rng = np.random.default_rng(0)
+        index = pd.date_range("2021-01-01", periods=30).delete(10)
+        results = icu.ICUSimulationResults(None, pd.DataFrame(rng.poisson(20, (29, 500)),
+                                                              index=index))
+        ax = results.plot.trajectories(mode, max_trajectories=100, bins=20, chunk_size=7)
+        if mode == "lines":
+            assert len(ax.collections) == 1
+            assert len(ax.collections[0].get_segments()) == 100
+        else:
+            density = np.asarray(ax.images[0].get_array())
+            assert density.shape == (20, 29)
+            np.testing.assert_allclose(density.sum(axis=0), 1.0)
+        plt.close()
+        with pytest.raises(ValueError, match="Unknown mode"):
+            results.plot.trajectories("boxes")
+
+
+class TestAdmissionTrajectories:
+    @pytest.fixture
+    def admissions(self) -> icu.ICUAdmissions:
+        return icu.ICUAdmissions(pd.Series([2, 0, 1], index=pd.date_range("2021-01-01", periods=3)))
+
+    @pytest.fixture
+    def trajectories(self) -> pd.DataFrame:
+        return pd.DataFrame([[1.0, 0.0], [3.0, 2.0], [0.0, 5.2]],
+                            columns=pd.date_range("2021-01-04", periods=2))
+
+    def test_pairing(self, admissions: icu.ICUAdmissions, trajectories: pd.DataFrame) -> None:
+        icu_sim = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([2]),
+                                    trajectories)
+        results = icu_sim.simulate_ensemble(iterations=4)
+        df_simulation = results.get_simulation_results()
+        assert list(df_simulation.index) == list(pd.date_range("2021-01-01", periods=6))
+        expected = np.array([[2, 2, 1, 2, 1, 0],
+                             [2, 2, 1, 4, 5, 2],
+                             [2, 2, 1, 1, 5, 5],
+                             [2, 2, 1, 2, 1, 0]])
+        np.testing.assert_array_equal(df_simulation.values.T, expected)
+        vals = icu_sim.simulation_round(round_index=5)
+        np.testing.assert_array_equal(vals.values, expected[2])
+        assert icu_sim.get_admission_trajectories() is trajectories
+        assert icu_sim.simulate_ensemble().get_simulation_results().shape[1] == 3
+
+    def test_sobol_variable_rounds(self, admissions: icu.ICUAdmissions,
+                                   trajectories: pd.DataFrame) -> None:
+        icu_sim = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([1, 2]),
+                                    trajectories)
+        # The trajectories have different totals, so the rounds have
+        # different numbers of patients
+        with pytest.raises(ValueError, match="same number of patients"):
+            icu_sim.simulate(4, backend="serial", sampling="sobol")
+        with pytest.raises(ValueError, match="same number of patients"):
+            icu_sim.simulate_ensemble(4, sampling="sobol")
+        with pytest.raises(ValueError, match="same number of patients"):
+            icu_sim.simulate_adaptive(batch_size=2, max_iterations=4, backend="serial",
+                                      show_progress=False, sampling="sobol")
+        same_totals = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([1, 2]),
+                                        pd.DataFrame([[1, 2], [3, 0]], columns=trajectories.columns))
+        assert same_totals.simulate_ensemble(4, sampling="sobol").get_simulation_results().shape[1] == 4
+
+    @pytest.mark.parametrize("sampling", ["random", "antithetic"])
+    def test_same_as_simulate(self, admissions: icu.ICUAdmissions,
+                              trajectories: pd.DataFrame, sampling: str) -> None:
+        icu_sim = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([0, 1, 3, 7]),
+                                    trajectories)
+        ensemble = icu_sim.simulate_ensemble(6, sampling=sampling, seed=3)
+        df_ensemble = ensemble.get_simulation_results()
+        df_rounds = icu_sim.simulate(6, show_progress=False, backend="serial",
+                                     sampling=sampling, seed=3).get_simulation_results()
+        df_rounds = df_rounds.reindex(df_ensemble.index, fill_value=0)
+        np.testing.assert_array_equal(df_ensemble.values, df_rounds.values)
+
+    def test_without_trajectories(self, admissions: icu.ICUAdmissions) -> None:
+        icu_sim = icu.ICUSimulation(admissions, distributions.EmpiricalBootstrap([1]))
+        df_simulation = icu_sim.simulate_ensemble().get_simulation_results()
+        assert df_simulation.shape == (3, 10)
+        assert (df_simulation.values.T == [2, 0, 1]).all()
+
+    def test_invalid(self, admissions: icu.ICUAdmissions, trajectories: pd.DataFrame) -> None:
+        dist = distributions.EmpiricalBootstrap([1])
+        with pytest.raises(ValueError, match="should start after"):
+            icu.ICUSimulation(admissions, dist, trajectories.set_axis(
+                pd.date_range("2021-01-03", periods=2), axis=1))
+        with pytest.raises(ValueError, match="negative"):
+            icu.ICUSimulation(admissions, dist, -trajectories)
+        with pytest.raises(ValueError, match="Empty"):
+            icu.ICUSimulation(admissions, dist, trajectories.iloc[:0])
+
+
+class TestMultiHospitalSimulation:
+    @pytest.fixture
+    def admissions(self) -> pd.DataFrame:
+        index = pd.date_range("2021-01-01", periods=4)
+        return pd.DataFrame({
+            "h1": [1, 0, 2, 0],
+            "h2": [0, 3, 0, 1],
+            "h3": [2, 2, 2, 2],
+        }, index=index)
+
+    @pytest.fixture
+    def hierarchy(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "region": ["r1", "r1", "r2"],
+            "state": ["s1", "s1", "s1"],
+        }, index=["h1", "h2", "h3"])
+
+    def test_fixed_los(self, admissions: pd.DataFrame) -> None:
+        sim = icu.MultiHospitalSimulation(admissions, distributions.EmpiricalBootstrap([2]))
+        results = sim.simulate(iterations=3)
+        occupancy = results.get_occupancy_array()
+        assert occupancy.shape == (3, 3, 5)
+        np.testing.assert_array_equal(occupancy[0, 0], [1, 1, 2, 2, 0])
+        np.testing.assert_array_equal(occupancy[1, 2], [0, 3, 3, 1, 1])
+        np.testing.assert_array_equal(occupancy[2, 1], [2, 4, 4, 4, 2])
+        assert (occupancy[:, 0] == occupancy[:, 1]).all()
+
+    @pytest.mark.parametrize("sampling", ["random", "sobol"])
+    def test_chunks(self, admissions: pd.DataFrame, sampling: str) -> None:
+        sim = icu.MultiHospitalSimulation(admissions, distributions.EmpiricalBootstrap([1, 2, 9]))
+        expected = sim.simulate(iterations=8, sampling=sampling, seed=0)
+        # The chunks extend the dates when their stays end later
+        for chunk_size in [1, 3]:
+            results = sim.simulate(iterations=8, sampling=sampling, seed=0, chunk_size=chunk_size)
+            pd.testing.assert_index_equal(results.dates, expected.dates)
+            np.testing.assert_array_equal(results.get_occupancy_array(),
+                                          expected.get_occupancy_array())
+
+    def test_chunk_memory(self) -> None:
+        admissions = pd.DataFrame(np.full((30, 50), 10),
+                                  index=pd.date_range("2021-01-01", periods=30))
+        sim = icu.MultiHospitalSimulation(admissions, distributions.EmpiricalBootstrap([3, 7]))
+        tracemalloc.start()
+        try:
+            results = sim.simulate(iterations=200, chunk_size=10)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # The stays of all the rounds at once would take 24 MB per array
+        assert peak < 4 * results.get_occupancy_array().nbytes + 8 * 1024 * 1024
+
+    def test_irregular_dates(self) -> None:
+        distribution = distributions.EmpiricalBootstrap([2])
+        # Unsorted, with a duplicated date and without the dates of no admissions
+        irregular = pd.DataFrame({"h1": [1, 1, 1], "h2": [0, 2, 1]},
+                                 index=pd.to_datetime(["2021-01-04", "2021-01-01", "2021-01-04"]))
+        regular = pd.DataFrame({"h1": [1, 0, 0, 2], "h2": [2, 0, 0, 1]},
+                               index=pd.date_range("2021-01-01", periods=4))
+        sim = icu.MultiHospitalSimulation(irregular, distribution)
+        pd.testing.assert_frame_equal(sim.admissions, regular, check_freq=False)
+        results = sim.simulate(iterations=1)
+        expected = icu.MultiHospitalSimulation(regular, distribution).simulate(iterations=1)
+        pd.testing.assert_index_equal(results.dates, expected.dates)
+        np.testing.assert_array_equal(results.get_occupancy_array(),
+                                      expected.get_occupancy_array())
+        np.testing.assert_array_equal(results.get_occupancy_array()[0, 0], [1, 1, 0, 2, 2])
+
+    def test_same_as_single_hospital(self, admissions: pd.DataFrame) -> None:
+        distribution = distributions.EmpiricalBootstrap([0, 1, 3, 5])
+        sim = icu.MultiHospitalSimulation(admissions[["h3"]], distribution)
+        np.random.seed(0)
+        results = sim.simulate(iterations=1)
+        icu_sim = icu.ICUSimulation(icu.ICUAdmissions(admissions.h3), distribution)
+        np.random.seed(0)
+        vals = icu_sim.simulation_round()
+        df_results = results.get_simulation_results("h3")
+        np.testing.assert_array_equal(df_results.loc[vals.index, 0], vals.values)
+        assert df_results[0].sum() == vals.sum()
+
+    def test_per_hospital_distributions(self, admissions: pd.DataFrame) -> None:
+        sim = icu.MultiHospitalSimulation(admissions, {
+            "h1": distributions.EmpiricalBootstrap([1]),
+            "h2": distributions.EmpiricalBootstrap([2]),
+            "h3": distributions.EmpiricalBootstrap([3]),
+        })
+        occupancy = sim.simulate(iterations=2).get_occupancy_array()
+        assert occupancy.shape[-1] == 6
+        assert occupancy[:, 0].sum(axis=-1).tolist() == [3, 8, 24]
+
+        with pytest.raises(ValueError, match="without a duration"):
+            icu.MultiHospitalSimulation(admissions, {"h1": distributions.EmpiricalBootstrap([1])})
+
+    def test_hierarchy(self, admissions: pd.DataFrame, hierarchy: pd.DataFrame) -> None:
+        sim = icu.MultiHospitalSimulation(admissions, distributions.EmpiricalBootstrap([1, 2, 6]),
+                                          hierarchy)
+        results = sim.simulate(iterations=50)
+        occupancy = results.get_occupancy_array()
+        groups, regions = results.aggregate("region")
+        assert list(groups) == ["r1", "r2"]
+        np.testing.assert_array_equal(regions[0], occupancy[0] + occupancy[1])
+        _, states = results.aggregate("state")
+        _, total = results.aggregate("total")
+        np.testing.assert_array_equal(states, total)
+
+        df_hdi = results.hdi("region")
+        assert list(df_hdi.columns) == ["region", "date", "lb95", "ub95", "lb50",
+                                        "ub50", "mean_val", "median_val"]
+        assert len(df_hdi) == 2 * len(results.dates)
+        assert (df_hdi.lb95 <= df_hdi.lb50).all()
+        assert (df_hdi.ub50 <= df_hdi.ub95).all()
+
+        with pytest.raises(ValueError, match="not found"):
+            results.aggregate("county")
+        with pytest.raises(ValueError, match="not found in the hierarchy"):
+            icu.MultiHospitalSimulation(admissions, distributions.EmpiricalBootstrap([1]),
+                                        hierarchy.iloc[:2])
+        hierarchy.loc["h2", "region"] = None
+        with pytest.raises(ValueError, match="without a group in the level region"):
+            icu.MultiHospitalSimulation(admissions, distributions.EmpiricalBootstrap([1]),
+                                        hierarchy)
+
+    def test_hdi_intervals(self) -> None:
+        import arviz as az
+        rng = np.random.default_rng(0)
+        samples = rng.poisson(10, (4, 200))
+        lb, ub = icu.hdi_intervals(samples, 0.95)
+        for i in range(len(samples)):
+            np.testing.assert_array_equal([lb[i], ub[i]], az.hdi(samples[i], hdi_prob=0.95))
+
+
+class TestPathwaySimulation:
+    @pytest.fixture
+    def admissions(self) -> icu.ICUAdmissions:
+        return icu.ICUAdmissions(pd.Series([2, 0, 1], index=pd.date_range("2021-01-01", periods=3)))
+
+    def test_deterministic(self, admissions: icu.ICUAdmissions) -> None:
+        stages = {
+            "ward": icu.PathwayStage(distributions.EmpiricalBootstrap([1]), {"icu": 1.0}),
+            "icu": icu.PathwayStage(distributions.EmpiricalBootstrap([2]), {"step-down": 1.0}),
+            "step-down": icu.PathwayStage(distributions.EmpiricalBootstrap([1])),
+        }
+        results = icu.PathwaySimulation(admissions, stages).simulate(iterations=3)
+        assert results.stages == ["ward", "icu", "step-down"]
+        assert list(results.dates) == list(pd.date_range("2021-01-01", periods=6))
+        occupancy = results.get_occupancy_array()
+        assert occupancy.shape == (3, 3, 6)
+        np.testing.assert_array_equal(occupancy[:, 0], [[2, 0, 1, 0, 0, 0],
+                                                        [0, 2, 2, 1, 1, 0],
+                                                        [0, 0, 0, 2, 0, 1]])
+        assert (occupancy == occupancy[:, :1]).all()
+        icu_results = results.get_simulation_results("icu")
+        assert icu_results.get_simulation_results().shape == (6, 3)
+        assert icu_results.get_admissions() is admissions
+        df_hdi = results.hdi()
+        assert len(df_hdi) == 3 * 6
+        assert list(df_hdi[df_hdi.stage == "step-down"].mean_val) == [0, 0, 0, 2, 0, 1]
+        with pytest.raises(ValueError, match="not found"):
+            results.get_simulation_results("morgue")
+
+    def test_outcomes(self) -> None:
+        admissions = icu.ICUAdmissions(pd.Series([1000], index=pd.date_range("2021-01-01", periods=1)))
+        stages = {
+            "ward": icu.PathwayStage(distributions.EmpiricalBootstrap([1]),
+                                     {"icu": {"DEATH": 1.0, "RECOVERY": 0.5}}),
+            "icu": icu.PathwayStage({"DEATH": distributions.EmpiricalBootstrap([3]),
+                                     "RECOVERY": distributions.EmpiricalBootstrap([1])}),
+        }
+        simulation = icu.PathwaySimulation(admissions, stages, pd.Series({"DEATH": 0.2, "RECOVERY": 0.8}))
+        results = simulation.simulate(iterations=20, seed=0)
+        icu_occupancy = results.get_occupancy_array()[1]
+        # 20% of deaths + 40% of recoveries enter the ICU, only the
+        # deaths stay for more than one day
+        np.testing.assert_allclose(icu_occupancy[:, 1].mean(), 600, rtol=0.05)
+        np.testing.assert_allclose(icu_occupancy[:, 2:4].mean(), 200, rtol=0.1)
+        np.testing.assert_array_equal(results.get_occupancy_array(),
+                                      simulation.simulate(iterations=20, seed=0).get_occupancy_array())
+
+    def test_trajectories(self, admissions: icu.ICUAdmissions) -> None:
+        trajectories = pd.DataFrame([[1], [3]], columns=pd.date_range("2021-01-04", periods=1))
+        stages = {"ward": icu.PathwayStage(distributions.EmpiricalBootstrap([1]))}
+        results = icu.PathwaySimulation(admissions, stages,
+                                        admission_trajectories=trajectories).simulate()
+        np.testing.assert_array_equal(results.get_occupancy_array()[0],
+                                      [[2, 0, 1, 1], [2, 0, 1, 3]])
+
+    @pytest.mark.parametrize("stages, outcomes, match", [
+        ({"a": {"b": 1.0}, "b": {"a": 0.5}}, None, "cycle"),
+        ({"a": {"c": 1.0}}, None, "unknown stage"),
+        ({"a": {"b": 0.7}, "b": {}}, {"x": 0.5, "y": 0.6}, "sum to 1"),
+        ({"a": {"b": 0.7, "c": 0.4}, "b": {}, "c": {}}, None, "at most 1"),
+        ({"a": {"b": {"x": 0.5}}, "b": {}}, None, "unknown outcomes"),
+        ({"a": {"b": {"z": 0.5}}, "b": {}}, {"x": 1.0}, "unknown outcomes"),
+    ])
+    def test_invalid(self, admissions: icu.ICUAdmissions, stages: dict,
+                     outcomes: Optional[dict], match: str) -> None:
+        dist = distributions.EmpiricalBootstrap([1])
+        pathway = {name: icu.PathwayStage(dist, transitions) for name, transitions in stages.items()}
+        with pytest.raises(ValueError, match=match):
+            icu.PathwaySimulation(admissions, pathway, outcomes)
+
+    def test_missing_outcome_durations(self, admissions: icu.ICUAdmissions) -> None:
+        dist = distributions.EmpiricalBootstrap([1])
+        outcomes = {"DEATH": 0.2, "RECOVERY": 0.8}
+        stages = {
+            "ward": icu.PathwayStage(dist, {"icu": {"DEATH": 1.0}}),
+            "icu": icu.PathwayStage({"DEATH": dist}),
+        }
+        # Only the deaths reach the ICU
+        icu.PathwaySimulation(admissions, stages, outcomes)
+        stages["ward"] = icu.PathwayStage(dist, {"icu": {"DEATH": 1.0, "RECOVERY": 0.1}})
+        with pytest.raises(ValueError, match=r"icu without durations for the outcomes \['RECOVERY'\]"):
+            icu.PathwaySimulation(admissions, stages, outcomes)
+        with pytest.raises(ValueError, match="ward without durations"):
+            icu.PathwaySimulation(admissions, {"ward": icu.PathwayStage({"DEATH": dist})}, outcomes)
+
+    def test_invalid_entry_stage(self, admissions: icu.ICUAdmissions) -> None:
+        stages = {"ward": icu.PathwayStage(distributions.EmpiricalBootstrap([1]))}
+        with pytest.raises(ValueError, match="Entry stage"):
+            icu.PathwaySimulation(admissions, stages, entry_stage="icu")
+        with pytest.raises(ValueError, match="at least one stage"):
+            icu.PathwaySimulation(admissions, {})
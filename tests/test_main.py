@@ -1,8 +1,51 @@
+import json
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
 import episuite
 
+HEAVY_MODULES = ["arviz", "matplotlib", "seaborn", "pkg_resources",
+                 "numpyro", "jax"]
+
+
+def import_in_subprocess(statement: str) -> Dict:
+    """Run an import statement in a new interpreter and return the time
+    spent and the modules loaded."""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(json.dumps({'elapsed': elapsed, 'modules': list(sys.modules)}))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
 
 class TestMain:
     def test_one(self) -> None:
         assert episuite.__version__ is not None
         assert episuite.__author__ is not None
         assert episuite.__appname__ is not None
+
+    def test_lazy_submodules(self) -> None:
+        assert episuite.icu.__name__ == "episuite.icu"
+        assert "durations" in dir(episuite)
+        with pytest.raises(AttributeError):
+            episuite.unknown_module
+
+    def test_import_budget(self) -> None:
+        result = import_in_subprocess("import episuite")
+        assert result["elapsed"] < 0.5
+        modules = set(result["modules"])
+        assert modules.isdisjoint(HEAVY_MODULES + ["pandas", "episuite.icu"])
+
+    @pytest.mark.parametrize("module", ["episuite.icu", "episuite.durations",
+                                        "episuite.data", "episuite.mobility.google"])
+    def test_no_plotting_on_import(self, module: str) -> None:
+        result = import_in_subprocess(f"import {module}")
+        assert set(result["modules"]).isdisjoint(HEAVY_MODULES)
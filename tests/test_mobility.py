@@ -1,7 +1,19 @@
+import datetime
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
 import pytest
+import requests
 from matplotlib import pyplot as plt
 
+from episuite import data
 from episuite.mobility import facebook, google
+from episuite.mobility.cube import MobilityCube
+from tests.conftest import LocalHTTPServer
 
 
 class TestFacebookSurvey:
@@ -69,3 +81,358 @@ class TestGoogleMobility:
         report_br = client.load_report("BR", show_progress=False)
         assert len(report_br) > 0
         assert len(report_br) < len(report)
+
+
+class TestGoogleMobilityCache:
+    @pytest.fixture
+    def report_url(self, http_server: LocalHTTPServer, cache_dir: Path) -> str:
+        dates = pd.date_range("2020-02-15", periods=10)
+        frames = []
+        for code, name in [("BR", "Brazil"), ("NA", "Namibia"), ("US", "United States")]:
+            df = pd.DataFrame({
+                "country_region_code": code,
+                "country_region": name,
+                "sub_region_1": "",
+                "date": dates.strftime("%Y-%m-%d"),
+            })
+            for category in google.GoogleMobility.MOBILITY_CATEGORIES:
+                df[f"{category}_percent_change_from_baseline"] = np.arange(len(dates))
+            frames.append(df)
+        content = pd.concat(frames).to_csv(index=False).encode("utf-8")
+        return http_server.write("report.csv", content)
+
+    def test_columnar(self, report_url: str, cache_dir: Path) -> None:
+        pytest.importorskip("pyarrow")
+        client = google.GoogleMobility(report_url)
+        report_br = client.load_report("BR", show_progress=False)
+        assert len(report_br) == 10
+        assert set(report_br.country_region_code) == {"BR"}
+        assert report_br.parks_percent_change_from_baseline.dtype == np.float32
+        assert pd.api.types.is_datetime64_any_dtype(report_br.date)
+        assert (cache_dir / client.DATASET_DIRNAME).is_dir()
+
+        report = client.load_report(["BR", "NA"], show_progress=False,
+                                    columns=["date", "parks_percent_change_from_baseline"])
+        assert len(report) == 20
+        assert list(report.columns) == ["date", "parks_percent_change_from_baseline"]
+
+        report_all = client.load_report(show_progress=False)
+        assert len(report_all) == 30
+
+    @pytest.mark.parametrize("compression", ["gzip", "zstd"])
+    @pytest.mark.parametrize("columnar", [False, True])
+    def test_compression(self, report_url: str, cache_dir: Path,
+                         compression: str, columnar: bool) -> None:
+        if columnar:
+            pytest.importorskip("pyarrow")
+        if compression == "zstd":
+            pytest.importorskip("zstandard")
+        client = google.GoogleMobility(report_url, compression=compression)
+        report = client.load_report(["BR", "NA"], show_progress=False,
+                                    columnar=columnar)
+        assert len(report) == 20
+        extension = data.COMPRESSION_EXTENSIONS[compression]
+        assert (cache_dir / f"{client.REPORT_FILENAME}{extension}").exists()
+        assert not (cache_dir / client.REPORT_FILENAME).exists()
+
+    def test_csv_fallback(self, report_url: str, cache_dir: Path) -> None:
+        client = google.GoogleMobility(report_url)
+        report = client.load_report(["BR", "US"], show_progress=False,
+                                    columnar=False)
+        assert len(report) == 20
+        assert not (cache_dir / client.DATASET_DIRNAME).exists()
+
+    def test_load_cube(self, report_url: str, cache_dir: Path) -> None:
+        client = google.GoogleMobility(report_url)
+        cube = client.load_cube(["BR", "US"], show_progress=False)
+        assert isinstance(cube.values, np.memmap)
+        assert cube.values.shape == (2, 10, 6)
+        assert cube.values.dtype == np.float32
+        assert list(cube.regions) == ["BR", "US"]
+        assert cube.categories == list(client.MOBILITY_CATEGORIES)
+        series = cube.region_series("US")
+        assert series.index[0] == pd.Timestamp("2020-02-15")
+        np.testing.assert_array_equal(series.parks, np.arange(10))
+
+        cube_dir = cache_dir / MobilityCube.cache_name("google_mobility", ["BR", "US"])
+        mtime = (cube_dir / MobilityCube.VALUES_FILENAME).stat().st_mtime
+        client.load_cube(["US", "BR"], show_progress=False)
+        assert (cube_dir / MobilityCube.VALUES_FILENAME).stat().st_mtime == mtime
+
+
+class TestFacebookMovementRangeLocal:
+    @pytest.fixture
+    def mrange(self, http_server: LocalHTTPServer, cache_dir: Path,
+               monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> facebook.FacebookMovementRange:
+        frames = []
+        for country in ["BRA", "ARG", "NAM"]:
+            frames.append(pd.DataFrame({
+                "ds": pd.date_range("2021-01-01", periods=5).strftime("%Y-%m-%d"),
+                "country": country,
+                "polygon_id": f"{country}.1_1",
+                "all_day_bing_tiles_visited_relative_change": np.linspace(-0.5, 0.5, 5),
+                "all_day_ratio_single_tile_users": np.linspace(0.1, 0.2, 5),
+            }))
+        zip_fname = tmp_path / "movement-range.zip"
+        with ZipFile(zip_fname, "w") as zip_file:
+            zip_file.writestr("movement-range-2021-01-05.txt",
+                              pd.concat(frames).to_csv(sep="\t", index=False))
+        url = http_server.write("movement-range.zip", zip_fname.read_bytes())
+        resource = facebook.MovementRangeResource(datetime.date(2021, 1, 5), url,
+                                                  "movement-range-data-2021-01-05.zip")
+        client = facebook.FacebookMovementRange()
+        monkeypatch.setattr(client, "_get_last_date_available", lambda: resource)
+        return client
+
+    @pytest.mark.parametrize("columnar", [False, True])
+    def test_load_movement_range(self, mrange: facebook.FacebookMovementRange,
+                                 columnar: bool) -> None:
+        if columnar:
+            pytest.importorskip("pyarrow")
+        df_bra = mrange.load_movement_range("BRA", show_progress=False,
+                                            columnar=columnar)
+        assert len(df_bra) == 5
+        assert pd.api.types.is_datetime64_any_dtype(df_bra.ds)
+        assert df_bra.all_day_ratio_single_tile_users.dtype == np.float32
+
+        df = mrange.load_movement_range(["BRA", "NAM"], show_progress=False,
+                                        columns=["ds", "polygon_id"],
+                                        columnar=columnar)
+        assert len(df) == 10
+        assert list(df.columns) == ["ds", "polygon_id"]
+
+        df_total = mrange.load_movement_range(show_progress=False,
+                                              columnar=columnar)
+        assert len(df_total) == 15
+
+    def test_columnar_cache(self, mrange: facebook.FacebookMovementRange,
+                            cache_dir: Path) -> None:
+        pytest.importorskip("pyarrow")
+        mrange.load_movement_range("BRA", show_progress=False, columnar=True)
+        dataset_dir = cache_dir / "movement-range-data-2021-01-05.parquet"
+        assert (dataset_dir / "country=BRA").is_dir()
+        mtime = (dataset_dir / "_source.json").stat().st_mtime
+        mrange.load_movement_range("ARG", show_progress=False, columnar=True)
+        assert (dataset_dir / "_source.json").stat().st_mtime == mtime
+
+    def test_load_cube(self, mrange: facebook.FacebookMovementRange) -> None:
+        cube = mrange.load_cube(["BRA", "NAM"], show_progress=False)
+        assert cube.values.shape == (2, 5, 2)
+        assert list(cube.regions) == ["BRA.1_1", "NAM.1_1"]
+        np.testing.assert_allclose(cube.region_values("NAM.1_1")[:, 0],
+                                   np.linspace(-0.5, 0.5, 5), rtol=1e-6)
+
+    def test_resource_ttl(self, mrange: facebook.FacebookMovementRange,
+                          monkeypatch: pytest.MonkeyPatch) -> None:
+        resource = mrange._get_last_date_available()
+        calls = []
+
+        def get_last_date_available() -> facebook.MovementRangeResource:
+            calls.append(1)
+            return resource
+
+        monkeypatch.setattr(mrange, "_get_last_date_available", get_last_date_available)
+        assert mrange.get_last_resource() == resource
+        assert mrange.get_last_resource() == resource
+        assert len(calls) == 1
+
+        mrange.resource_ttl = 0
+        assert mrange.get_last_resource() == resource
+        assert len(calls) == 2
+
+        # A truncated or incomplete metadata file is a cache miss
+        mrange.resource_ttl = 3600
+        resource_file = data.get_cache_dir_file(mrange.RESOURCE_FILENAME)
+        for content in ['{"date": "2021-', '{"date": "2021-01-01"}']:
+            resource_file.write_text(content, encoding="utf-8")
+            assert mrange.get_last_resource() == resource
+        assert len(calls) == 4
+        assert json.loads(resource_file.read_text(encoding="utf-8"))["url"] == resource.url
+        assert [p.name for p in resource_file.parent.glob(f".{resource_file.name}.*")] == []
+
+
+class TestFacebookSurveyLocal:
+    @pytest.fixture
+    def survey(self, http_server: LocalHTTPServer) -> facebook.FacebookSymptomSurvey:
+        failures = {"count": 2}
+
+        def resources(query: Dict[str, List[str]]) -> Tuple[int, Dict]:
+            with http_server.lock:
+                if failures["count"] > 0:
+                    failures["count"] -= 1
+                    return 503, {}
+            start, end = query["daterange"][0].split("-")
+            dates = pd.date_range(start, end)
+            return 200, {"data": [{
+                "country": query["country"][0],
+                "region": query["region"][0],
+                "survey_date": date.strftime("%Y%m%d"),
+                "percent_cli": 0.01,
+                "cli_se": 0.001,
+            } for date in dates]}
+
+        http_server.routes["/api/resources"] = resources
+        base_url = http_server.url("api")
+        return facebook.FacebookSymptomSurvey(base_url, max_workers=4,
+                                              backoff_factor=0.01,
+                                              max_days_per_request=10)
+
+    def test_get_survey_range(self, survey: facebook.FacebookSymptomSurvey,
+                              http_server: LocalHTTPServer) -> None:
+        result = survey.get_survey_range("Brazil", "Rio Grande do Sul",
+                                         "20210101", "20210131")
+        assert len(result) == 31
+        assert result.survey_date.is_monotonic_increasing
+        assert result.survey_date.iloc[-1] == pd.Timestamp("2021-01-31")
+        assert result.percent_cli_95_upper_ci.iloc[0] == pytest.approx(1.196)
+        # Four date sub-ranges and two retries
+        assert len(http_server.requests) == 6
+
+    def test_get_survey_ranges(self, survey: facebook.FacebookSymptomSurvey) -> None:
+        result = survey.get_survey_ranges("Brazil", ["RS", "SC", "PR"],
+                                          "20210101", "20210115",
+                                          types=["daily", "smoothed"])
+        assert len(result) == 3 * 2 * 15
+        assert set(result.region) == {"RS", "SC", "PR"}
+        assert set(result["type"]) == {"daily", "smoothed"}
+        assert (result.indicator == "covid").all()
+
+    def test_cache(self, survey: facebook.FacebookSymptomSurvey,
+                   http_server: LocalHTTPServer, cache_dir: Path) -> None:
+        pytest.importorskip("pyarrow")
+        first = survey.get_survey_range("Brazil", "RS", "20210101", "20210120",
+                                        cache=True)
+        assert len(first) == 20
+        num_requests = len(http_server.requests)
+
+        # Only the new dates are requested
+        result = survey.get_survey_range("Brazil", "RS", "20210101", "20210125",
+                                         cache=True)
+        assert len(result) == 25
+        assert len(http_server.requests) == num_requests + 1
+        assert "daterange=20210121-20210125" in http_server.requests[-1]["path"]
+        assert result.survey_date.is_monotonic_increasing
+        assert result.percent_cli_95_lower_ci.notna().all()
+
+        # Everything is cached
+        result = survey.get_survey_range("Brazil", "RS", "20210105", "20210110",
+                                         cache=True)
+        assert len(result) == 6
+        assert len(http_server.requests) == num_requests + 1
+
+        result = survey.get_survey_ranges("Brazil", ["RS", "SC"],
+                                          "20210101", "20210125", cache=True)
+        assert len(result) == 50
+        assert len(http_server.requests) == num_requests + 4
+
+    def test_cache_unpublished_dates(self, survey: facebook.FacebookSymptomSurvey,
+                                     http_server: LocalHTTPServer, cache_dir: Path) -> None:
+        pytest.importorskip("pyarrow")
+        resources = http_server.routes["/api/resources"]
+        published = {"last": "20210105"}
+
+        def published_resources(query: Dict[str, List[str]]) -> Tuple[int, Dict]:
+            status, body = resources(query)
+            if status == 200:
+                body["data"] = [row for row in body["data"]
+                                if row["survey_date"] <= published["last"]]
+            return status, body
+
+        http_server.routes["/api/resources"] = published_resources
+        result = survey.get_survey_range("Brazil", "RS", "20210101", "20210108",
+                                         cache=True)
+        assert len(result) == 5
+        num_requests = len(http_server.requests)
+
+        # The dates not published in the first request are requested again
+        published["last"] = "20210108"
+        result = survey.get_survey_range("Brazil", "RS", "20210101", "20210108",
+                                         cache=True)
+        assert len(result) == 8
+        assert len(http_server.requests) == num_requests + 1
+        assert "daterange=20210106-20210108" in http_server.requests[-1]["path"]
+
+    def test_retries_exhausted(self, http_server: LocalHTTPServer) -> None:
+        http_server.routes["/api/region"] = lambda query: (500, {})
+        survey = facebook.FacebookSymptomSurvey(http_server.url("api"),
+                                                retries=1, backoff_factor=0.01)
+        with pytest.raises(requests.RequestException):
+            survey.get_survey_country_region()
+
+
+class TestSurveyResponseCache:
+    def test_missing_ranges(self, tmp_path: Path) -> None:
+        pytest.importorskip("pyarrow")
+        cache = facebook.SurveyResponseCache(tmp_path)
+        query = facebook.SurveyQuery("Brazil", "RS", "covid", "daily")
+        jan_01, jan_10 = pd.Timestamp("2021-01-01"), pd.Timestamp("2021-01-10")
+        assert cache.missing_ranges(query, jan_01, jan_10) == [(jan_01, jan_10)]
+
+        def responses(start: str, end: str) -> pd.DataFrame:
+            return pd.DataFrame({"survey_date": pd.date_range(start, end),
+                                 "percent_cli": 0.01})
+
+        cache.update(query, responses("2021-01-03", "2021-01-04"),
+                     [(pd.Timestamp("2021-01-03"), pd.Timestamp("2021-01-04"))])
+        cache.update(query, responses("2021-01-05", "2021-01-06"),
+                     [(pd.Timestamp("2021-01-05"), pd.Timestamp("2021-01-06"))])
+        assert cache.coverage(query) == [(pd.Timestamp("2021-01-03"),
+                                          pd.Timestamp("2021-01-06"))]
+        assert cache.missing_ranges(query, jan_01, jan_10) == [
+            (jan_01, pd.Timestamp("2021-01-02")),
+            (pd.Timestamp("2021-01-07"), jan_10),
+        ]
+
+        # The dates after the last survey date returned aren't covered
+        cache.update(query, responses("2021-01-07", "2021-01-08"),
+                     [(pd.Timestamp("2021-01-07"), jan_10)])
+        cache.update(query, pd.DataFrame(), [(pd.Timestamp("2021-01-09"), jan_10)])
+        assert cache.missing_ranges(query, jan_01, jan_10) == [
+            (jan_01, pd.Timestamp("2021-01-02")),
+            (pd.Timestamp("2021-01-09"), jan_10),
+        ]
+        assert not list(tmp_path.glob("*.part"))
+
+
+class TestMobilityCube:
+    @pytest.fixture
+    def df(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "country": ["BR", "BR", "BR", "US", "US"],
+            "region": ["RS", "RS", None, "NY", "NY"],
+            "date": pd.to_datetime(["2021-01-01", "2021-01-03", "2021-01-02",
+                                    "2021-01-02", "2021-01-01"]),
+            "a": [1.0, 3.0, 2.0, 5.0, 4.0],
+            "b": [0.1, 0.3, 0.2, 0.5, np.nan],
+        })
+
+    def test_from_dataframe(self, df: pd.DataFrame) -> None:
+        cube = MobilityCube.from_dataframe(df, ["country", "region"],
+                                           "date", ["a", "b"])
+        assert cube.values.shape == (3, 3, 2)
+        assert list(cube.regions) == ["BR|RS", "BR", "US|NY"]
+        assert list(cube.dates) == list(pd.date_range("2021-01-01", periods=3))
+        np.testing.assert_array_equal(cube.region_values("BR|RS")[:, 0], [1.0, np.nan, 3.0])
+        np.testing.assert_array_equal(cube.region_values("US|NY")[:, 0], [4.0, 5.0, np.nan])
+        assert np.isnan(cube.region_series("US|NY").b.iloc[0])
+        assert np.shares_memory(cube.region_values("BR"), cube.values)
+        with pytest.raises(KeyError):
+            cube.region_code("AR")
+
+    def test_save_load(self, df: pd.DataFrame, tmp_path: Path) -> None:
+        cube = MobilityCube.from_dataframe(df, ["country"], "date", ["a", "b"],
+                                           categories=["x", "y"])
+        source = tmp_path / "source.csv"
+        source.write_text("source")
+        cube_dir = cube.save(tmp_path / "cube", source=source)
+        assert data.is_source_signature_valid(cube_dir, source)
+
+        loaded = MobilityCube.load(cube_dir)
+        assert isinstance(loaded.values, np.memmap)
+        assert list(loaded.regions) == ["BR", "US"]
+        assert loaded.categories == ["x", "y"]
+        assert loaded.start_date == pd.Timestamp("2021-01-01")
+        np.testing.assert_array_equal(loaded.values, cube.values)
+
+        in_memory = MobilityCube.load(cube_dir, mmap=False)
+        assert not isinstance(in_memory.values, np.memmap)
@@ -1,3 +1,6 @@
+from pathlib import Path
+
+import numpy as np
 import numpyro
 import pytest
 
@@ -53,3 +56,50 @@ class TestApparentPrevalenceModel:
         samples = mcmc.get_samples()
         true_p = samples["true_p"].mean()
         assert true_p == pytest.approx(0.5, rel=0.1)
+
+
+class TestApparentPrevalenceTable:
+    @pytest.fixture(scope="class")
+    def table(self) -> prevalence.ApparentPrevalenceTable:
+        return prevalence.ApparentPrevalenceTable.build(
+            x_se=100, n_se=100, x_sp=100, n_sp=100,
+            obs_totals=[500, 1000], proportions=[0.25, 0.5],
+            num_warmup=100, num_samples=500, seed=42)
+
+    def test_query_grid_point(self, table: prevalence.ApparentPrevalenceTable) -> None:
+        df = table.query(500, 1000)
+        assert len(df) == 1
+        assert df.mean_val[0] == pytest.approx(0.5, rel=0.1)
+        assert df.lb95[0] < df.mean_val[0] < df.ub95[0]
+
+    def test_query_interpolation(self, table: prevalence.ApparentPrevalenceTable) -> None:
+        df = table.query([150, 240, 300], [600, 800, 800])
+        assert len(df) == 3
+        assert df.mean_val.is_monotonic_increasing
+        assert df.mean_val[2] == pytest.approx(0.375, rel=0.1)
+
+    def test_query_out_of_range(self, table: prevalence.ApparentPrevalenceTable) -> None:
+        with pytest.raises(ValueError, match="outside"):
+            table.query(10, 100)
+
+    def test_realized_proportions(self) -> None:
+        # The summaries are the realized proportion of each grid point, so
+        # an unbiased interpolation answers the proportion of the query
+        obs_totals = np.array([10, 20])
+        proportions = np.array([0.0, 0.01, 0.26, 1.0])
+        positives = prevalence.ApparentPrevalenceTable.realized_positives(obs_totals, proportions)
+        np.testing.assert_array_equal(positives, [[0, 0, 3, 10], [0, 0, 5, 20]])
+        summaries = np.repeat((positives / obs_totals[:, np.newaxis])[..., np.newaxis],
+                              len(prevalence.ApparentPrevalenceTable.STATISTICS), axis=-1)
+        table = prevalence.ApparentPrevalenceTable(np.ones(4), obs_totals, proportions, summaries)
+        df = table.query([0, 2, 3, 5, 6, 10], [10, 10, 10, 20, 15, 10])
+        np.testing.assert_allclose(df.mean_val, [0.0, 0.2, 0.3, 0.25, 0.4, 1.0])
+
+    @pytest.mark.parametrize("filename", ["table.npz", "table"])
+    def test_save_load(self, table: prevalence.ApparentPrevalenceTable,
+                       tmp_path: Path, filename: str) -> None:
+        fname = tmp_path / filename
+        table.save(fname)
+        loaded = prevalence.ApparentPrevalenceTable.load(fname)
+        np.testing.assert_array_equal(loaded.summaries, table.summaries)
+        np.testing.assert_array_equal(loaded.assay, table.assay)